@@ -1,27 +1,407 @@
 """
 This script generates a template that deploys an ECS cluster
-to the provided VPC and subnets using an Auto Scaling Group
+to the provided VPC and subnets using an Auto Scaling Group.
+The Auto Scaling Group can optionally scale between a minimum
+and maximum size on the CPU and memory reserved by the cluster,
+or launch a mix of Spot and On-Demand instances from a launch
+template as a capacity provider scaled by ECS itself. Hosts are
+replaced in configurable rolling batches or all at once, and can
+be launched from a warm pool of pre-initialized instances.
+Hosts either bootstrap the CloudFormation helper scripts at boot
+or boot from a pre-baked AMI that already has them, and the ECS
+agent and kernel of the hosts can be tuned.
 """
-from troposphere import Base64, FindInMap, Join, Output
-from troposphere import Parameter, Ref, Sub, Template
-from troposphere.cloudformation import Init, InitConfig, InitFiles, InitFile
-from troposphere.cloudformation import InitServices, InitService
-from troposphere.autoscaling import LaunchConfiguration
-from troposphere.iam import Policy, Role
-from troposphere.ecs import Cluster
-from troposphere.autoscaling import AutoScalingGroup, Metadata
-from troposphere.autoscaling import Tags as ASTags
-from troposphere.policies import AutoScalingRollingUpdate, CreationPolicy
-from troposphere.policies import ResourceSignal, UpdatePolicy
-from troposphere.iam import InstanceProfile
-import awacs
-import awacs.aws
+import argparse
+import json
+import math
+import re
+
+from host_tuning import SYSCTL_FILE, HostTuning
+from instance_types import INSTANCE_FAMILIES, common_architecture, family_instance_types
+from output import add_output_arguments, write_from_arguments
+from wiring import add_input, add_output
+
+# target-tracking keeps the reservation of each metric close to the target,
+# step scales out when a metric exceeds the target and in when both are low
+SCALING_MODES = ('target-tracking', 'step')
+
+# AWS/ECS cluster metrics the Auto Scaling Group scales on
+SCALING_METRICS = ('CPUReservation', 'MemoryReservation')
+
+# Step scaling adds this many more hosts once a metric exceeds the target by this much
+STEP_SCALING_BURST = (2, 15)
+
+# Instance types a capacity provider's Auto Scaling Group launches, in order of preference
+MIXED_INSTANCE_TYPES = ('t3.medium', 't3a.medium', 't2.medium')
+
+# Architecture -> public SSM parameter holding the current ECS-optimized AMI
+ECS_AMI_PARAMETERS = {
+    'x86_64': '/aws/service/ecs/optimized-ami/amazon-linux-2023/recommended/image_id',
+    'arm64': '/aws/service/ecs/optimized-ami/amazon-linux-2023/arm64/recommended/image_id',
+}
+
+# rolling replaces the hosts a batch at a time, replacing creates a whole new
+# Auto Scaling Group and deletes the old one once the new hosts have signalled
+UPDATE_MODES = ('rolling', 'replacing')
+
+WARM_POOL_STATES = ('Stopped', 'Hibernated', 'Running')
+
+# bootstrap installs the CloudFormation helper scripts and configures the
+# ECS agent with cfn-init, prebaked expects the helper scripts on the AMI
+# and configures the agent directly from UserData
+BOOT_MODES = ('bootstrap', 'prebaked')
+
+# The ECS agent's introspection endpoint, which knows the container
+# instance ARN once the host has registered with the cluster
+AGENT_METADATA_URL = 'http://localhost:51678/v1/metadata'
+
+# Seconds pre-baked hosts wait for the ECS agent to register before signalling failure
+REGISTRATION_TIMEOUT = 600
+
+ISO8601_DURATION = re.compile(r'^PT(?=\d)(\d+H)?(\d+M)?(\d+S)?$')
+
+SPOT_ALLOCATION_STRATEGIES = (
+    'capacity-optimized', 'capacity-optimized-prioritized', 'lowest-price',
+    'price-capacity-optimized',
+)
+
+
+def add_scaling_policies(template, auto_scaling_group, cluster, mode,
+                         target_reservation=75, scale_in_reservation=40):
+    """Adds the policies (and for step scaling the alarms) scaling the hosts
+
+    Reservations are percentages of the cluster's registered CPU and memory
+    that are reserved by running tasks.
+    """
+    from troposphere import Ref
+    from troposphere.autoscaling import CustomizedMetricSpecification, MetricDimension
+    from troposphere.autoscaling import ScalingPolicy, StepAdjustments
+    from troposphere.autoscaling import TargetTrackingConfiguration
+    from troposphere.cloudwatch import Alarm, MetricDimension as AlarmDimension
+    from troposphere.cloudwatch import Metric, MetricDataQuery, MetricStat
+
+    if mode not in SCALING_MODES:
+        raise ValueError('unknown scaling mode %r, expected one of %s' % (
+            mode, ', '.join(SCALING_MODES)))
+    if not 0 < scale_in_reservation < target_reservation <= 100:
+        raise ValueError('reservations must satisfy 0 < scale in (%s) < target (%s) <= 100' % (
+            scale_in_reservation, target_reservation))
+
+    if mode == 'target-tracking':
+        # The Auto Scaling Group scales out when either policy asks it to
+        # and only scales in when both do
+        for metric in SCALING_METRICS:
+            template.add_resource(ScalingPolicy(
+                '%sScalingPolicy' % metric,
+                AutoScalingGroupName=Ref(auto_scaling_group),
+                PolicyType='TargetTrackingScaling',
+                TargetTrackingConfiguration=TargetTrackingConfiguration(
+                    CustomizedMetricSpecification=CustomizedMetricSpecification(
+                        Namespace='AWS/ECS',
+                        MetricName=metric,
+                        Dimensions=[MetricDimension(Name='ClusterName', Value=Ref(cluster))],
+                        Statistic='Average',
+                    ),
+                    TargetValue=float(target_reservation),
+                ),
+            ))
+        return
+
+    burst_hosts, burst_over = STEP_SCALING_BURST
+    # ScaleOutPolicy
+    scale_out_policy = template.add_resource(ScalingPolicy(
+        'ScaleOutPolicy',
+        AutoScalingGroupName=Ref(auto_scaling_group),
+        PolicyType='StepScaling',
+        AdjustmentType='ChangeInCapacity',
+        MetricAggregationType='Maximum',
+        StepAdjustments=[
+            StepAdjustments(MetricIntervalLowerBound=0, MetricIntervalUpperBound=burst_over,
+                            ScalingAdjustment=1),
+            StepAdjustments(MetricIntervalLowerBound=burst_over,
+                            ScalingAdjustment=burst_hosts),
+        ],
+    ))
+    # ScaleInPolicy
+    scale_in_policy = template.add_resource(ScalingPolicy(
+        'ScaleInPolicy',
+        AutoScalingGroupName=Ref(auto_scaling_group),
+        PolicyType='StepScaling',
+        AdjustmentType='ChangeInCapacity',
+        MetricAggregationType='Maximum',
+        StepAdjustments=[StepAdjustments(MetricIntervalUpperBound=0, ScalingAdjustment=-1)],
+    ))
+
+    dimensions = [AlarmDimension(Name='ClusterName', Value=Ref(cluster))]
+    for metric in SCALING_METRICS:
+        # CPUReservationHighAlarm, MemoryReservationHighAlarm
+        template.add_resource(Alarm(
+            '%sHighAlarm' % metric,
+            AlarmDescription='Scale out when the cluster %s exceeds %s%%' % (
+                metric, target_reservation),
+            Namespace='AWS/ECS',
+            MetricName=metric,
+            Dimensions=dimensions,
+            Statistic='Maximum',
+            Period=60,
+            EvaluationPeriods=3,
+            Threshold=target_reservation,
+            ComparisonOperator='GreaterThanThreshold',
+            AlarmActions=[Ref(scale_out_policy)],
+        ))
+    # ReservationLowAlarm, only scales in once neither CPU nor memory is in demand
+    metrics = [
+        MetricDataQuery(
+            Id=metric.lower(),
+            MetricStat=MetricStat(
+                Metric=Metric(Namespace='AWS/ECS', MetricName=metric, Dimensions=dimensions),
+                Period=60,
+                Stat='Maximum',
+            ),
+            ReturnData=False,
+        ) for metric in SCALING_METRICS
+    ]
+    metrics.append(MetricDataQuery(
+        Id='reservation',
+        Expression='MAX([%s])' % ', '.join(metric.lower() for metric in SCALING_METRICS),
+        Label='Highest reservation',
+        ReturnData=True,
+    ))
+    template.add_resource(Alarm(
+        'ReservationLowAlarm',
+        AlarmDescription='Scale in when the cluster CPU and memory reservations are both '
+                         'below %s%%' % scale_in_reservation,
+        Metrics=metrics,
+        EvaluationPeriods=15,
+        Threshold=scale_in_reservation,
+        ComparisonOperator='LessThanThreshold',
+        AlarmActions=[Ref(scale_in_policy)],
+    ))
+
+
+def is_percentage(value):
+    """Checks whether a host count is given as a percentage such as '25%'"""
+    return isinstance(value, str) and value.endswith('%')
+
+
+def host_count(value, cluster_size, round_up=True):
+    """Returns a number of hosts given as a number or as a percentage of cluster_size
+
+    Percentages are rounded up by default, and down with round_up=False.
+    """
+    if is_percentage(value):
+        hosts = float(value[:-1]) * cluster_size / 100
+        return int(math.ceil(hosts) if round_up else math.floor(hosts))
+    return int(value)
+
+
+def user_data_script(boot_mode, launch_resource, ecs_config=(), cfn_init=True,
+                     sysctl_conf=None):
+    """Returns the UserData script booting a host, as the parts of a Fn::Join
+
+    bootstrap installs the CloudFormation helper scripts and runs cfn-init
+    before signalling the ECSAutoScalingGroup. prebaked appends the
+    ecs_config (name, value) pairs to /etc/ecs/ecs.config itself, applies
+    the kernel parameters of sysctl_conf, runs cfn-init only with cfn_init,
+    and signals once the ECS agent has registered the host with the cluster.
+    """
+    from troposphere import Ref
+
+    cfn_init_command = [
+        '/opt/aws/bin/cfn-init -v --region ', Ref('AWS::Region'),
+        ' --stack ', Ref('AWS::StackName'), ' --resource %s\n' % launch_resource,
+    ]
+    signal_command = [
+        '/opt/aws/bin/cfn-signal -e $? --region ', Ref('AWS::Region'),
+        ' --stack ', Ref('AWS::StackName'), ' --resource ECSAutoScalingGroup\n',
+    ]
+    if boot_mode == 'bootstrap':
+        return (['#!/bin/bash\n', 'yum install -y aws-cfn-bootstrap\n'] +
+                cfn_init_command + signal_command)
+    if boot_mode != 'prebaked':
+        raise ValueError('unknown boot mode %r, expected one of %s' % (
+            boot_mode, ', '.join(BOOT_MODES)))
+
+    parts = ['#!/bin/bash\n', "cat >> /etc/ecs/ecs.config <<'EOF'\n"]
+    for name, value in ecs_config:
+        parts.extend([name + '=', value, '\n'])
+    parts.append('EOF\n')
+    if sysctl_conf:
+        parts.append("cat > %s <<'EOF'\n%sEOF\n" % (SYSCTL_FILE, sysctl_conf))
+        parts.append('sysctl -e -p %s\n' % SYSCTL_FILE)
+    wait_command = "timeout %d sh -c 'until curl -sf %s | grep -q ContainerInstanceArn; " \
+                   "do sleep 2; done'\n" % (REGISTRATION_TIMEOUT, AGENT_METADATA_URL)
+    if cfn_init:
+        parts.extend(cfn_init_command)
+        parts.append('init_status=$?\n')
+        wait_command = '[ $init_status -eq 0 ] && ' + wait_command
+    # The agent only starts once UserData has finished, so wait for it in the background
+    parts.append('(\n')
+    parts.append(wait_command)
+    parts.extend(signal_command)
+    parts.append(') >> /var/log/ecs-registration.log 2>&1 &\n')
+    return parts
+
+
+def add_capacity_provider(template, auto_scaling_group, cluster, target_capacity=100):
+    """Adds a capacity provider for the hosts and makes it the cluster's default
+
+    ECS scales the Auto Scaling Group to keep the hosts target_capacity
+    percent utilized by the tasks placed on them, and protects hosts that
+    still run tasks from scaling in.
+    """
+    from troposphere import Ref
+    from troposphere.ecs import AutoScalingGroupProvider, CapacityProvider
+    from troposphere.ecs import CapacityProviderStrategy, ClusterCapacityProviderAssociations
+    from troposphere.ecs import ManagedScaling
+
+    if not 1 <= target_capacity <= 100:
+        raise ValueError('target_capacity must be between 1 and 100, got %s' % target_capacity)
+
+    # ECSCapacityProvider
+    capacity_provider = template.add_resource(CapacityProvider(
+        'ECSCapacityProvider',
+        AutoScalingGroupProvider=AutoScalingGroupProvider(
+            AutoScalingGroupArn=Ref(auto_scaling_group),
+            ManagedScaling=ManagedScaling(
+                Status='ENABLED',
+                TargetCapacity=target_capacity,
+                MinimumScalingStepSize=1,
+                MaximumScalingStepSize=10,
+            ),
+            ManagedTerminationProtection='ENABLED',
+        ),
+    ))
+    # ECSClusterCapacityProviderAssociations
+    template.add_resource(ClusterCapacityProviderAssociations(
+        'ECSClusterCapacityProviderAssociations',
+        Cluster=Ref(cluster),
+        CapacityProviders=[Ref(capacity_provider)],
+        DefaultCapacityProviderStrategy=[
+            CapacityProviderStrategy(CapacityProvider=Ref(capacity_provider), Weight=1),
+        ],
+    ))
+    return capacity_provider
+
+
+def build_template(exports=False, instance_family='t2',
+                   scaling=None, target_reservation=75, scale_in_reservation=40,
+                   capacity_provider=False, instance_types=MIXED_INSTANCE_TYPES,
+                   on_demand_base=1, on_demand_percentage=0,
+                   spot_allocation_strategy='price-capacity-optimized', target_capacity=100,
+                   cluster_size=None, update_mode='rolling', update_batch_size=1,
+                   min_in_service=1, update_pause='PT15M',
+                   warm_pool=False, warm_pool_min_size=0, warm_pool_state='Stopped',
+                   boot_mode='bootstrap', cfn_init=None, host_tuning=None):
+    """Generates the CloudFormation template
+
+    The InstanceType parameter offers the sizes of instance_family, and the
+    hosts boot from the latest ECS-optimized AMI for its architecture.
+    Without scaling the cluster is fixed at ClusterSize hosts, otherwise it
+    starts at MinClusterSize and scales between MinClusterSize and
+    MaxClusterSize using one of SCALING_MODES, which stack updates leave
+    alone.
+
+    With capacity_provider the hosts are launched from a launch template as
+    a mix of instance_types. The first on_demand_base hosts, and
+    on_demand_percentage percent of the rest, are On-Demand and the others
+    Spot. ECS scales them between MinClusterSize and MaxClusterSize to keep
+    them target_capacity percent utilized.
+
+    cluster_size is the default ClusterSize without scaling, 1 when not given. Updates replace
+    update_batch_size hosts at a time, keeping min_in_service in service, and
+    wait up to update_pause for each batch to signal. Both counts may also be
+    given as percentages of cluster_size, e.g. '25%', which need cluster_size
+    to be given: they are resolved when the template is generated, so
+    ClusterSize is then restricted to cluster_size. With update_mode 'replacing'
+    updates launch a complete new set of hosts at once instead. With
+    warm_pool the group keeps at least warm_pool_min_size pre-initialized
+    instances in warm_pool_state to scale out and replace hosts from.
+
+    boot_mode is one of BOOT_MODES. Pre-baked hosts only run cfn-init, and
+    cfn-hup, with cfn_init.
+
+    host_tuning, a HostTuning or a dict of its fields, configures the ECS
+    agent and kernel of the hosts.
+    """
+    from troposphere import Base64, GetAtt, Join, Output
+    from troposphere import Parameter, Ref, Sub, Template
+    from troposphere.cloudformation import Init, InitConfig, InitFiles, InitFile
+    from troposphere.cloudformation import InitServices, InitService
+    from troposphere.autoscaling import InstancesDistribution, LaunchConfiguration
+    from troposphere.autoscaling import LaunchTemplate as ASLaunchTemplate
+    from troposphere.autoscaling import LaunchTemplateOverrides, LaunchTemplateSpecification
+    from troposphere.autoscaling import InstanceReusePolicy, MixedInstancesPolicy, WarmPool
+    from troposphere.ec2 import IamInstanceProfile, LaunchTemplate, LaunchTemplateData
+    from troposphere.iam import Policy, Role
+    from troposphere.ecs import Cluster
+    from troposphere.autoscaling import AutoScalingGroup, Metadata
+    from troposphere.autoscaling import Tags as ASTags
+    from troposphere.policies import AutoScalingCreationPolicy, AutoScalingReplacingUpdate
+    from troposphere.policies import AutoScalingRollingUpdate, CreationPolicy
+    from troposphere.policies import ResourceSignal, UpdatePolicy
+    from troposphere.iam import InstanceProfile
+    import awacs
+    import awacs.aws
+
+    if capacity_provider:
+        if scaling:
+            raise ValueError('a capacity provider scales the hosts itself, scaling policies '
+                             'cannot be added to it')
+        if not instance_types:
+            raise ValueError('a capacity provider needs at least one instance type')
+        if spot_allocation_strategy not in SPOT_ALLOCATION_STRATEGIES:
+            raise ValueError('unknown Spot allocation strategy %r, expected one of %s' % (
+                spot_allocation_strategy, ', '.join(SPOT_ALLOCATION_STRATEGIES)))
+        if not 0 <= on_demand_percentage <= 100:
+            raise ValueError('on_demand_percentage must be between 0 and 100, got %s' % (
+                on_demand_percentage,))
+        architecture = common_architecture(instance_types)
+    else:
+        family_types = family_instance_types(instance_family)
+        architecture = common_architecture(family_types)
+    launch_resource = 'ECSLaunchTemplate' if capacity_provider else 'ECSLaunchConfiguration'
+
+    if update_mode not in UPDATE_MODES:
+        raise ValueError('unknown update mode %r, expected one of %s' % (
+            update_mode, ', '.join(UPDATE_MODES)))
+    percentages = [name for name, value in (('update_batch_size', update_batch_size),
+                                            ('min_in_service', min_in_service))
+                   if is_percentage(value)]
+    if percentages and cluster_size is None:
+        raise ValueError('%s given as a percentage needs cluster_size, as percentages are '
+                         'resolved when the template is generated' % ' and '.join(percentages))
+    if cluster_size is None:
+        cluster_size = 1
+    batch_size = host_count(update_batch_size, cluster_size)
+    hosts_in_service = host_count(min_in_service, cluster_size, round_up=False)
+    if batch_size < 1:
+        raise ValueError('update_batch_size must be at least one host, got %r' % (
+            update_batch_size,))
+    if hosts_in_service < 0:
+        raise ValueError('min_in_service cannot be negative, got %r' % (min_in_service,))
+    if not ISO8601_DURATION.match(update_pause):
+        raise ValueError('update_pause must be an ISO 8601 duration such as PT5M, got %r' % (
+            update_pause,))
+    host_tuning = HostTuning.from_options(host_tuning)
+    if boot_mode not in BOOT_MODES:
+        raise ValueError('unknown boot mode %r, expected one of %s' % (
+            boot_mode, ', '.join(BOOT_MODES)))
+    if cfn_init is None:
+        cfn_init = boot_mode == 'bootstrap'
+    elif boot_mode == 'bootstrap' and not cfn_init:
+        raise ValueError('bootstrapped hosts configure the ECS agent with cfn-init')
+    if warm_pool:
+        if capacity_provider:
+            raise ValueError('warm pools cannot be added to the mixed instances of a '
+                             'capacity provider')
+        if warm_pool_state not in WARM_POOL_STATES:
+            raise ValueError('unknown warm pool state %r, expected one of %s' % (
+                warm_pool_state, ', '.join(WARM_POOL_STATES)))
 
-def main():
-    """Generates the CloudFormation template"""
     template = Template()
-    template.add_version('2010-09-09')
-    template.add_description(
+    template.set_version('2010-09-09')
+    template.set_description(
         'This template deploys an ECS cluster to the ' +
         'provided VPC and subnets using an Auto Scaling Group')
 
@@ -33,64 +413,72 @@ def main():
         Description='An environment name that will be prefixed to resource names',
     ))
 
-    # InstanceType
-    instance_type_param = template.add_parameter(Parameter(
-        'InstanceType',
-        Type='String',
-        Default='t2.nano',
-        Description='Which instance type should we use to build the ECS cluster?',
-        AllowedValues=[
-            't2.nano', 't2.micro', 't2.small', 't2.medium', 't2.large', 't2.xlarge', 't2.2xlarge',
-        ],
-    ))
+    if not capacity_provider:
+        # InstanceType
+        instance_type_param = template.add_parameter(Parameter(
+            'InstanceType',
+            Type='String',
+            Default=family_types[0],
+            Description='Which instance type should we use to build the ECS cluster?',
+            AllowedValues=family_types,
+        ))
 
-    # ClusterSize
-    cluster_size_param = template.add_parameter(Parameter(
-        'ClusterSize',
-        Type='Number',
-        Description='How many ECS hosts do you want to initially deploy?',
-        Default='1',
-    ))
+    if scaling or capacity_provider:
+        # MinClusterSize
+        min_size_param = template.add_parameter(Parameter(
+            'MinClusterSize',
+            Type='Number',
+            Description='The fewest ECS hosts the cluster scales in to',
+            Default='1',
+        ))
+
+        # MaxClusterSize
+        max_size_param = template.add_parameter(Parameter(
+            'MaxClusterSize',
+            Type='Number',
+            Description='The most ECS hosts the cluster scales out to',
+            Default='4',
+        ))
+    else:
+        # ClusterSize, fixed when the update counts were resolved against it
+        cluster_size_param = template.add_parameter(Parameter(
+            'ClusterSize',
+            Type='Number',
+            Description='How many ECS hosts do you want to initially deploy?',
+            Default=str(cluster_size),
+            **({'AllowedValues': [str(cluster_size)]} if percentages else {})
+        ))
+        min_size_param = max_size_param = cluster_size_param
 
     # VPC
-    template.add_parameter(Parameter(
+    add_input(template, 'ECSCluster', Parameter(
         'VPC',
         Type='AWS::EC2::VPC::Id',
         Description='Choose which VPC this ECS cluster should be deployed to',
-    ))
+    ), exports)
 
     # Subnets
-    subnets_param = template.add_parameter(Parameter(
+    subnets = add_input(template, 'ECSCluster', Parameter(
         'Subnets',
         Type='List<AWS::EC2::Subnet::Id>',
         Description='Choose which subnets this ECS cluster should be deployed to',
-    ))
+    ), exports)
 
     # SecurityGroup
-    sg_param = template.add_parameter(Parameter(
+    security_group = add_input(template, 'ECSCluster', Parameter(
         'SecurityGroup',
         Type='AWS::EC2::SecurityGroup::Id',
         Description='Select the Security Group to use for the ECS cluster hosts',
-    ))
+    ), exports)
 
-    # Mappings
-    # AWSRegionToAMI
-    template.add_mapping(
-        'AWSRegionToAMI',
-        {
-            'us-east-1' : {'AMI': 'ami-a58760b3'},
-            'us-east-2' : {'AMI': 'ami-a6e4bec3'},
-            'us-west-1' : {'AMI': 'ami-74cb9b14'},
-            'us-west-2' : {'AMI': 'ami-5b6dde3b'},
-            'eu-west-1' : {'AMI': 'ami-e3fbd290'},
-            'eu-west-2' : {'AMI': 'ami-77f6fc13'},
-            'eu-central-1' : {'AMI': 'ami-38dc1157'},
-            'ap-northeast-1' : {'AMI': 'ami-30bdce57'},
-            'ap-southeast-1' : {'AMI': 'ami-9f75ddfc'},
-            'ap-southeast-2' : {'AMI': 'ami-cf393cac'},
-            'ca-central-1' : {'AMI': 'ami-1b01b37f'},
-        },
-    )
+    # ECSAMI
+    ami_param = template.add_parameter(Parameter(
+        'ECSAMI',
+        Type='AWS::SSM::Parameter::Value<AWS::EC2::Image::Id>',
+        Default=ECS_AMI_PARAMETERS[architecture],
+        Description='The SSM parameter holding the ECS-optimized AMI the %s hosts boot from' % (
+            architecture),
+    ))
 
     # Resources
     ecs_role = template.add_resource(Role(
@@ -147,19 +535,51 @@ def main():
         ClusterName=Ref(env_name_param),
     ))
 
+    ecs_config = [('ECS_CLUSTER', Ref(ecs_cluster))]
+    if warm_pool:
+        # Keeps instances from registering with the cluster while they are warmed
+        ecs_config.append(('ECS_WARM_POOLS_CHECK', 'true'))
+
+    commands = {
+        '01_add_instance_to_cluster': {
+            'command': Join(
+                '',
+                ['#!/bin/bash\n',
+                 'echo ECS_CLUSTER=', Ref(ecs_cluster),
+                 ' >> /etc/ecs/ecs.config'])
+        },
+    }
+    if warm_pool:
+        commands['02_check_warm_pool'] = {
+            'command': 'echo ECS_WARM_POOLS_CHECK=true >> /etc/ecs/ecs.config',
+        }
+    init_files = {}
+    if host_tuning:
+        ecs_config.extend(host_tuning.ecs_config())
+        commands['03_tune_agent'] = {
+            'command': "cat >> /etc/ecs/ecs.config <<'EOF'\n%sEOF\n" % ''.join(
+                '%s=%s\n' % setting for setting in host_tuning.ecs_config()),
+        }
+        init_files[SYSCTL_FILE] = InitFile(
+            mode='000644',
+            owner='root',
+            group='root',
+            content=host_tuning.sysctl_conf(),
+        )
+        commands['04_apply_kernel_parameters'] = {
+            'command': 'sysctl -e -p %s' % SYSCTL_FILE,
+        }
+
+    # Pre-baked hosts have already configured the agent and kernel from UserData
+    if boot_mode == 'bootstrap':
+        init_commands = dict(commands=commands)
+    else:
+        init_commands, init_files = {}, {}
+
     instance_metadata = Metadata(
         Init({
             'config': InitConfig(
-                commands={
-                    '01_add_instance_to_cluster': {
-                        'command': Join(
-                            '',
-                            ['#!/bin/bash\n',
-                             'echo ECS_CLUSTER=', Ref(ecs_cluster),
-                             ' >> /etc/ecs/ecs.config'])
-                    },
-                },
-                files=InitFiles({
+                files=InitFiles(dict(init_files, **{
                     '/etc/cfn/cfn-hup.conf': InitFile(
                         mode='000400',
                         owner='root',
@@ -178,12 +598,13 @@ def main():
                         content=Join('', [
                             '[cfn-auto-reloader-hook]\n',
                             'triggers=post.update\n',
-                            'path=Resources.ContainerInstances.Metadata.AWS::CloudFormation::Init\n'
+                            'path=Resources.%s.Metadata.AWS::CloudFormation::Init\n' % (
+                                launch_resource),
                             'action=/opt/aws/bin/cfn-init -v --region ', Ref('AWS::Region'),
                             ' --stack ', Ref('AWS::StackId'),
-                            ' --resource ECSLaunchConfiguration\n']),
+                            ' --resource %s\n' % launch_resource]),
                     )
-                }),
+                })),
                 services=InitServices({
                     'cfn-hup': InitService(
                         enabled='true',
@@ -193,58 +614,229 @@ def main():
                             '/etc/cfn/hooks.d/cfn-auto-reloader.conf']
                     )
                 }),
+                **init_commands
             )
         })
     )
+    launch_metadata = dict(Metadata=instance_metadata) if cfn_init else {}
 
-    ecs_launch_config = template.add_resource(LaunchConfiguration(
-        'ECSLaunchConfiguration',
-        ImageId=FindInMap('AWSRegionToAMI', Ref('AWS::Region'), 'AMI'),
-        InstanceType=Ref(instance_type_param),
-        SecurityGroups=[Ref(sg_param)],
-        IamInstanceProfile=Ref(ecs_instance_profile),
-        UserData=Base64(Join('', [
-            '#!/bin/bash\n',
-            'yum install -y aws-cfn-bootstrap\n',
-            '/opt/aws/bin/cfn-init -v --region ', Ref('AWS::Region'),
-            ' --stack ', Ref('AWS::StackName'), ' --resource ECSLaunchConfiguration\n',
-            '/opt/aws/bin/cfn-signal -e $? --region ', Ref('AWS::Region'),
-            ' --stack ', Ref('AWS::StackName'), ' --resource ECSAutoScalingGroup\n',
-        ])),
-        Metadata=instance_metadata,
-    ))
+    user_data = Base64(Join('', user_data_script(
+        boot_mode, launch_resource, ecs_config=ecs_config, cfn_init=cfn_init,
+        sysctl_conf=host_tuning.sysctl_conf() if host_tuning else None)))
 
-    # ECSAutoScalingGroup:
-    template.add_resource(AutoScalingGroup(
-        'ECSAutoScalingGroup',
-        VPCZoneIdentifier=Ref(subnets_param),
-        LaunchConfigurationName=Ref(ecs_launch_config),
-        MinSize=Ref(cluster_size_param),
-        MaxSize=Ref(cluster_size_param),
-        DesiredCapacity=Ref(cluster_size_param),
-        Tags=ASTags(Name=(Sub('${EnvironmentName} ECS host'), True)),
-        CreationPolicy=CreationPolicy(
+    if capacity_provider:
+        # ECSLaunchTemplate
+        ecs_launch_template = template.add_resource(LaunchTemplate(
+            'ECSLaunchTemplate',
+            LaunchTemplateData=LaunchTemplateData(
+                ImageId=Ref(ami_param),
+                SecurityGroupIds=[security_group],
+                IamInstanceProfile=IamInstanceProfile(Arn=GetAtt(ecs_instance_profile, 'Arn')),
+                UserData=user_data,
+            ),
+            **launch_metadata
+        ))
+        launch_options = dict(
+            MixedInstancesPolicy=MixedInstancesPolicy(
+                InstancesDistribution=InstancesDistribution(
+                    OnDemandBaseCapacity=on_demand_base,
+                    OnDemandPercentageAboveBaseCapacity=on_demand_percentage,
+                    OnDemandAllocationStrategy='prioritized',
+                    SpotAllocationStrategy=spot_allocation_strategy,
+                ),
+                LaunchTemplate=ASLaunchTemplate(
+                    LaunchTemplateSpecification=LaunchTemplateSpecification(
+                        LaunchTemplateId=Ref(ecs_launch_template),
+                        Version=GetAtt(ecs_launch_template, 'LatestVersionNumber'),
+                    ),
+                    Overrides=[LaunchTemplateOverrides(InstanceType=instance_type)
+                               for instance_type in instance_types],
+                ),
+            ),
+            # Managed termination protection only scales in hosts without tasks
+            NewInstancesProtectedFromScaleIn=True,
+            # No DesiredCapacity, updates would reset the hosts ECS scaled out to
+        )
+    else:
+        ecs_launch_config = template.add_resource(LaunchConfiguration(
+            'ECSLaunchConfiguration',
+            ImageId=Ref(ami_param),
+            InstanceType=Ref(instance_type_param),
+            SecurityGroups=[security_group],
+            IamInstanceProfile=Ref(ecs_instance_profile),
+            UserData=user_data,
+            **launch_metadata
+        ))
+        launch_options = dict(LaunchConfigurationName=Ref(ecs_launch_config))
+        if not scaling:
+            launch_options['DesiredCapacity'] = Ref(cluster_size_param)
+        # Otherwise no DesiredCapacity, updates would reset the hosts scaled out to
+
+    if update_mode == 'replacing':
+        # The new group is only kept once all of its initial hosts have signalled
+        creation_policy = CreationPolicy(
+            AutoScalingCreationPolicy=AutoScalingCreationPolicy(
+                MinSuccessfulInstancesPercent=100,
+            ),
+            ResourceSignal=ResourceSignal(
+                Count=Ref(min_size_param),
+                Timeout=update_pause,
+            ),
+        )
+        update_policy = UpdatePolicy(
+            AutoScalingReplacingUpdate=AutoScalingReplacingUpdate(
+                WillReplace=True,
+            )
+        )
+    else:
+        creation_policy = CreationPolicy(
             ResourceSignal=ResourceSignal(
                 Timeout='PT15M'
             ),
-        ),
-        UpdatePolicy=UpdatePolicy(
+        )
+        update_policy = UpdatePolicy(
             AutoScalingRollingUpdate=AutoScalingRollingUpdate(
-                MinInstancesInService='1',
-                MaxBatchSize='1',
-                PauseTime='PT15M',
+                MinInstancesInService=str(hosts_in_service),
+                MaxBatchSize=str(batch_size),
+                PauseTime=update_pause,
                 WaitOnResourceSignals=True,
             )
-        ),
+        )
+
+    # ECSAutoScalingGroup:
+    ecs_auto_scaling_group = template.add_resource(AutoScalingGroup(
+        'ECSAutoScalingGroup',
+        VPCZoneIdentifier=subnets,
+        MinSize=Ref(min_size_param),
+        MaxSize=Ref(max_size_param),
+        Tags=ASTags(Name=(Sub('${EnvironmentName} ECS host'), True)),
+        CreationPolicy=creation_policy,
+        UpdatePolicy=update_policy,
+        **launch_options
     ))
 
+    if warm_pool:
+        # ECSWarmPool
+        template.add_resource(WarmPool(
+            'ECSWarmPool',
+            AutoScalingGroupName=Ref(ecs_auto_scaling_group),
+            MinSize=warm_pool_min_size,
+            PoolState=warm_pool_state,
+            InstanceReusePolicy=InstanceReusePolicy(ReuseOnScaleIn=True),
+        ))
+
+    if scaling:
+        add_scaling_policies(template, ecs_auto_scaling_group, ecs_cluster, scaling,
+                             target_reservation, scale_in_reservation)
+
     # Output
-    template.add_output(Output(
+    add_output(template, Output(
         'Cluster',
         Description='A reference to the ECS cluster',
         Value=Ref(ecs_cluster),
-    ))
-    print(template.to_json())
+    ), exports)
+
+    if capacity_provider:
+        add_output(template, Output(
+            'CapacityProvider',
+            Description='A reference to the capacity provider of the ECS hosts',
+            Value=Ref(add_capacity_provider(
+                template, ecs_auto_scaling_group, ecs_cluster, target_capacity)),
+        ), exports)
+    return template
+
+def main():
+    """Prints the CloudFormation template"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--exports', action='store_true',
+                        help='export the outputs and import the inputs of other stacks')
+    parser.add_argument('--instance-family', choices=sorted(INSTANCE_FAMILIES), default='t2',
+                        help='instance family the InstanceType parameter offers the sizes of '
+                             '(default: t2)')
+    parser.add_argument('--scaling', choices=SCALING_MODES,
+                        help='scale the hosts on the CPU and memory reserved by tasks '
+                             '(default: fixed at ClusterSize)')
+    parser.add_argument('--target-reservation', type=int, default=75,
+                        help='reservation percentage scaling keeps the cluster under '
+                             '(default: 75)')
+    parser.add_argument('--scale-in-reservation', type=int, default=40,
+                        help='reservation percentage step scaling scales in below '
+                             '(default: 40)')
+    parser.add_argument('--capacity-provider', action='store_true',
+                        help='launch a mix of Spot and On-Demand hosts from a launch template '
+                             'and let ECS scale them as a capacity provider')
+    parser.add_argument('--instance-types', default=','.join(MIXED_INSTANCE_TYPES),
+                        help='comma separated instance types of a capacity provider, in order '
+                             'of preference (default: %(default)s)')
+    parser.add_argument('--on-demand-base', type=int, default=1,
+                        help='hosts of a capacity provider that are always On-Demand '
+                             '(default: 1)')
+    parser.add_argument('--on-demand-percentage', type=int, default=0,
+                        help='percentage of the hosts above the base that are On-Demand '
+                             '(default: 0)')
+    parser.add_argument('--spot-allocation-strategy', choices=SPOT_ALLOCATION_STRATEGIES,
+                        default='price-capacity-optimized',
+                        help='how Spot hosts are spread over the instance types '
+                             '(default: %(default)s)')
+    parser.add_argument('--target-capacity', type=int, default=100,
+                        help='percentage of the capacity provider hosts ECS keeps '
+                             'utilized (default: 100)')
+    parser.add_argument('--cluster-size', type=int,
+                        help='default ClusterSize without --scaling (default: 1); '
+                             'required by percentage update counts, which are resolved '
+                             'against it when generating the template, so ClusterSize is '
+                             'then fixed to it')
+    parser.add_argument('--update-mode', choices=UPDATE_MODES, default='rolling',
+                        help='replace the hosts in batches or all at once on updates '
+                             '(default: rolling)')
+    parser.add_argument('--update-batch-size', default='1',
+                        help='hosts replaced at a time by rolling updates, a number or a '
+                             'percentage of --cluster-size such as 25%% (default: 1)')
+    parser.add_argument('--min-in-service', default='1',
+                        help='hosts kept in service during rolling updates, a number or a '
+                             'percentage of --cluster-size (default: 1)')
+    parser.add_argument('--update-pause', default='PT15M',
+                        help='how long updates wait for new hosts to signal (default: PT15M)')
+    parser.add_argument('--warm-pool', action='store_true',
+                        help='keep a warm pool of pre-initialized instances')
+    parser.add_argument('--warm-pool-min-size', type=int, default=0,
+                        help='instances always kept in the warm pool (default: 0)')
+    parser.add_argument('--warm-pool-state', choices=WARM_POOL_STATES, default='Stopped',
+                        help='state of the warm pool instances (default: Stopped)')
+    parser.add_argument('--boot-mode', choices=BOOT_MODES, default='bootstrap',
+                        help='install the CloudFormation helper scripts at boot, or expect '
+                             'them on a pre-baked AMI (default: bootstrap)')
+    parser.add_argument('--cfn-init', action='store_true',
+                        help='also run cfn-init and cfn-hup on pre-baked hosts')
+    parser.add_argument('--host-tuning', nargs='?', const='{}', type=json.loads,
+                        help='tune the ECS agent and kernel of the hosts, optionally '
+                             'overriding HostTuning fields with a JSON object')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    write_from_arguments(build_template(
+        exports=args.exports,
+        instance_family=args.instance_family,
+        scaling=args.scaling,
+        target_reservation=args.target_reservation,
+        scale_in_reservation=args.scale_in_reservation,
+        capacity_provider=args.capacity_provider,
+        instance_types=args.instance_types.split(','),
+        on_demand_base=args.on_demand_base,
+        on_demand_percentage=args.on_demand_percentage,
+        spot_allocation_strategy=args.spot_allocation_strategy,
+        target_capacity=args.target_capacity,
+        cluster_size=args.cluster_size,
+        update_mode=args.update_mode,
+        update_batch_size=args.update_batch_size,
+        min_in_service=args.min_in_service,
+        update_pause=args.update_pause,
+        warm_pool=args.warm_pool,
+        warm_pool_min_size=args.warm_pool_min_size,
+        warm_pool_state=args.warm_pool_state,
+        boot_mode=args.boot_mode,
+        cfn_init=args.cfn_init or None,
+        host_tuning=args.host_tuning,
+    ), args)
 
 if __name__ == '__main__':
     main()
@@ -3,15 +3,157 @@ This scipt creates the template that deploys an Application Load Balancer
 that exposes our various ECS services.
 We create them it a seperate nested template, so it can be referenced by
 all of the other nested templates.
+The load balancer and its target groups are tuned for fast deploys.
+Host and path routes to services are planned into listener rules by
+listener_rules.py, across further load balancers once one runs out of room.
 """
-from troposphere import GetAtt, Join, Output, Parameter, Template, Ref, Sub
-import troposphere.elasticloadbalancingv2 as elb
+import argparse
+import json
+import re
+
+from load_balancer_tuning import LoadBalancerTuning, TargetGroupTuning
+from output import add_output_arguments, write_from_arguments
+from wiring import add_input, add_output
+
+# CloudFormation template limits
+MAX_RESOURCES = 500
+MAX_OUTPUTS = 200
+
+
+def target_group_properties(tuning):
+    """Returns the attribute and health check properties of a tuned target group"""
+    import troposphere.elasticloadbalancingv2 as elb
+
+    return dict(
+        TargetGroupAttributes=[elb.TargetGroupAttribute(Key=key, Value=value)
+                               for key, value in tuning.attributes()],
+        **tuning.health_check()
+    )
+
+
+def resource_name(name):
+    """Returns the CamelCase logical ID prefix of a route or target name"""
+    return ''.join(part[:1].upper() + part[1:] for part in re.split(r'[^A-Za-z0-9]+', name))
+
+
+def add_route_rules(template, plan, load_balancer, listener, vpc, tuning, exports=False,
+                    target_tunings=None, outputs=True):
+    """Adds the target groups and listener rules of a load balancer of a plan
+
+    listener is the value of the listener's ARN. target_tunings overrides
+    tuning for some targets, and with outputs each target group is output.
+    Returns the target groups and the lists of listener rules by target.
+    """
+    from troposphere import Output, Ref
+    import troposphere.elasticloadbalancingv2 as elb
+
+    target_tunings = target_tunings or {}
+    target_groups = {}
+    target_rules = {}
+    for target in plan.targets(load_balancer):
+        name = '%sTargetGroup' % resource_name(target)
+        if name in template.resources:
+            raise ValueError('target %r clashes with another resource as %s' % (target, name))
+        # <Target>TargetGroup
+        target_groups[target] = template.add_resource(elb.TargetGroup(
+            name,
+            VpcId=vpc,
+            Port='80',
+            Protocol='HTTP',
+            **target_group_properties(target_tunings.get(target, tuning))
+        ))
+        if outputs:
+            add_output(template, Output(
+                name,
+                Description='A reference to the target group of %s' % target,
+                Value=Ref(target_groups[target]),
+            ), exports)
+
+    for rule in plan.load_balancers[load_balancer]:
+        name = '%sListenerRule' % resource_name(rule.routes[0])
+        if name in template.resources:
+            raise ValueError('route %r clashes with another resource as %s' % (
+                rule.routes[0], name))
+        conditions = []
+        if rule.host:
+            conditions.append(elb.Condition(
+                Field='host-header',
+                HostHeaderConfig=elb.HostHeaderConfig(Values=[rule.host]),
+            ))
+        if rule.paths:
+            conditions.append(elb.Condition(
+                Field='path-pattern',
+                PathPatternConfig=elb.PathPatternConfig(Values=list(rule.paths)),
+            ))
+        # <Route>ListenerRule, the metadata lets the next plan keep its priority
+        target_rules.setdefault(rule.target, []).append(template.add_resource(elb.ListenerRule(
+            name,
+            Metadata={'Routes': list(rule.routes), 'LoadBalancer': load_balancer},
+            ListenerArn=listener,
+            Priority=rule.priority,
+            Conditions=conditions,
+            Actions=[elb.ListenerRuleAction(
+                Type='forward',
+                TargetGroupArn=Ref(target_groups[rule.target]),
+            )],
+        )))
+    return target_groups, target_rules
+
+
+def build_template(exports=False, load_balancer_tuning=None, target_group_tuning=None,
+                   routes=None, previous_template=None, load_balancer=None,
+                   services_template=None):
+    """Generates the CloudFormation template
+
+    load_balancer_tuning and target_group_tuning are LoadBalancerTuning and
+    TargetGroupTuning settings, or dicts of their fields, and default to
+    their defaults.
+
+    routes is a list of listener_rules routes (dicts of their fields), each
+    getting a listener rule and, per target, a target group. Priorities of
+    the previously rendered template at previous_template are kept where
+    they can be. Routes that do not fit on one load balancer add more, or,
+    with load_balancer set, only that load balancer of the plan is rendered
+    so that each can be its own stack. Rules take the LoadBalancers priority
+    range, avoiding the priorities of the rendered Services template at
+    services_template, which adds rules to the same listener.
+    """
+    from troposphere import GetAtt, Join, Output, Parameter, Template, Ref, Sub
+    import troposphere.elasticloadbalancingv2 as elb
+
+    load_balancer_tuning = LoadBalancerTuning.from_options(load_balancer_tuning)
+    target_group_tuning = TargetGroupTuning.from_options(target_group_tuning)
+
+    plan = None
+    if routes:
+        from listener_rules import (PRIORITY_RANGES, plan_rules, priorities_from_template,
+                                    taken_priorities)
+
+        previous = None
+        if previous_template:
+            with open(previous_template) as template_file:
+                previous = priorities_from_template(json.load(template_file))
+        taken = ()
+        if services_template:
+            with open(services_template) as template_file:
+                taken = taken_priorities(json.load(template_file))
+        plan = plan_rules(routes, previous, priority_range=PRIORITY_RANGES['LoadBalancers'],
+                          taken=taken)
+    count = len(plan.load_balancers) if plan else 1
+    if load_balancer is not None and not 0 <= load_balancer < count:
+        raise ValueError('load_balancer must be between 0 and %d, got %r' % (
+            count - 1, load_balancer))
+    if plan and load_balancer is None and count > 1:
+        # Each load balancer brings its listener, default target group and outputs
+        targets = sum(len(plan.targets(index)) for index in range(count))
+        resources = 3 * count + targets + sum(len(rules) for rules in plan.load_balancers)
+        if resources > MAX_RESOURCES or 3 * count + targets > MAX_OUTPUTS:
+            raise ValueError('the %d load balancers the routes need do not fit in one '
+                             'stack, render each on its own with load_balancer' % count)
 
-def main():
-    """Generates the CloudFormation template"""
     template = Template()
 
-    template.add_version("2010-09-09")
+    template.set_version("2010-09-09")
 
     # Parameters
     # EnvironmentName
@@ -22,77 +164,121 @@ def main():
     ))
 
     # VPC
-    vpc_param = template.add_parameter(Parameter(
+    vpc = add_input(template, 'LoadBalancers', Parameter(
         'VPC',
         Type='AWS::EC2::VPC::Id',
         Description='Choose which VPC this ECS cluster should be deployed to',
-    ))
+    ), exports)
 
     # Subnets
-    subnets_param = template.add_parameter(Parameter(
+    subnets = add_input(template, 'LoadBalancers', Parameter(
         'Subnets',
         Type='List<AWS::EC2::Subnet::Id>',
         Description='Choose which subnets the Applicaion Load Balancer should be deployed to',
-    ))
+    ), exports)
 
-    # SecurityGroup
-    sg_param = template.add_parameter(Parameter(
-        'SecurityGroup',
-        Type='AWS::EC2::SecurityGroup::Id',
-        Description='Select the Security Group to apply to the Applicaion Load Balancer',
-    ))
+    # SecurityGroups
+    security_groups = add_input(template, 'LoadBalancers', Parameter(
+        'SecurityGroups',
+        Type='List<AWS::EC2::SecurityGroup::Id>',
+        Description='Select the Security Groups to apply to the Applicaion Load Balancer',
+    ), exports)
 
     # Resources
-    # LoadBalancer
-    load_balancer = template.add_resource(elb.LoadBalancer(
-        'LoadBalancer',
-        Name=Ref(env_name_param),
-        Subnets=Ref(subnets_param),
-        SecurityGroups=[Ref(sg_param)],
-        Tags=[{'Key': 'Name', 'Value' : Sub('${EnvironmentName}')}]
-    ))
+    indexes = range(count) if load_balancer is None else [load_balancer]
+    for index in indexes:
+        # The first load balancer keeps its names, as does any rendered on its own
+        prefix = 'LoadBalancer' if index == 0 or load_balancer is not None else (
+            'LoadBalancer%d' % (index + 1))
 
-    # DefaultTargetGroup
-    dflt_trg_grp = template.add_resource(elb.TargetGroup(
-        'DefaultTargetGroup',
-        Name='default',
-        VpcId=Ref(vpc_param),
-        Port='80',
-        Protocol='HTTP'
-    ))
+        # LoadBalancer
+        load_balancer_resource = template.add_resource(elb.LoadBalancer(
+            prefix,
+            Name=Ref(env_name_param) if index == 0 else Sub(
+                '${EnvironmentName}-%d' % (index + 1)),
+            Subnets=subnets,
+            SecurityGroups=security_groups,
+            LoadBalancerAttributes=[elb.LoadBalancerAttributes(Key=key, Value=value)
+                                    for key, value in load_balancer_tuning.attributes()],
+            Tags=[{'Key': 'Name', 'Value' : Sub('${EnvironmentName}')}]
+        ))
 
-    # LoadBalancerListener
-    load_balancer_listner = template.add_resource(elb.Listener(
-        'LoadBalancerListener',
-        LoadBalancerArn=Ref(load_balancer),
-        Port='80',
-        Protocol='HTTP',
-        DefaultActions=[elb.Action(
-            Type='forward',
-            TargetGroupArn=Ref(dflt_trg_grp)
-        )]
-    ))
-    # Output
-    # LoadBalancer
-    template.add_output(Output(
-        'LoadBalancer',
-        Description='A reference to the Application Load Balancer',
-        Value=Ref(load_balancer),
-    ))
+        # DefaultTargetGroup, a target group only serves one load balancer
+        default_properties = {'Name': 'default'} if index == 0 else {}
+        dflt_trg_grp = template.add_resource(elb.TargetGroup(
+            'DefaultTargetGroup' if prefix == 'LoadBalancer' else '%sDefaultTargetGroup' % prefix,
+            VpcId=vpc,
+            Port='80',
+            Protocol='HTTP',
+            **dict(default_properties, **target_group_properties(target_group_tuning))
+        ))
 
-    template.add_output(Output(
-        'LoadBalancerUrl',
-        Description='The URL of the ALB',
-        Value=Join("", ["http://", GetAtt(load_balancer, "DNSName")]),
-    ))
+        # LoadBalancerListener
+        load_balancer_listner = template.add_resource(elb.Listener(
+            '%sListener' % prefix,
+            LoadBalancerArn=Ref(load_balancer_resource),
+            Port='80',
+            Protocol='HTTP',
+            DefaultActions=[elb.Action(
+                Type='forward',
+                TargetGroupArn=Ref(dflt_trg_grp)
+            )]
+        ))
 
-    template.add_output(Output(
-        'Listener',
-        Description='A reference to a port 80 listener',
-        Value=Ref(load_balancer_listner),
-    ))
+        if plan:
+            add_route_rules(template, plan, index, Ref(load_balancer_listner), vpc,
+                            target_group_tuning, exports)
+
+        # Output
+        # LoadBalancer
+        add_output(template, Output(
+            prefix,
+            Description='A reference to the Application Load Balancer',
+            Value=Ref(load_balancer_resource),
+        ), exports)
 
-    print(template.to_json())
+        add_output(template, Output(
+            '%sUrl' % prefix,
+            Description='The URL of the ALB',
+            Value=Join("", ["http://", GetAtt(load_balancer_resource, "DNSName")]),
+        ), exports)
+
+        add_output(template, Output(
+            'Listener' if prefix == 'LoadBalancer' else '%sListener' % prefix,
+            Description='A reference to a port 80 listener',
+            Value=Ref(load_balancer_listner),
+        ), exports)
+
+    return template
+
+def main():
+    """Prints the CloudFormation template"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--exports', action='store_true',
+                        help='export the outputs and import the inputs of other stacks')
+    parser.add_argument('--load-balancer-tuning', type=json.loads,
+                        help='JSON object overriding LoadBalancerTuning fields')
+    parser.add_argument('--target-group-tuning', type=json.loads,
+                        help='JSON object overriding TargetGroupTuning fields')
+    parser.add_argument('--routes', type=argparse.FileType('r'),
+                        help='JSON file with a list of routes to plan listener rules for')
+    parser.add_argument('--previous-template',
+                        help='previously rendered template whose rule priorities to keep')
+    parser.add_argument('--load-balancer', type=int,
+                        help='render only this load balancer of the planned routes')
+    parser.add_argument('--services-template',
+                        help='rendered Services template whose rule priorities to avoid')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    write_from_arguments(build_template(
+        exports=args.exports,
+        load_balancer_tuning=args.load_balancer_tuning,
+        target_group_tuning=args.target_group_tuning,
+        routes=json.load(args.routes) if args.routes else None,
+        previous_template=args.previous_template,
+        load_balancer=args.load_balancer,
+        services_template=args.services_template,
+    ), args)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,116 @@
+"""
+This script generates the master template that deploys our entire stack as
+nested stacks: the VPC, the security groups, the Application Load Balancer,
+the ECS cluster and the services running on it. The outputs of each stack are wired into the parameters
+of the stacks that need them, so CloudFormation works out the order they are
+created in and creates independent stacks, such as the load balancer and the
+ECS cluster, in parallel.
+
+With exports the nested stacks import each other's exported outputs instead
+of being passed parameters, in which case they must have been generated
+with exports too. The nested stack templates are uploaded as .json files,
+or .yaml files when they were generated with --format yaml.
+"""
+import argparse
+
+from output import EXTENSIONS, FORMATS, add_output_arguments, write_from_arguments
+from wiring import INPUTS
+
+# The nested stacks in the order they are deployed
+NESTED_STACKS = ('VPC', 'SecurityGroups', 'LoadBalancers', 'ECSCluster', 'Services')
+
+# Output -> (nested stack, nested stack output) passed through by the master template
+OUTPUTS = (
+    ('VPC', 'VPC', 'VPC'),
+    ('Cluster', 'ECSCluster', 'Cluster'),
+    ('LoadBalancerUrl', 'LoadBalancers', 'LoadBalancerUrl'),
+    ('Listener', 'LoadBalancers', 'Listener'),
+)
+
+
+def build_template(exports=False, template_format='json'):
+    """Generates the CloudFormation template
+
+    template_format is the format of the nested stack templates, which sets
+    the extension of their URLs.
+    """
+    from troposphere import GetAtt, Output, Parameter, Ref, Sub, Template
+    from troposphere.cloudformation import Stack
+
+    if template_format not in EXTENSIONS:
+        raise ValueError('unknown template format %r, expected one of %s' % (
+            template_format, ', '.join(FORMATS)))
+
+    template = Template()
+
+    template.set_version("2010-09-09")
+
+    template.set_description(
+        'This template deploys the VPC, security groups, load balancer, ECS cluster and ' +
+        'services as nested stacks, wiring the outputs of each stack into the stacks that need them')
+
+    # Parameters
+    # EnvironmentName
+    env_name_param = template.add_parameter(Parameter(
+        'EnvironmentName',
+        Type='String',
+        Description='An environment name that will be prefixed to resource names',
+    ))
+
+    # TemplateBaseURL
+    template.add_parameter(Parameter(
+        'TemplateBaseURL',
+        Type='String',
+        Description='The S3 URL the nested stack templates have been uploaded to, ' +
+        'without a trailing slash',
+    ))
+
+    # Resources
+    for stack in NESTED_STACKS:
+        parameters = {'EnvironmentName': Ref(env_name_param)}
+        producers = set()
+        for parameter, (producer, output) in INPUTS.get(stack, {}).items():
+            if exports:
+                producers.add(producer)
+            else:
+                parameters[parameter] = GetAtt(producer, 'Outputs.%s' % output)
+
+        nested_stack = Stack(
+            stack,
+            TemplateURL=Sub('${TemplateBaseURL}/%s%s' % (stack, EXTENSIONS[template_format])),
+            Parameters=parameters,
+        )
+        # Imports do not tell CloudFormation which stacks have to exist first
+        if producers:
+            nested_stack.DependsOn = sorted(producers)
+        template.add_resource(nested_stack)
+
+    # Outputs
+    for name, stack, output in OUTPUTS:
+        template.add_output(Output(
+            name,
+            Description='The %s output of the %s stack' % (output, stack),
+            Value=GetAtt(stack, 'Outputs.%s' % output),
+        ))
+
+    return template
+
+
+def main():
+    """Prints the CloudFormation template"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--exports', action='store_true',
+                        help='let the nested stacks import exports instead of passing parameters')
+    parser.add_argument('--template-format', choices=FORMATS,
+                        help='format the nested stack templates were generated in '
+                             '(default: the --format of this template)')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    write_from_arguments(build_template(
+        exports=args.exports,
+        template_format=args.template_format or args.format,
+    ), args)
+
+
+if __name__ == '__main__':
+    main()
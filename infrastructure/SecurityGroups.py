@@ -3,18 +3,44 @@ This script generates a template that contains the security groups
 required by our entire stack. We create them in a seperate nested
 template, so they can be referenced by all of the other nested
 templates.
+The load balancer can be limited to allow-lists of CIDRs and ports, which
+sg_rules.py compacts and spreads over more security groups when they do not
+fit in one.
 """
-from troposphere import Output, Parameter, Template, Ref, Sub
-from troposphere.ec2 import SecurityGroup, SecurityGroupRule
+import argparse
+import json
+import sys
 
+from output import add_output_arguments, write_from_arguments
+from wiring import add_input, add_output
+
+
+def build_template(exports=False, load_balancer_ingress=None, report=None):
+    """Generates the CloudFormation template
+
+    load_balancer_ingress is a list of sg_rules rule dicts the load balancer
+    allows, instead of all traffic. The rule counts before and after
+    compacting them are written to report, a file, when given.
+    """
+    from troposphere import Join, Output, Parameter, Template, Ref, Sub
+    from troposphere.ec2 import SecurityGroup, SecurityGroupRule
+
+    ingress_groups = [[SecurityGroupRule(CidrIp='0.0.0.0/0', IpProtocol='-1',)]]
+    if load_balancer_ingress is not None:
+        from sg_rules import plan_rules, rule_properties
+
+        plan = plan_rules(load_balancer_ingress)
+        ingress_groups = [[SecurityGroupRule(**rule_properties(rule)) for rule in group]
+                          for group in plan.groups]
+        if report:
+            report.write('load balancer ingress: %(rules_before)d rules compacted to '
+                         '%(rules_after)d in %(groups)d security groups\n' % plan.stats())
 
-def main():
-    """Generates the CloudFormation template"""
     template = Template()
 
-    template.add_version("2010-09-09")
+    template.set_version("2010-09-09")
 
-    template.add_description(
+    template.set_description(
         'This template contains the security groups required by our '+
         'entire stack. We create them in a seperate nested template, '+
         'so they can be referenced by all of the other nested templates')
@@ -28,25 +54,30 @@ def main():
     ))
 
     # VPC
-    vpc_param = template.add_parameter(Parameter(
+    vpc = add_input(template, 'SecurityGroups', Parameter(
         'VPC',
         Type='AWS::EC2::VPC::Id',
         Description='Choose which VPC this ECS cluster should be deployed to',
-    ))
+    ), exports)
 
     # Resources
-    # LoadBalancerSecurityGroup
-    elb_security_group = template.add_resource(SecurityGroup(
-        'LoadBalancerSecurityGroup',
-        VpcId=Ref(vpc_param),
-        GroupDescription='Access to the load balancer that sits in front of ECS',
-        SecurityGroupIngress=[SecurityGroupRule(CidrIp='0.0.0.0/0', IpProtocol='-1',)],
-        Tags=[{'Key': 'Name', 'Value' : Sub('${EnvironmentName}-LoadBalancers')}]
-    ))
+    # LoadBalancerSecurityGroup and LoadBalancerSecurityGroup<n>
+    elb_security_groups = []
+    for index, ingress in enumerate(ingress_groups):
+        suffix = str(index + 1) if index else ''
+        elb_security_groups.append(template.add_resource(SecurityGroup(
+            'LoadBalancerSecurityGroup' + suffix,
+            VpcId=vpc,
+            GroupDescription='Access to the load balancer that sits in front of ECS',
+            SecurityGroupIngress=ingress,
+            Tags=[{'Key': 'Name', 'Value' : Sub('${EnvironmentName}-LoadBalancers' + suffix)}]
+        )))
+    # The load balancer's traffic comes from all of its groups, the first is enough
+    elb_security_group = elb_security_groups[0]
     # ECSHostSecurityGroup
     ecs_security_group = template.add_resource(SecurityGroup(
         'ECSHostSecurityGroup',
-        VpcId=Ref(vpc_param),
+        VpcId=vpc,
         GroupDescription='Access to the ECS hosts and the tasks/containers that run on them',
         SecurityGroupIngress=[
             SecurityGroupRule(SourceSecurityGroupId=Ref(elb_security_group), IpProtocol='-1',)
@@ -55,18 +86,41 @@ def main():
     ))
 
     # Output
-    template.add_output(Output(
+    add_output(template, Output(
         'ECSHostSecurityGroup',
         Description='A reference to the security group for ECS hosts',
         Value=Ref(ecs_security_group),
-    ))
+    ), exports)
 
-    template.add_output(Output(
+    add_output(template, Output(
         'LoadBalancerSecurityGroup',
         Description='A reference to the security group for load balancers',
         Value=Ref(elb_security_group),
-    ))
-    print(template.to_json())
+    ), exports)
+
+    add_output(template, Output(
+        'LoadBalancerSecurityGroups',
+        Description='A list of the security groups for load balancers',
+        Value=Join(',', [Ref(security_group) for security_group in elb_security_groups]),
+    ), exports)
+    return template
+
+
+def main():
+    """Prints the CloudFormation template"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--exports', action='store_true',
+                        help='export the outputs and import the inputs of other stacks')
+    parser.add_argument('--load-balancer-ingress', type=argparse.FileType('r'),
+                        help='JSON file with a list of rules the load balancer allows')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    write_from_arguments(build_template(
+        exports=args.exports,
+        load_balancer_ingress=(json.load(args.load_balancer_ingress)
+                               if args.load_balancer_ingress else None),
+        report=sys.stderr,
+    ), args)
 
 
 if __name__ == '__main__':
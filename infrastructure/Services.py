@@ -0,0 +1,268 @@
+"""
+This script creates the template that deploys our ECS services onto the
+ECS cluster, each with its task definition.
+Services with a host or path are registered in a target group that the
+load balancer's listener routes to, and services with a maximum count scale
+on their own load with target tracking.
+"""
+import argparse
+import json
+
+from LoadBalancers import add_route_rules, resource_name
+from load_balancer_tuning import TargetGroupTuning
+from output import add_output_arguments, write_from_arguments
+from service_specs import (DEFAULT_SERVICES, SCALING_METRICS, ServiceSpec,
+                           parse_placement_constraint, parse_placement_strategy)
+from wiring import add_input, add_output
+
+
+def task_definition(name, spec, log_group):
+    """Returns the task definition running the container of a service"""
+    from troposphere import Ref, Sub
+    import troposphere.ecs as ecs
+
+    container = dict(
+        Name=spec.name,
+        Image=spec.image,
+        Cpu=spec.cpu,
+        Memory=spec.memory,
+        Essential=True,
+        Environment=[ecs.Environment(Name=key, Value=str(value))
+                     for key, value in sorted(spec.environment.items())],
+        LogConfiguration=ecs.LogConfiguration(
+            LogDriver='awslogs',
+            Options={
+                'awslogs-group': Ref(log_group),
+                'awslogs-region': Ref('AWS::Region'),
+                'awslogs-stream-prefix': spec.name,
+            },
+        ),
+    )
+    if spec.memory_reservation is not None:
+        container['MemoryReservation'] = spec.memory_reservation
+    if spec.container_port is not None:
+        # Dynamic host ports let any number of tasks share a host
+        container['PortMappings'] = [ecs.PortMapping(ContainerPort=spec.container_port,
+                                                     HostPort=0)]
+    return ecs.TaskDefinition(
+        name,
+        Family=Sub('${EnvironmentName}-%s' % spec.name),
+        NetworkMode='bridge',
+        ContainerDefinitions=[ecs.ContainerDefinition(**container)],
+    )
+
+
+def add_service_scaling(template, prefix, spec, cluster, service, listener, target_group):
+    """Adds target tracking of the service's scaling metric between its task counts"""
+    from troposphere import GetAtt, Join, Ref, Select, Split, Sub
+    import troposphere.applicationautoscaling as aas
+
+    # <Service>ScalableTarget
+    scalable_target = template.add_resource(aas.ScalableTarget(
+        '%sScalableTarget' % prefix,
+        MinCapacity=spec.min_count,
+        MaxCapacity=spec.max_count,
+        ResourceId=Join('/', ['service', cluster, GetAtt(service, 'Name')]),
+        ScalableDimension='ecs:service:DesiredCount',
+        ServiceNamespace='ecs',
+    ))
+
+    metric = dict(PredefinedMetricType=SCALING_METRICS[spec.scaling_metric])
+    if spec.scaling_metric == 'requests':
+        # app/<name>/<id>/targetgroup/<name>/<id>, the load balancer part
+        # taken from the listener ARN
+        listener_parts = Split('/', listener)
+        metric['ResourceLabel'] = Join('/', [
+            Select(1, listener_parts), Select(2, listener_parts), Select(3, listener_parts),
+            GetAtt(target_group, 'TargetGroupFullName'),
+        ])
+
+    # <Service>ScalingPolicy
+    template.add_resource(aas.ScalingPolicy(
+        '%sScalingPolicy' % prefix,
+        PolicyName=Sub('${AWS::StackName}-%s' % spec.name),
+        PolicyType='TargetTrackingScaling',
+        ScalingTargetId=Ref(scalable_target),
+        TargetTrackingScalingPolicyConfiguration=aas.TargetTrackingScalingPolicyConfiguration(
+            PredefinedMetricSpecification=aas.PredefinedMetricSpecification(**metric),
+            TargetValue=spec.scaling_target,
+            ScaleInCooldown=spec.scale_in_cooldown,
+            ScaleOutCooldown=spec.scale_out_cooldown,
+        ),
+    ))
+
+
+def build_template(exports=False, services=None, previous_template=None,
+                   load_balancers_template=None):
+    """Generates the CloudFormation template
+
+    services is a list of ServiceSpecs, or dicts of their fields, and
+    defaults to DEFAULT_SERVICES. The listener rule priorities of the
+    previously rendered template at previous_template are kept where they
+    can be. Rules take the Services priority range, avoiding the priorities
+    of the rendered LoadBalancers template at load_balancers_template, whose
+    routes share the listener.
+    """
+    from troposphere import Output, Parameter, Ref, Sub, Template
+    import troposphere.ecs as ecs
+    from troposphere.logs import LogGroup
+
+    specs = [ServiceSpec.from_options(service) for service in (services or DEFAULT_SERVICES)]
+    names = set()
+    for spec in specs:
+        if spec.name in names:
+            raise ValueError('duplicate service %r' % spec.name)
+        names.add(spec.name)
+
+    plan = None
+    routed = [spec for spec in specs if spec.routed]
+    if routed:
+        from listener_rules import (PRIORITY_RANGES, plan_rules, priorities_from_template,
+                                    taken_priorities)
+
+        previous = None
+        if previous_template:
+            with open(previous_template) as template_file:
+                previous = priorities_from_template(json.load(template_file))
+        taken = ()
+        if load_balancers_template:
+            with open(load_balancers_template) as template_file:
+                taken = taken_priorities(json.load(template_file))
+        plan = plan_rules([spec.route() for spec in routed], previous,
+                          priority_range=PRIORITY_RANGES['Services'], taken=taken)
+        if len(plan.load_balancers) > 1:
+            raise ValueError('the routes of the %d services do not fit on one listener' % (
+                len(routed),))
+
+    template = Template()
+
+    template.set_version("2010-09-09")
+
+    # Parameters
+    # EnvironmentName
+    template.add_parameter(Parameter(
+        'EnvironmentName',
+        Type='String',
+        Description='An environment name that will be prefixed to resource names',
+    ))
+
+    # Cluster
+    cluster = add_input(template, 'Services', Parameter(
+        'Cluster',
+        Type='String',
+        Description='The ECS cluster the services run on',
+    ), exports)
+
+    # Listener
+    listener = add_input(template, 'Services', Parameter(
+        'Listener',
+        Type='String',
+        Description='The load balancer listener the services are routed from',
+    ), exports)
+
+    # VPC
+    vpc = add_input(template, 'Services', Parameter(
+        'VPC',
+        Type='AWS::EC2::VPC::Id',
+        Description='The VPC the target groups of the services are in',
+    ), exports)
+
+    # Resources
+    # ServicesLogGroup
+    log_group = template.add_resource(LogGroup(
+        'ServicesLogGroup',
+        LogGroupName=Sub('/ecs/${EnvironmentName}'),
+        RetentionInDays=30,
+    ))
+
+    target_groups, target_rules = {}, {}
+    if plan:
+        target_groups, target_rules = add_route_rules(
+            template, plan, 0, listener, vpc, TargetGroupTuning(),
+            target_tunings=dict((spec.name, spec.target_group) for spec in routed),
+            outputs=False)
+
+    for spec in specs:
+        prefix = resource_name(spec.name)
+
+        # <Service>TaskDefinition
+        task = template.add_resource(task_definition(
+            '%sTaskDefinition' % prefix, spec, log_group))
+
+        properties = dict(
+            Cluster=cluster,
+            DesiredCount=spec.desired_count,
+            TaskDefinition=Ref(task),
+            PlacementStrategies=[
+                ecs.PlacementStrategy(**dict(
+                    [('Type', strategy_type)] + ([('Field', field)] if field else [])))
+                for strategy_type, field in map(parse_placement_strategy,
+                                                spec.placement_strategies)],
+            PlacementConstraints=[
+                ecs.PlacementConstraint(**dict(
+                    [('Type', constraint_type)] + (
+                        [('Expression', expression)] if expression else [])))
+                for constraint_type, expression in map(parse_placement_constraint,
+                                                       spec.placement_constraints)],
+            DeploymentConfiguration=ecs.DeploymentConfiguration(
+                MaximumPercent=200,
+                MinimumHealthyPercent=100,
+                DeploymentCircuitBreaker=ecs.DeploymentCircuitBreaker(
+                    Enable=True,
+                    Rollback=True,
+                ),
+            ),
+        )
+        if spec.routed:
+            properties.update(
+                LoadBalancers=[ecs.LoadBalancer(
+                    ContainerName=spec.name,
+                    ContainerPort=spec.container_port,
+                    TargetGroupArn=Ref(target_groups[spec.name]),
+                )],
+                HealthCheckGracePeriodSeconds=spec.health_check_grace_period,
+                # The target group must be attached to the load balancer first
+                DependsOn=[rule.title for rule in target_rules[spec.name]],
+            )
+
+        # <Service>Service
+        service = template.add_resource(ecs.Service('%sService' % prefix, **properties))
+
+        if spec.max_count is not None:
+            add_service_scaling(template, prefix, spec, cluster, service, listener,
+                                target_groups.get(spec.name))
+
+        # Output
+        # <Service>Service
+        add_output(template, Output(
+            '%sService' % prefix,
+            Description='A reference to the %s service' % spec.name,
+            Value=Ref(service),
+        ), exports)
+
+    return template
+
+
+def main():
+    """Prints the CloudFormation template"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--exports', action='store_true',
+                        help='export the outputs and import the inputs of other stacks')
+    parser.add_argument('--services', type=argparse.FileType('r'),
+                        help='JSON file with a list of ServiceSpec fields')
+    parser.add_argument('--previous-template',
+                        help='previously rendered template whose rule priorities to keep')
+    parser.add_argument('--load-balancers-template',
+                        help='rendered LoadBalancers template whose rule priorities to avoid')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    write_from_arguments(build_template(
+        exports=args.exports,
+        services=json.load(args.services) if args.services else None,
+        previous_template=args.previous_template,
+        load_balancers_template=args.load_balancers_template,
+    ), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,23 +3,131 @@ This script generates a template deploys a VPC, with a pair of public and
 private subnets spread across two Availabilty Zones. It deploys an Internet
 Gateway, with a default route on the public subnets. It deploys a pair of
 NAT Gateways (one in each AZ), and default routes for them in the private subnets.
+The number of Availabilty Zones can be raised to spread the VPC further.
+VPC endpoints for S3, ECR, CloudWatch Logs and ECS can be added so image
+pulls and log writes from the private subnets bypass the NAT Gateways.
 """
-from troposphere import GetAtt, GetAZs, Join, Output, Parameter
-from troposphere import Ref, Select, Sub, Tags, Template
-from troposphere.ec2 import EIP, InternetGateway, NatGateway
-from troposphere.ec2 import Subnet, SubnetRouteTableAssociation
-from troposphere.ec2 import Route, RouteTable, VPC, VPCGatewayAttachment
+import argparse
+import ipaddress
+import re
+
+from output import add_output_arguments, write_from_arguments
+from subnets import plan_subnets
+from wiring import add_output
+
+ORDINALS = ('first', 'second', 'third', 'fourth', 'fifth', 'sixth')
+
+SHORT_ORDINALS = ('1st', '2nd', '3rd', '4th', '5th', '6th')
+
+# No region has more Availabilty Zones than this
+MAX_AZ_COUNT = len(ORDINALS)
+
+# Endpoint -> (endpoint type, AWS services it covers), in the order they are added
+VPC_ENDPOINTS = {
+    's3': ('Gateway', ('s3',)),
+    'ecr.api': ('Interface', ('ecr.api',)),
+    'ecr.dkr': ('Interface', ('ecr.dkr',)),
+    'logs': ('Interface', ('logs',)),
+    # The ECS agent also talks to the agent and telemetry endpoints
+    'ecs': ('Interface', ('ecs', 'ecs-agent', 'ecs-telemetry')),
+}
+
+
+def add_vpc_endpoints(template, endpoints, vpc, vpc_cidr, subnets, route_tables):
+    """Adds the VPC endpoints and the security group of the interface endpoints
+
+    Gateway endpoints are added to route_tables, interface endpoints to
+    subnets with private DNS, so the AWS SDKs use them without changes.
+    """
+    from troposphere import Ref, Sub, Tags
+    from troposphere.ec2 import SecurityGroup, SecurityGroupRule, VPCEndpoint
+
+    endpoint_security_group = None
+    if any(VPC_ENDPOINTS[endpoint][0] == 'Interface' for endpoint in endpoints):
+        # VPCEndpointSecurityGroup
+        endpoint_security_group = template.add_resource(SecurityGroup(
+            'VPCEndpointSecurityGroup',
+            VpcId=Ref(vpc),
+            GroupDescription='HTTPS access to the interface VPC endpoints from within the VPC',
+            SecurityGroupIngress=[SecurityGroupRule(
+                CidrIp=vpc_cidr, IpProtocol='tcp', FromPort=443, ToPort=443)],
+            Tags=Tags(Name=Sub('${EnvironmentName}-VPC-Endpoints')),
+        ))
+
+    # <Service>Endpoint, e.g. EcrDkrEndpoint
+    for endpoint in VPC_ENDPOINTS:
+        if endpoint not in endpoints:
+            continue
+        endpoint_type, services = VPC_ENDPOINTS[endpoint]
+        for service in services:
+            properties = dict(
+                VpcId=Ref(vpc),
+                ServiceName=Sub('com.amazonaws.${AWS::Region}.%s' % service),
+                VpcEndpointType=endpoint_type,
+            )
+            if endpoint_type == 'Gateway':
+                properties['RouteTableIds'] = [Ref(route_table) for route_table in route_tables]
+            else:
+                properties.update(
+                    SubnetIds=[Ref(subnet) for subnet in subnets],
+                    SecurityGroupIds=[Ref(endpoint_security_group)],
+                    PrivateDnsEnabled=True,
+                )
+            template.add_resource(VPCEndpoint(
+                '%sEndpoint' % ''.join(part.capitalize() for part in re.split(r'[.-]', service)),
+                **properties
+            ))
+
+
+def build_template(az_count=2, vpc_cidr='10.192.0.0/16', subnet_prefix=24, exports=False,
+                   endpoints=()):
+    """Generates the CloudFormation template
+
+    The subnets are planned as blocks of subnet_prefix within vpc_cidr, the
+    default of the VpcCIDR parameter. Their CIDR parameters default to
+    empty, which takes the same blocks of the VpcCIDR deployed with, so
+    overriding VpcCIDR alone moves every subnet along with it.
+
+    endpoints lists the VPC_ENDPOINTS to add for the private subnets. The
+    private DNS names of interface endpoints need the DNS support and DNS
+    hostnames of the VPC, which are then enabled.
+    """
+    from troposphere import Cidr, Equals, GetAtt, GetAZs, If, Join, Output, Parameter
+    from troposphere import Ref, Select, Sub, Tags, Template
+    from troposphere.ec2 import EIP, InternetGateway, NatGateway
+    from troposphere.ec2 import Subnet, SubnetRouteTableAssociation
+    from troposphere.ec2 import Route, RouteTable, VPC, VPCGatewayAttachment
+
+    if not 1 <= az_count <= MAX_AZ_COUNT:
+        raise ValueError('az_count must be between 1 and %d, got %d' % (MAX_AZ_COUNT, az_count))
+    unknown = sorted(set(endpoints) - set(VPC_ENDPOINTS))
+    if unknown:
+        raise ValueError('unknown VPC endpoints %s, expected some of %s' % (
+            ', '.join(unknown), ', '.join(sorted(VPC_ENDPOINTS))))
+    subnet_plan = dict(zip(
+        ('Public', 'Private'), plan_subnets(vpc_cidr, az_count, prefix_length=subnet_prefix)))
+    # The index of each planned subnet among the subnet_prefix blocks of the VPC
+    vpc_network = ipaddress.ip_network(vpc_cidr)
+    block_bits = vpc_network.max_prefixlen - subnet_prefix
+    subnet_blocks = dict(
+        (kind, [(int(cidr.network_address) - int(vpc_network.network_address)) >> block_bits
+                for cidr in cidrs])
+        for kind, cidrs in subnet_plan.items())
+    block_count = max(max(blocks) for blocks in subnet_blocks.values()) + 1
+    azs = range(1, az_count + 1)
 
-def main():
-    """Generates the CloudFormation template"""
     template = Template()
 
-    template.add_version("2010-09-09")
+    template.set_version("2010-09-09")
 
-    template.add_description(
-        'This template deploys a VPC, with a pair of public and private subnets spread ' +
-        'across two Availabilty Zones. It deploys an Internet Gateway, with a default ' +
-        'route on the public subnets. It deploys a pair of NAT Gateways (one in each AZ), ' +
+    if az_count == 2:
+        pair, spread = 'a pair of', 'two'
+    else:
+        pair, spread = str(az_count), str(az_count)
+    template.set_description(
+        'This template deploys a VPC, with %s public and private subnets spread ' % pair +
+        'across %s Availabilty Zones. It deploys an Internet Gateway, with a default ' % spread +
+        'route on the public subnets. It deploys %s NAT Gateways (one in each AZ), ' % pair +
         'and default routes for them in the private subnets.'
     )
     # Parameters
@@ -35,52 +143,43 @@ def main():
         'VpcCIDR',
         Type='String',
         Description='Please enter the IP range (CIDR notation) for this VPC',
-        Default='10.192.0.0/16',
-    ))
-
-    # PublicSubnet1CIDR
-    pub_subnet_1_param = template.add_parameter(Parameter(
-        'PublicSubnet1CIDR',
-        Type='String',
-        Description='Please enter the IP range (CIDR notation) for the public subnet ' +
-        'in the first Availability Zone',
-        Default='10.192.10.0/24',
-    ))
-
-    # PublicSubnet2CIDR
-    pub_subnet_2_param = template.add_parameter(Parameter(
-        'PublicSubnet2CIDR',
-        Type='String',
-        Description='Please enter the IP range (CIDR notation) for the public subnet ' +
-        'in the second Availability Zone',
-        Default='10.192.11.0/24',
-    ))
-
-    # PrivateSubnet1CIDR
-    prvt_subnet_1_param = template.add_parameter(Parameter(
-        'PrivateSubnet1CIDR',
-        Type='String',
-        Description='Please enter the IP range (CIDR notation) for the private subnet ' +
-        'in the first Availability Zone',
-        Default='10.192.20.0/24',
+        Default=vpc_cidr,
     ))
 
-    # PrivateSubnet2CIDR
-    prvt_subnet_2_param = template.add_parameter(Parameter(
-        'PrivateSubnet2CIDR',
-        Type='String',
-        Description='Please enter the IP range (CIDR notation) for the private subnet ' +
-        'in the second Availability Zone',
-        Default='10.192.21.0/24',
-    ))
+    # PublicSubnet<n>CIDR and PrivateSubnet<n>CIDR
+    subnet_cidrs = {}
+    for kind in ('Public', 'Private'):
+        for az, cidr, block in zip(azs, subnet_plan[kind], subnet_blocks[kind]):
+            subnet_param = template.add_parameter(Parameter(
+                '%sSubnet%dCIDR' % (kind, az),
+                Type='String',
+                Description='Please enter the IP range (CIDR notation) for the %s subnet ' % (
+                    kind.lower()) +
+                'in the %s Availability Zone, or leave it empty for /%d block %d of ' % (
+                    ORDINALS[az - 1], subnet_prefix, block) +
+                'the VPC (%s with the default VpcCIDR)' % cidr,
+                Default='',
+            ))
+            # Plan<Kind>Subnet<n>CIDR, when the planned block of the VPC is used
+            condition = template.add_condition(
+                'Plan%sSubnet%dCIDR' % (kind, az), Equals(Ref(subnet_param), ''))
+            subnet_cidrs[kind, az] = If(
+                condition,
+                Select(block, Cidr(Ref(vpc_cidr_param), block_count, block_bits)),
+                Ref(subnet_param),
+            )
 
     # Resources
     # VPC
+    vpc_dns = {}
+    if any(VPC_ENDPOINTS[endpoint][0] == 'Interface' for endpoint in endpoints):
+        vpc_dns = dict(EnableDnsSupport=True, EnableDnsHostnames=True)
     vpc = template.add_resource(
         VPC(
             'VPC',
             CidrBlock=Ref(vpc_cidr_param),
             Tags=Tags(Name=Ref(env_param)),
+            **vpc_dns
         )
     )
 
@@ -101,89 +200,39 @@ def main():
         )
     )
 
-    # PublicSubnet1
-    pub_subnet1 = template.add_resource(
-        Subnet(
-            'PublicSubnet1',
-            VpcId=Ref(vpc),
-            AvailabilityZone=Select('0', GetAZs("")),
-            CidrBlock=Ref(pub_subnet_1_param),
-            MapPublicIpOnLaunch=False,
-            Tags=Tags(Name=Sub('${EnvironmentName} Public Subnet (AZ1)')),
+    # PublicSubnet<n> and PrivateSubnet<n>
+    subnets = {}
+    for kind in ('Public', 'Private'):
+        for az in azs:
+            subnets[kind, az] = template.add_resource(
+                Subnet(
+                    '%sSubnet%d' % (kind, az),
+                    VpcId=Ref(vpc),
+                    AvailabilityZone=Select(str(az - 1), GetAZs("")),
+                    CidrBlock=subnet_cidrs[kind, az],
+                    MapPublicIpOnLaunch=False,
+                    Tags=Tags(Name=Sub('${EnvironmentName} %s Subnet (AZ%d)' % (kind, az))),
+                )
+            )
+
+    # NatGateway<n>EIP and NatGateway<n>
+    nat_gateways = {}
+    for az in azs:
+        nat_gateway_eip = template.add_resource(
+            EIP(
+                'NatGateway%dEIP' % az,
+                DependsOn='InternetGatewayAttachment',
+                Domain='vpc',
+            )
         )
-    )
 
-    # PublicSubnet2
-    pub_subnet2 = template.add_resource(
-        Subnet(
-            'PublicSubnet2',
-            VpcId=Ref(vpc),
-            AvailabilityZone=Select('1', GetAZs("")),
-            CidrBlock=Ref(pub_subnet_2_param),
-            MapPublicIpOnLaunch=False,
-            Tags=Tags(Name=Sub('${EnvironmentName} Public Subnet (AZ2)')),
+        nat_gateways[az] = template.add_resource(
+            NatGateway(
+                'NatGateway%d' % az,
+                AllocationId=GetAtt(nat_gateway_eip, 'AllocationId'),
+                SubnetId=Ref(subnets['Public', az]),
+            )
         )
-    )
-
-    # PrivateSubnet1
-    prvt_subnet1 = template.add_resource(
-        Subnet(
-            'PrivateSubnet1',
-            VpcId=Ref(vpc),
-            AvailabilityZone=Select('0', GetAZs("")),
-            CidrBlock=Ref(prvt_subnet_1_param),
-            MapPublicIpOnLaunch=False,
-            Tags=Tags(Name=Sub('${EnvironmentName} Private Subnet (AZ1)')),
-        )
-    )
-
-    # PrivateSubnet2
-    prvt_subnet2 = template.add_resource(
-        Subnet(
-            'PrivateSubnet2',
-            VpcId=Ref(vpc),
-            AvailabilityZone=Select('1', GetAZs("")),
-            CidrBlock=Ref(prvt_subnet_2_param),
-            MapPublicIpOnLaunch=False,
-            Tags=Tags(Name=Sub('${EnvironmentName} Private Subnet (AZ2)')),
-        )
-    )
-
-    # NatGateway1EIP
-    nat_gateway1_eip = template.add_resource(
-        EIP(
-            'NatGateway1EIP',
-            DependsOn='InternetGatewayAttachment',
-            Domain='vpc',
-        )
-    )
-
-    # NatGateway2EIP
-    nat_gateway2_eip = template.add_resource(
-        EIP(
-            'NatGateway2EIP',
-            DependsOn='InternetGatewayAttachment',
-            Domain='vpc',
-        )
-    )
-
-    # NatGateway1
-    nat_gateway1 = template.add_resource(
-        NatGateway(
-            'NatGateway1',
-            AllocationId=GetAtt(nat_gateway1_eip, 'AllocationId'),
-            SubnetId=Ref(pub_subnet1),
-        )
-    )
-
-    # NatGateway2
-    nat_gateway2 = template.add_resource(
-        NatGateway(
-            'NatGateway2',
-            AllocationId=GetAtt(nat_gateway2_eip, 'AllocationId'),
-            SubnetId=Ref(pub_subnet2),
-        )
-    )
 
     # PublicRouteTable
     pub_route_table = template.add_resource(
@@ -204,124 +253,100 @@ def main():
         )
     )
 
-    # PublicSubnet1RouteTableAssociation
-    template.add_resource(
-        SubnetRouteTableAssociation(
-            'PublicSubnet1RouteTableAssociation',
-            RouteTableId=Ref(pub_route_table),
-            SubnetId=Ref(pub_subnet1),
+    # PublicSubnet<n>RouteTableAssociation
+    for az in azs:
+        template.add_resource(
+            SubnetRouteTableAssociation(
+                'PublicSubnet%dRouteTableAssociation' % az,
+                RouteTableId=Ref(pub_route_table),
+                SubnetId=Ref(subnets['Public', az]),
+            )
         )
-    )
-
-    # PublicSubnet2RouteTableAssociation
-    template.add_resource(
-        SubnetRouteTableAssociation(
-            'PublicSubnet2RouteTableAssociation',
-            RouteTableId=Ref(pub_route_table),
-            SubnetId=Ref(pub_subnet2),
-        )
-    )
 
-    # PrivateRouteTable1
-    prvt_route_table1 = template.add_resource(
-        RouteTable(
-            'PrivateRouteTable1',
-            VpcId=Ref(vpc),
-            Tags=Tags(Name=Sub('${EnvironmentName} Private Routes (AZ1)')),
+    # PrivateRouteTable<n>, DefaultPrivateRoute<n> and PrivateSubnet<n>RouteTableAssociation
+    prvt_route_tables = []
+    for az in azs:
+        prvt_route_table = template.add_resource(
+            RouteTable(
+                'PrivateRouteTable%d' % az,
+                VpcId=Ref(vpc),
+                Tags=Tags(Name=Sub('${EnvironmentName} Private Routes (AZ%d)' % az)),
+            )
         )
-    )
-
-    # DefaultPrivateRoute1
-    template.add_resource(
-        Route(
-            'DefaultPrivateRoute1',
-            RouteTableId=Ref(prvt_route_table1),
-            DestinationCidrBlock='0.0.0.0/0',
-            NatGatewayId=Ref(nat_gateway1),
-        )
-    )
-
-    # PrivateSubnet1RouteTableAssociation
-    template.add_resource(
-        SubnetRouteTableAssociation(
-            'PrivateSubnet1RouteTableAssociation',
-            RouteTableId=Ref(prvt_route_table1),
-            SubnetId=Ref(prvt_subnet1),
-        )
-    )
 
-    # PrivateRouteTable2
-    prvt_route_table2 = template.add_resource(
-        RouteTable(
-            'PrivateRouteTable2',
-            VpcId=Ref(vpc),
-            Tags=Tags(Name=Sub('${EnvironmentName} Private Routes (AZ2)')),
+        template.add_resource(
+            Route(
+                'DefaultPrivateRoute%d' % az,
+                RouteTableId=Ref(prvt_route_table),
+                DestinationCidrBlock='0.0.0.0/0',
+                NatGatewayId=Ref(nat_gateways[az]),
+            )
         )
-    )
 
-    # DefaultPrivateRoute2
-    template.add_resource(
-        Route(
-            'DefaultPrivateRoute2',
-            RouteTableId=Ref(prvt_route_table2),
-            DestinationCidrBlock='0.0.0.0/0',
-            NatGatewayId=Ref(nat_gateway2),
+        template.add_resource(
+            SubnetRouteTableAssociation(
+                'PrivateSubnet%dRouteTableAssociation' % az,
+                RouteTableId=Ref(prvt_route_table),
+                SubnetId=Ref(subnets['Private', az]),
+            )
         )
-    )
+        prvt_route_tables.append(prvt_route_table)
 
-    # PrivateSubnet1RouteTableAssociation
-    template.add_resource(
-        SubnetRouteTableAssociation(
-            'PrivateSubnet2RouteTableAssociation',
-            RouteTableId=Ref(prvt_route_table2),
-            SubnetId=Ref(prvt_subnet2),
-        )
-    )
+    if endpoints:
+        add_vpc_endpoints(template, endpoints, vpc, Ref(vpc_cidr_param),
+                          [subnets['Private', az] for az in azs], prvt_route_tables)
 
     # Outputs
-    template.add_output(Output(
+    add_output(template, Output(
         'VPC',
         Description='A reference to the created VPC',
         Value=Ref(vpc),
-    ))
+    ), exports)
 
-    template.add_output(Output(
+    add_output(template, Output(
         'PublicSubnets',
         Description='A list of the public subnets',
-        Value=Join(',', [Ref(pub_subnet1), Ref(pub_subnet2)]),
-    ))
+        Value=Join(',', [Ref(subnets['Public', az]) for az in azs]),
+    ), exports)
 
-    template.add_output(Output(
+    add_output(template, Output(
         'PrivateSubnets',
         Description='A list of the private subnets',
-        Value=Join(',', [Ref(prvt_subnet1), Ref(prvt_subnet2)]),
-    ))
+        Value=Join(',', [Ref(subnets['Private', az]) for az in azs]),
+    ), exports)
 
-    template.add_output(Output(
-        'PublicSubnet1',
-        Description='A reference to the public subnet in the 1st Availability Zone',
-        Value=Ref(pub_subnet1),
-    ))
+    for kind in ('Public', 'Private'):
+        for az in azs:
+            add_output(template, Output(
+                '%sSubnet%d' % (kind, az),
+                Description='A reference to the %s subnet in the %s Availability Zone' % (
+                    kind.lower(), SHORT_ORDINALS[az - 1]),
+                Value=Ref(subnets[kind, az]),
+            ), exports)
 
-    template.add_output(Output(
-        'PublicSubnet2',
-        Description='A reference to the public subnet in the 2nd Availability Zone',
-        Value=Ref(pub_subnet2),
-    ))
+    return template
 
-    template.add_output(Output(
-        'PrivateSubnet1',
-        Description='A reference to the private  subnet in the 1st Availability Zone',
-        Value=Ref(prvt_subnet1),
-    ))
-
-    template.add_output(Output(
-        'PrivateSubnet2',
-        Description='A reference to the private  subnet in the 2nd Availability Zone',
-        Value=Ref(prvt_subnet2),
-    ))
 
-    print(template.to_json())
+def main():
+    """Prints the CloudFormation template"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--az-count', type=int, default=2,
+                        help='number of Availabilty Zones to spread the VPC across (default: 2)')
+    parser.add_argument('--subnet-prefix', type=int, default=24,
+                        help='prefix length of the subnets (default: 24)')
+    parser.add_argument('--vpc-cidr', default='10.192.0.0/16',
+                        help='default IP range of the VPC the subnets are planned in')
+    parser.add_argument('--endpoints', nargs='+', default=(), choices=sorted(VPC_ENDPOINTS),
+                        metavar='ENDPOINT',
+                        help='VPC endpoints to add for the private subnets: %s' % (
+                            ', '.join(sorted(VPC_ENDPOINTS))))
+    parser.add_argument('--exports', action='store_true',
+                        help='export the outputs for other stacks to import')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+    write_from_arguments(build_template(
+        az_count=args.az_count, vpc_cidr=args.vpc_cidr, subnet_prefix=args.subnet_prefix,
+        exports=args.exports, endpoints=args.endpoints), args)
 
 
 if __name__ == '__main__':
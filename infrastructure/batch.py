@@ -0,0 +1,266 @@
+"""
+This script generates the templates of every stack for all of the
+environments listed in a manifest in a single run, so troposphere and
+awacs are only imported once rather than once per stack per environment.
+
+The manifest is a JSON document listing the environments to render:
+
+    {
+        "environments": [
+            {"name": "dev"},
+            {"name": "prod", "stacks": {"VPC": {}, "ECSCluster": {}}}
+        ]
+    }
+
+When an environment has no "stacks" entry every stack is rendered with its
+default options, otherwise only the listed stacks are rendered and each value
+is passed to that stack's build_template() as keyword arguments. Templates
+are written to <output>/<environment>/<stack>.json, or .yaml with
+--format yaml. With --optimize, JSON templates are also shrunk by the
+semantics-preserving rewrites of compaction.py and written minified.
+"""
+import argparse
+import functools
+import importlib
+import json
+import os
+import sys
+import time
+
+import instrument
+from output import EXTENSIONS, FORMATS, TraceAction, dumps
+from render_cache import RenderCache, cache_key
+from validate import report as report_problems, validate_body
+
+# The stacks in the order they are deployed
+STACKS = ('VPC', 'SecurityGroups', 'LoadBalancers', 'ECSCluster', 'Services', 'Master')
+
+
+def load_manifest(path):
+    """Reads the manifest and returns a list of (environment, stacks) pairs"""
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    environments = []
+    for environment in manifest.get('environments', []):
+        name = environment.get('name')
+        if not name or os.sep in name or name in (os.curdir, os.pardir):
+            raise ValueError('invalid environment name %r in %s' % (name, path))
+        stacks = environment.get('stacks')
+        if stacks is None:
+            stacks = dict((stack, {}) for stack in STACKS)
+        unknown = sorted(set(stacks) - set(STACKS))
+        if unknown:
+            raise ValueError('unknown stacks %s for environment %s' % (', '.join(unknown), name))
+        environments.append((name, stacks))
+    return environments
+
+
+def build_template(stack, options):
+    """Builds the template of a stack using the given builder options"""
+    module = importlib.import_module(stack)
+    with instrument.span('build_template %s' % stack):
+        return module.build_template(**options)
+
+
+def render(stack, options, fmt='json', compact=False, optimize=False):
+    """Builds and serializes the template of a stack
+
+    The master template points at the nested stack templates written in fmt.
+    """
+    if stack == 'Master':
+        options = dict(options, template_format=fmt)
+    template = build_template(stack, options)
+    if not optimize:
+        return dumps(template, fmt=fmt, compact=compact)
+    from compaction import compact_template, equivalent, minify
+
+    original = json.loads(dumps(template, compact=True))
+    compacted, _ = compact_template(original)
+    if not equivalent(original, compacted):
+        raise ValueError('compacting the %s template changed what it deploys' % stack)
+    return minify(compacted)
+
+
+def output_path(output_dir, environment, stack, fmt='json'):
+    """Returns the path the template of a stack is written to"""
+    return os.path.join(output_dir, environment, stack + EXTENSIONS[fmt])
+
+
+def output_matches(output_dir, environment, stack, body, fmt='json'):
+    """Checks whether a previously written template is identical to body"""
+    try:
+        with open(output_path(output_dir, environment, stack, fmt)) as output_file:
+            return output_file.read() == body + '\n'
+    except IOError:
+        return False
+
+
+def write_output(output_dir, environment, stack, body, fmt='json'):
+    """Writes a rendered template and returns the path it was written to"""
+    path = output_path(output_dir, environment, stack, fmt)
+    with instrument.span('write %s/%s' % (environment, stack), 'batch'):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as output_file:
+            output_file.write(body)
+            output_file.write('\n')
+    return path
+
+
+def render_task(task, fmt='json', compact=False, optimize=False):
+    """Renders one (environment, stack, options) task, timing how long it took
+
+    While tracing, the events recorded are returned too, so the ones of
+    worker processes can be merged into the trace.
+    """
+    environment, stack, options = task
+    started = time.perf_counter()
+    with instrument.span('render %s/%s' % (environment, stack), 'batch'):
+        body = render(stack, options, fmt=fmt, compact=compact, optimize=optimize)
+    elapsed = time.perf_counter() - started
+    return body, elapsed, instrument.take_events() if instrument.enabled() else None
+
+
+def plan_tasks(environments):
+    """Lists the (environment, stack, options) tasks in the order they are written"""
+    return [
+        (environment, stack, stacks[stack])
+        for environment, stacks in environments
+        for stack in STACKS if stack in stacks
+    ]
+
+
+def run(environments, output_dir, jobs=1, cache=None, fmt='json', compact=False,
+        validate=False, optimize=False, report=sys.stderr):
+    """Renders and writes the templates of every environment
+
+    With more than one job the templates are rendered across a process pool.
+    Results are consumed in task order, so the output does not depend on the
+    number of workers. Templates found in the cache are neither rendered nor,
+    when the existing output is already identical, written again.
+
+    With validate, every template is checked offline once it is rendered and
+    the number of templates with errors is returned. With optimize, JSON
+    templates are compacted, failing when a compacted template is not
+    equivalent to the original.
+    """
+    started = time.perf_counter()
+    tasks = plan_tasks(environments)
+    counts = dict((environment, len(stacks)) for environment, stacks in environments)
+
+    # Without a cache every task is rendered, otherwise each distinct key is
+    # looked up once and only rendered once on a miss
+    keys = list(range(len(tasks)))
+    cached = {}
+    pending = []
+    optimize = optimize and fmt == 'json'
+    serialization = fmt + ('-optimized' if optimize else
+                           '-compact' if compact and fmt == 'json' else '')
+    for index, task in enumerate(tasks):
+        if cache is not None:
+            keys[index] = cache_key(task[1], task[2], serialization)
+            if keys[index] in cached:
+                continue
+            cached[keys[index]] = cache.get(keys[index])
+        if cached.get(keys[index]) is None:
+            pending.append(task)
+            cached[keys[index]] = None
+
+    task_renderer = functools.partial(render_task, fmt=fmt, compact=compact, optimize=optimize)
+    if jobs > 1 and len(pending) > 1:
+        import concurrent.futures
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=instrument.enable if instrument.enabled() else None)
+        results = pool.map(task_renderer, pending, chunksize=max(1, len(pending) // (jobs * 4)))
+    else:
+        pool = None
+        results = map(task_renderer, pending)
+
+    validations = {}
+    invalid = 0
+    try:
+        elapsed = 0.0
+        for index, (environment, stack, _) in enumerate(tasks):
+            body = cached[keys[index]]
+            rendered = body is None
+            if rendered:
+                # Waiting for a worker overlaps its render time, which is
+                # counted instead
+                body, render_time, events = next(results)
+                instrument.add_events(events)
+                elapsed += render_time
+            write_started = time.perf_counter()
+            if rendered:
+                cached[keys[index]] = body
+                write_output(output_dir, environment, stack, body, fmt)
+                if cache is not None:
+                    cache.put(keys[index], body)
+            elif not output_matches(output_dir, environment, stack, body, fmt):
+                write_output(output_dir, environment, stack, body, fmt)
+            if validate:
+                if keys[index] not in validations:
+                    validations[keys[index]] = validate_body(body, fmt)
+                errors, warnings = validations[keys[index]]
+                report_problems('%s/%s' % (environment, stack), errors, warnings, report)
+                invalid += bool(errors)
+            elapsed += time.perf_counter() - write_started
+            if index + 1 == len(tasks) or tasks[index + 1][0] != environment:
+                print('%s: %d templates in %.3fs' % (
+                    environment, counts[environment], elapsed), file=report)
+                elapsed = 0.0
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if cache is not None:
+            cache.save()
+
+    print('%d environments in %.3fs' % (
+        len(environments), time.perf_counter() - started), file=report)
+    if cache is not None:
+        print(cache.stats(), file=report)
+    if validate:
+        print('validation: %d of %d templates have errors' % (invalid, len(tasks)), file=report)
+    return invalid
+
+
+def main(argv=None):
+    """Generates the templates listed in a manifest"""
+    parser = argparse.ArgumentParser(
+        description='Generates the templates of every stack for the environments in a manifest')
+    parser.add_argument('manifest', help='JSON manifest listing the environments to render')
+    parser.add_argument('-o', '--output', default='build',
+                        help='directory the templates are written to (default: build)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes rendering templates (default: 1)')
+    parser.add_argument('--cache-dir', default='.render-cache',
+                        help='directory of the render cache (default: .render-cache)')
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help='size cap of the render cache in MB (default: 256)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='render every template without using the render cache')
+    parser.add_argument('--format', choices=FORMATS, default='json',
+                        help='format the templates are written in (default: json)')
+    parser.add_argument('--compact', action='store_true',
+                        help='write JSON templates without indentation')
+    parser.add_argument('--optimize', action='store_true',
+                        help='compact JSON templates with semantics-preserving rewrites')
+    parser.add_argument('--validate', action='store_true',
+                        help='validate every template offline, failing on errors')
+    parser.add_argument('--trace', action=TraceAction, metavar='FILE',
+                        help='write a Chrome trace of rendering the templates to FILE')
+    instrument.trace_from_environment()
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    cache = None
+    if not args.no_cache:
+        cache = RenderCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    invalid = run(load_manifest(args.manifest), args.output, jobs=args.jobs, cache=cache,
+                  fmt=args.format, compact=args.compact, validate=args.validate,
+                  optimize=args.optimize)
+    return 1 if invalid else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+This script benchmarks building and serializing the stack templates. Each
+phase is timed separately over a number of repeats:
+
+    import   - importing the troposphere and awacs modules used by the stack,
+               measured in a fresh interpreter with python -X importtime
+    build    - constructing the parameters and resources of the Template
+    to_json  - serializing the Template
+    write    - writing the serialized template to disk
+
+Every stack is benchmarked in its current shape, and the VPC, SecurityGroups
+and LoadBalancers stacks also in synthetic scaled-up variants (6 AZs, 50
+security group rules, 5000 security group rules that compact into a few,
+100 listener rules, and the first of the load balancers planned for 2000
+routes), as is the ECS cluster with step scaling policies and alarms and as
+a capacity provider, and the services stack with 50 autoscaled services.
+Results can be saved as JSON and compared with a previous run, failing when
+a phase regressed by more than a threshold.
+"""
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import batch
+from check_startup import DEFERRED_PACKAGES, import_times
+from render_cache import package_version
+
+PHASES = ('import', 'build', 'to_json', 'write')
+
+
+def ingress_rules(rule_count, merge=False):
+    """Returns rule_count load balancer ingress rules of distinct /24s and ports
+
+    With merge, the rules are of adjacent CIDRs and overlapping ports that
+    compact into a few rules.
+    """
+    rules = []
+    for index in range(rule_count):
+        cidr = '10.%d.%d.0/24' % (index // 256, index % 256)
+        if merge:
+            # Every /24 of a /16 allows the same overlapping ports
+            port = 8000 + index // 256
+            rules.append({'cidrs': cidr, 'ports': ['%d-%d' % (port, port + 1), port + 1]})
+        else:
+            rules.append({'cidrs': cidr, 'ports': 8000 + index})
+    return rules
+
+
+def service_routes(route_count, services_per_host=0):
+    """Returns route_count path-based routes, each to its own service
+
+    With services_per_host, the routes are also host-based with that many
+    services per host.
+    """
+    routes = []
+    for index in range(1, route_count + 1):
+        route = {'name': 'service%d' % index, 'path': '/service%d/*' % index,
+                 'hotness': index % 97}
+        if services_per_host:
+            route['host'] = 'host%d.example.com' % (index // services_per_host)
+        routes.append(route)
+    return routes
+
+
+def services(service_count):
+    """Returns service_count routed services scaling on their requests"""
+    return [{'name': 'service%d' % index, 'image': 'service%d:latest' % index,
+             'path': '/service%d/*' % index, 'max_count': 10, 'scaling_metric': 'requests'}
+            for index in range(1, service_count + 1)]
+
+
+# (stack, variant, builder options)
+VARIANTS = (
+    ('VPC', 'current', {}),
+    ('VPC', '6-az', {'az_count': 6}),
+    ('SecurityGroups', 'current', {}),
+    ('SecurityGroups', '50-rules', {'load_balancer_ingress': ingress_rules(50)}),
+    ('SecurityGroups', '5000-mergeable',
+     {'load_balancer_ingress': ingress_rules(5000, merge=True)}),
+    ('LoadBalancers', 'current', {}),
+    ('LoadBalancers', '100-rules', {'routes': service_routes(100)}),
+    ('LoadBalancers', '2000-routes', {'routes': service_routes(2000, 4), 'load_balancer': 0}),
+    ('ECSCluster', 'current', {}),
+    ('ECSCluster', 'step-scaling', {'scaling': 'step'}),
+    ('ECSCluster', 'capacity-provider', {'capacity_provider': True}),
+    ('Services', 'current', {}),
+    ('Services', '50-services', {'services': services(50)}),
+)
+
+
+def build(stack, variant):
+    """Builds the template of a benchmark variant"""
+    for name, variant_name, options in VARIANTS:
+        if (name, variant_name) == (stack, variant):
+            return batch.build_template(stack, options)
+    raise KeyError('unknown variant %s/%s' % (stack, variant))
+
+
+def summarize(samples):
+    """Summarizes timing samples in seconds"""
+    return {
+        'median': statistics.median(samples),
+        'mean': statistics.mean(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'min': min(samples),
+        'max': max(samples),
+        'repeats': len(samples),
+    }
+
+
+def time_import(stack, variant, repeat):
+    """Times importing the modules a variant needs in fresh interpreters"""
+    samples = []
+    for _ in range(repeat):
+        times, _ = import_times([
+            '-c', 'import benchmark; benchmark.build(%r, %r)' % (stack, variant)])
+        samples.append(sum(
+            cumulative for name, cumulative in times.items()
+            if name.split('.')[0] in DEFERRED_PACKAGES) / 1e6)
+    return samples
+
+
+def time_phases(stack, variant, repeat, output_dir):
+    """Times the build, to_json and write phases of a variant in this process"""
+    samples = dict((phase, []) for phase in PHASES[1:])
+    build(stack, variant)  # warm up, so imports are not timed
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            template = build(stack, variant)
+            built = time.perf_counter()
+            body = template.to_json()
+            serialized = time.perf_counter()
+            batch.write_output(output_dir, variant, stack, body)
+            written = time.perf_counter()
+            samples['build'].append(built - started)
+            samples['to_json'].append(serialized - built)
+            samples['write'].append(written - serialized)
+            gc.collect()
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return samples
+
+
+def run(repeat, import_repeat, report=sys.stderr):
+    """Runs every benchmark and returns the machine-readable results"""
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for stack, variant, _ in VARIANTS:
+            samples = time_phases(stack, variant, repeat, output_dir)
+            samples['import'] = time_import(stack, variant, import_repeat)
+            name = '%s/%s' % (stack, variant)
+            results[name] = dict((phase, summarize(samples[phase])) for phase in PHASES)
+            print('%-36s %s' % (name, '  '.join(
+                '%s %8.3fms' % (phase, results[name][phase]['median'] * 1e3)
+                for phase in PHASES)), file=report)
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'troposphere': package_version('troposphere'),
+            'awacs': package_version('awacs'),
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold, min_delta, report=sys.stderr):
+    """Lists the phases whose median regressed beyond the threshold"""
+    regressions = []
+    for name, phases in sorted(results['results'].items()):
+        for phase, summary in sorted(phases.items()):
+            previous = baseline.get('results', {}).get(name, {}).get(phase)
+            if previous is None:
+                continue
+            delta = summary['median'] - previous['median']
+            if delta > min_delta and delta > previous['median'] * threshold:
+                regressions.append((name, phase))
+                print('REGRESSION %s %s: %.3fms -> %.3fms (%+.0f%%)' % (
+                    name, phase, previous['median'] * 1e3, summary['median'] * 1e3,
+                    100.0 * delta / previous['median']), file=report)
+    return regressions
+
+
+def main(argv=None):
+    """Runs the benchmarks"""
+    parser = argparse.ArgumentParser(
+        description='Benchmarks building and serializing the stack templates')
+    parser.add_argument('-n', '--repeat', type=int, default=20,
+                        help='number of timed repeats of each phase (default: 20)')
+    parser.add_argument('--import-repeat', type=int, default=5,
+                        help='number of fresh interpreters timing the imports (default: 5)')
+    parser.add_argument('-o', '--output', help='file the JSON results are written to')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative slowdown of a median reported as a regression '
+                             '(default: 0.25)')
+    parser.add_argument('--min-delta', type=float, default=0.1,
+                        help='slowdowns under this many ms are ignored as noise (default: 0.1)')
+    args = parser.parse_args(argv)
+    if args.repeat < 2 or args.import_repeat < 1:
+        parser.error('--repeat must be at least 2 and --import-repeat at least 1')
+
+    results = run(args.repeat, args.import_repeat)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4, sort_keys=True)
+            output_file.write('\n')
+    else:
+        json.dump(results, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.threshold, args.min_delta / 1e3):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
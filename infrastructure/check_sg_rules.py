@@ -0,0 +1,78 @@
+"""
+This script plans sets of load balancer ingress rules with sg_rules.py and
+checks that they plan without error into the expected number of rules, and
+that every rule allowed before compacting is still allowed after it. It
+exits non-zero when a check fails.
+"""
+import argparse
+import sys
+
+from sg_rules import _covers, expand_rules, plan_rules
+
+# (name, rules, expected number of compacted rules)
+CASES = (
+    ('duplicates', [{'cidrs': '10.0.0.0/24', 'ports': 443}] * 3, 1),
+    ('adjacent-ports', [{'cidrs': '10.0.0.0/24', 'ports': [80, 81, '82-90']}], 1),
+    ('adjacent-cidrs', [{'cidrs': ['10.0.0.0/25', '10.0.0.128/25'], 'ports': 443}], 1),
+    ('subsumed', [{'cidrs': '10.0.0.0/16', 'ports': '0-65535'},
+                  {'cidrs': '10.0.1.0/24', 'ports': 443}], 1),
+    ('mixed-ipv4-ipv6-security-group', [
+        {'cidrs': ['0.0.0.0/0', '::/0'], 'ports': 443},
+        {'source_security_group': 'sg-0123456789abcdef0', 'ports': 443},
+    ], 3),
+    ('ipv6-and-security-group', [
+        {'cidrs': '::/0', 'ports': 443},
+        {'source_security_group': 'sg-1', 'ports': 443},
+    ], 2),
+    ('all-traffic', [{'cidrs': '10.0.0.0/8', 'protocol': '-1'},
+                     {'cidrs': '10.1.0.0/16', 'protocol': 'udp', 'ports': 53}], 1),
+)
+
+
+def allowed(rule, compacted):
+    """Checks that a compacted rule allows the traffic of an expanded rule"""
+    for other in compacted:
+        if isinstance(rule.source, str) or isinstance(other.source, str):
+            same_source = rule.source == other.source
+        else:
+            same_source = (rule.source.version == other.source.version
+                           and rule.source.subnet_of(other.source))
+        if same_source and _covers(other, rule):
+            return True
+    return False
+
+
+def check(rules, expected):
+    """Plans rules and returns the problems found in the plan"""
+    try:
+        plan = plan_rules(rules)
+    except Exception as error:  # pylint: disable=broad-except
+        return ['planning failed: %s: %s' % (type(error).__name__, error)]
+    problems = []
+    compacted = [rule for group in plan.groups for rule in group]
+    if len(compacted) != expected:
+        problems.append('compacted into %d rules, expected %d' % (len(compacted), expected))
+    for rule in expand_rules(rules):
+        if not allowed(rule, compacted):
+            problems.append('no longer allows %s %s %s-%s' % rule)
+    return problems
+
+
+def main(argv=None):
+    """Checks every case"""
+    parser = argparse.ArgumentParser(
+        description='Checks the compacting and planning of security group rules')
+    parser.parse_args(argv)
+
+    failed = False
+    for name, rules, expected in CASES:
+        problems = check(rules, expected)
+        print('%-36s %s' % (name, 'FAILED' if problems else 'ok'))
+        for problem in problems:
+            print('    %s' % problem)
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+This script checks the startup cost of the template scripts against the
+budgets recorded in startup_budget.json, so that module-level imports of
+troposphere or awacs do not creep back in.
+
+Each entry point is started with `python -X importtime <script> --help` and
+the cumulative time of the top-level imports a bare interpreter does not
+already make is compared with its budget. It exits non-zero when an entry
+point goes over budget or imports troposphere or awacs just to print its
+usage.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BUDGET_FILE = os.path.join(SOURCE_DIR, 'startup_budget.json')
+
+ENTRY_POINTS = ('VPC', 'SecurityGroups', 'LoadBalancers', 'ECSCluster', 'Services', 'Master',
+                'batch')
+
+# Packages that must only be imported once building starts
+DEFERRED_PACKAGES = ('troposphere', 'awacs')
+
+
+def import_times(args):
+    """Runs python -X importtime and returns the top-level import times and all modules"""
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, cwd=SOURCE_DIR, check=True,
+    )
+    times = {}
+    modules = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        # Nested imports are indented, their time is already in their parent's
+        if not name[1:].startswith(' '):
+            times[name.strip()] = int(cumulative)
+    return times, modules
+
+
+def startup_cost(entry_point, repeat):
+    """Returns the best import time in us of an entry point and the modules it imported"""
+    _, interpreter_modules = import_times(['-c', 'pass'])
+    best = None
+    for _ in range(repeat):
+        times, modules = import_times([entry_point + '.py', '--help'])
+        cost = sum(
+            cumulative for name, cumulative in times.items() if name not in interpreter_modules)
+        best = cost if best is None else min(best, cost)
+    return best, modules
+
+
+def main(argv=None):
+    """Checks or records the startup budgets"""
+    parser = argparse.ArgumentParser(
+        description='Checks the startup import time of the template scripts')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs, the fastest of which is kept (default: 5)')
+    parser.add_argument('--record', action='store_true',
+                        help='record the current import times as the new budgets')
+    parser.add_argument('--headroom', type=float, default=2.0,
+                        help='factor applied to the import times when recording (default: 2)')
+    args = parser.parse_args(argv)
+
+    with open(BUDGET_FILE) as budget_file:
+        budgets = json.load(budget_file)
+
+    failures = 0
+    for entry_point in ENTRY_POINTS:
+        cost, modules = startup_cost(entry_point, args.repeat)
+        deferred = sorted(
+            name for name in modules if name.split('.')[0] in DEFERRED_PACKAGES)
+        if args.record:
+            budgets[entry_point] = int(cost * args.headroom)
+        budget = budgets.get(entry_point)
+        status = 'ok'
+        if deferred:
+            status = 'FAIL: imports %s at startup' % ', '.join(deferred)
+        elif budget is None or cost > budget:
+            status = 'FAIL: over budget'
+        failures += status != 'ok'
+        print('%-15s %8dus (budget %sus) %s' % (entry_point, cost, budget, status))
+
+    if args.record:
+        with open(BUDGET_FILE, 'w') as budget_file:
+            json.dump(budgets, budget_file, indent=4, sort_keys=True)
+            budget_file.write('\n')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
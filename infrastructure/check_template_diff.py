@@ -0,0 +1,74 @@
+"""
+This script edits the parameters of the VPC template in ways that do and
+do not change what it deploys, and checks that template_diff.py reports
+the expected modified and replaced resources for each. It exits non-zero
+when a check fails.
+"""
+import argparse
+import copy
+import json
+import sys
+
+import VPC
+from template_diff import diff_templates
+
+
+def edit_parameter(name, key, value):
+    """Returns an edit setting key of the parameter name to value"""
+    def edit(template):
+        template['Parameters'][name][key] = value
+    return edit
+
+
+# (name, edit, expected modified resources, expected replaced resources)
+CASES = (
+    ('unchanged', lambda template: None, 0, 0),
+    ('description-only', edit_parameter(
+        'VpcCIDR', 'Description', 'The IP range of the VPC'), 0, 0),
+    ('allowed-values-only', edit_parameter(
+        'VpcCIDR', 'AllowedValues', ['10.192.0.0/16', '10.0.0.0/16']), 0, 0),
+    ('constraint-description-only', edit_parameter(
+        'EnvironmentName', 'ConstraintDescription', 'a short name'), 0, 0),
+    ('vpc-cidr-default', edit_parameter('VpcCIDR', 'Default', '10.0.0.0/16'), None, None),
+)
+
+
+def check(template, edit, modified, replaced):
+    """Diffs template against an edited copy and returns the problems found
+
+    A None count only has to be positive.
+    """
+    edited = copy.deepcopy(template)
+    edit(edited)
+    changes, _ = diff_templates(template, edited)
+    problems = []
+    for kind, expected, count in (
+            ('modified', modified, len(changes)),
+            ('replaced', replaced, sum(change.replaces for change in changes))):
+        if count != expected if expected is not None else not count:
+            problems.append('%d resources %s, expected %s' % (
+                count, kind, expected if expected is not None else 'some'))
+    if problems:
+        problems.extend(change.describe() for change in changes)
+    return problems
+
+
+def main(argv=None):
+    """Checks every case"""
+    parser = argparse.ArgumentParser(
+        description='Checks the resources template_diff.py reports for parameter edits')
+    parser.parse_args(argv)
+
+    template = json.loads(VPC.build_template().to_json())
+    failed = False
+    for name, edit, modified, replaced in CASES:
+        problems = check(template, edit, modified, replaced)
+        print('%-36s %s' % (name, 'FAILED' if problems else 'ok'))
+        for problem in problems:
+            print('    %s' % problem)
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
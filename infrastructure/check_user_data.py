@@ -0,0 +1,115 @@
+"""
+This script renders the UserData of the ECS hosts for every boot mode and
+checks the resulting shell scripts: that they are valid bash, that only the
+bootstrap mode installs packages, that pre-baked hosts write the ECS agent
+configuration themselves and wait for the agent to register, and that every
+mode signals the ECSAutoScalingGroup. It exits non-zero when a check fails.
+"""
+import argparse
+import base64
+import shutil
+import subprocess
+import sys
+
+import ECSCluster
+from evaluate import evaluate_template
+
+# The stack the UserData is rendered for
+REGION = 'eu-west-1'
+STACK_NAME = 'dev-ECSCluster'
+PARAMETERS = {
+    'EnvironmentName': 'dev',
+    'SecurityGroup': 'sg-0123456789abcdef0',
+    'Subnets': 'subnet-0123456789abcdef0,subnet-0123456789abcdef1',
+    'VPC': 'vpc-0123456789abcdef0',
+}
+PHYSICAL_IDS = {'ECSCluster': 'dev'}
+
+# (name, build options)
+CASES = (
+    ('bootstrap', {}),
+    ('prebaked', {'boot_mode': 'prebaked'}),
+    ('prebaked-cfn-init', {'boot_mode': 'prebaked', 'cfn_init': True}),
+    ('prebaked-warm-pool', {'boot_mode': 'prebaked', 'warm_pool': True}),
+    ('prebaked-capacity-provider', {'boot_mode': 'prebaked', 'capacity_provider': True}),
+    ('prebaked-host-tuning', {'boot_mode': 'prebaked', 'host_tuning': {}}),
+)
+
+
+def launch_resource(template):
+    """Returns the name and resolved properties of the resource launching the hosts"""
+    resources = evaluate_template(template.to_dict(), REGION, parameters=PARAMETERS,
+                                  physical_ids=PHYSICAL_IDS, stack_name=STACK_NAME)['Resources']
+    for name in ('ECSLaunchConfiguration', 'ECSLaunchTemplate'):
+        if name in resources:
+            resource = resources[name]
+            properties = resource['Properties']
+            return name, resource, properties.get('LaunchTemplateData', properties)
+    raise KeyError('the template has no launch configuration or launch template')
+
+
+def check(options):
+    """Renders the UserData of a boot mode and returns the problems found in it"""
+    template = ECSCluster.build_template(**options)
+    name, resource, properties = launch_resource(template)
+    script = base64.b64decode(properties['UserData']).decode('utf-8')
+    boot_mode = options.get('boot_mode', 'bootstrap')
+    cfn_init = options.get('cfn_init', boot_mode == 'bootstrap')
+
+    problems = []
+
+    def expect(condition, message):
+        if not condition:
+            problems.append(message)
+
+    expect(script.startswith('#!/bin/bash\n'), 'does not start with a bash shebang')
+    expect(script.endswith('\n'), 'does not end with a newline')
+    expect('--resource ECSAutoScalingGroup' in script, 'does not signal ECSAutoScalingGroup')
+    expect(('yum install' in script) == (boot_mode == 'bootstrap'),
+           'installs packages' if boot_mode == 'prebaked' else 'does not install cfn-bootstrap')
+    expect(('--resource %s' % name in script) == cfn_init,
+           'runs cfn-init' if not cfn_init else 'does not run cfn-init on %s' % name)
+    expect(('Metadata' in resource) == cfn_init,
+           '%s cfn-init metadata' % ('has no' if cfn_init else 'has unused'))
+    if boot_mode == 'prebaked':
+        expect('ECS_CLUSTER=%s\n' % PHYSICAL_IDS['ECSCluster'] in script,
+               'does not write ECS_CLUSTER to /etc/ecs/ecs.config')
+        expect(('ECS_WARM_POOLS_CHECK=true\n' in script) == bool(options.get('warm_pool')),
+               'ECS_WARM_POOLS_CHECK does not match the warm pool')
+        expect(('ECS_IMAGE_PULL_BEHAVIOR=' in script) == ('host_tuning' in options),
+               'agent tuning does not match the host tuning')
+        expect(('sysctl -e -p %s\n' % ECSCluster.SYSCTL_FILE in script) == (
+            'host_tuning' in options), 'kernel parameters do not match the host tuning')
+        expect(ECSCluster.AGENT_METADATA_URL in script,
+               'does not wait for the ECS agent to register')
+        expect(script.index(ECSCluster.AGENT_METADATA_URL) < script.index('cfn-signal'),
+               'signals before the ECS agent has registered')
+    if shutil.which('bash'):
+        syntax = subprocess.run(['bash', '-n'], input=script, universal_newlines=True,
+                                stderr=subprocess.PIPE)
+        expect(syntax.returncode == 0, 'is not valid bash: %s' % syntax.stderr.strip())
+    return script, problems
+
+
+def main(argv=None):
+    """Checks the UserData of every boot mode"""
+    parser = argparse.ArgumentParser(
+        description='Renders and checks the UserData of the ECS hosts for every boot mode')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print the rendered scripts')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for name, options in CASES:
+        script, problems = check(options)
+        print('%-28s %s' % (name, 'FAILED' if problems else 'ok'))
+        for problem in problems:
+            print('    UserData %s' % problem)
+        if args.verbose:
+            print(''.join('    ' + line for line in script.splitlines(True)))
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+This script generates the VPC template with sets of VPC endpoints and checks
+that the VPC enables the DNS support and DNS hostnames its interface
+endpoints need for their private DNS names. It exits non-zero when a check
+fails.
+"""
+import argparse
+import json
+import sys
+
+import VPC
+
+# (name, endpoints)
+CASES = (
+    ('none', ()),
+    ('gateway-only', ('s3',)),
+    ('interface-only', ('logs',)),
+    ('all', tuple(VPC.VPC_ENDPOINTS)),
+)
+
+
+def check(endpoints):
+    """Generates the VPC template with endpoints and returns the problems found"""
+    try:
+        template = json.loads(VPC.build_template(endpoints=endpoints).to_json())
+    except Exception as error:  # pylint: disable=broad-except
+        return ['generating failed: %s: %s' % (type(error).__name__, error)]
+    resources = template['Resources']
+    vpc = resources['VPC']['Properties']
+    private_dns = [name for name, resource in sorted(resources.items())
+                   if resource['Type'] == 'AWS::EC2::VPCEndpoint'
+                   and resource['Properties'].get('PrivateDnsEnabled')]
+    problems = []
+    if private_dns:
+        for name in ('EnableDnsSupport', 'EnableDnsHostnames'):
+            if vpc.get(name) not in (True, 'true'):
+                problems.append('%s is not enabled for the private DNS of %s' % (
+                    name, ', '.join(private_dns)))
+    return problems
+
+
+def main(argv=None):
+    """Checks every case"""
+    parser = argparse.ArgumentParser(
+        description='Checks the VPC DNS settings needed by the VPC endpoints')
+    parser.parse_args(argv)
+
+    failed = False
+    for name, endpoints in CASES:
+        problems = check(endpoints)
+        print('%-36s %s' % (name, 'FAILED' if problems else 'ok'))
+        for problem in problems:
+            print('    %s' % problem)
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
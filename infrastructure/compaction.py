@@ -0,0 +1,244 @@
+"""
+Shrinks rendered templates with rewrites that do not change what they
+deploy, to stay under the CloudFormation template body limits and upload
+less:
+
+    Fn::Join  - joins of strings, Refs and Fn::GetAtts become a shorter
+                Fn::Sub, or a plain string when nothing needs substituting
+    Mappings  - mappings no Fn::FindInMap reads are removed
+    JSON      - the template is written minified
+
+With prune_parameters, parameters nothing refers to are removed too. That
+is left off by default as it changes the parameters a stack accepts, and
+CloudFormation rejects values passed for undeclared parameters, as the
+master template does for every nested stack.
+
+equivalent() checks a compacted template against the original by reducing
+every Fn::Join and Fn::Sub of both to the same canonical form.
+"""
+import argparse
+import json
+import re
+import sys
+
+from output import COMPACT_SEPARATORS
+
+SUB_VARIABLE = re.compile(r'\$\{([^}]*)\}')
+
+# Sections whose values may use Fn::Sub
+REWRITTEN_SECTIONS = ('Resources', 'Outputs')
+
+
+def minify(template):
+    """Returns the minified JSON of a template dict"""
+    return json.dumps(template, sort_keys=True, separators=COMPACT_SEPARATORS)
+
+
+def _sub_part(value):
+    """Returns the Fn::Sub text of a Join item, or None when it has none"""
+    if isinstance(value, str):
+        return value.replace('${', '${!')
+    if not isinstance(value, dict) or len(value) != 1:
+        return None
+    (key, item), = value.items()
+    if key == 'Ref' and isinstance(item, str) and item != 'AWS::NoValue':
+        return '${%s}' % item
+    if (key == 'Fn::GetAtt' and isinstance(item, list) and len(item) == 2
+            and all(isinstance(part, str) for part in item)):
+        return '${%s.%s}' % tuple(item)
+    if key == 'Fn::Sub' and isinstance(item, str):
+        return item
+    return None
+
+
+def rewrite(value):
+    """Returns value with its Fn::Joins rewritten to Fn::Subs where shorter"""
+    if isinstance(value, list):
+        return [rewrite(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    value = dict((key, rewrite(item)) for key, item in value.items())
+    if list(value) != ['Fn::Join']:
+        return value
+    delimiter, items = value['Fn::Join']
+    if not isinstance(delimiter, str) or not isinstance(items, list):
+        return value
+    parts = [_sub_part(item) for item in items]
+    if any(part is None for part in parts):
+        return value
+    text = delimiter.replace('${', '${!').join(parts)
+    if not SUB_VARIABLE.search(text.replace('${!', '')):
+        return text.replace('${!', '${')
+    sub = {'Fn::Sub': text}
+    return sub if len(minify(sub)) < len(minify(value)) else value
+
+
+def _references(value, refs, maps):
+    if isinstance(value, list):
+        for item in value:
+            _references(item, refs, maps)
+    elif isinstance(value, dict):
+        if len(value) == 1:
+            (key, item), = value.items()
+            if key == 'Ref' and isinstance(item, str):
+                refs.add(item)
+            elif key == 'Fn::FindInMap' and isinstance(item, list) and isinstance(item[0], str):
+                maps.add(item[0])
+            elif key == 'Fn::Sub':
+                text = item[0] if isinstance(item, list) else item
+                refs.update(name.split('.')[0] for name in SUB_VARIABLE.findall(text)
+                            if not name.startswith('!'))
+        for item in value.values():
+            _references(item, refs, maps)
+
+
+def references(template):
+    """Returns the names Refs and Fn::Subs use and the mappings Fn::FindInMap reads"""
+    refs, maps = set(), set()
+    for section, value in template.items():
+        if section not in ('Parameters', 'Mappings'):
+            _references(value, refs, maps)
+    return refs, maps
+
+
+def compact_template(template, prune_parameters=False):
+    """Returns the compacted copy of a template dict and the names of what was removed"""
+    compacted = dict(template)
+    for section in REWRITTEN_SECTIONS:
+        if section in compacted:
+            compacted[section] = rewrite(compacted[section])
+
+    refs, maps = references(compacted)
+    removed = []
+    mappings = compacted.get('Mappings', {})
+    unused = sorted(set(mappings) - maps)
+    if unused:
+        compacted['Mappings'] = dict(
+            (name, mapping) for name, mapping in mappings.items() if name in maps)
+        removed.extend('Mappings.%s' % name for name in unused)
+    parameters = compacted.get('Parameters', {})
+    unused = sorted(set(parameters) - refs) if prune_parameters else []
+    if unused:
+        compacted['Parameters'] = dict(
+            (name, parameter) for name, parameter in parameters.items() if name in refs)
+        removed.extend('Parameters.%s' % name for name in unused)
+    for section in ('Mappings', 'Parameters'):
+        if section in compacted and not compacted[section]:
+            del compacted[section]
+    return compacted, removed
+
+
+def _canonical_parts(value):
+    """Returns the literal and reference parts of a string valued Join or Sub, or None"""
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, dict) or len(value) != 1:
+        return None
+    (key, item), = value.items()
+    if key == 'Fn::Sub' and isinstance(item, str):
+        parts = []
+        position = 0
+        for match in SUB_VARIABLE.finditer(item):
+            parts.append(item[position:match.start()])
+            name = match.group(1)
+            if name.startswith('!'):
+                parts.append('${' + name[1:] + '}')
+            elif '.' in name:
+                parts.append({'Fn::GetAtt': name.split('.', 1)})
+            else:
+                parts.append({'Ref': name})
+            position = match.end()
+        parts.append(item[position:])
+        return parts
+    if key == 'Fn::Join' and isinstance(item, list) and isinstance(item[1], list):
+        parts = []
+        for index, element in enumerate(item[1]):
+            if index:
+                parts.append(item[0])
+            element = canonical(element)
+            nested = _canonical_parts(element)
+            parts.extend(nested if nested is not None else [element])
+        return parts
+    return None
+
+
+def canonical(value):
+    """Reduces every Fn::Join and Fn::Sub of a value to a canonical Fn::Join"""
+    if isinstance(value, list):
+        return [canonical(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    parts = _canonical_parts(value)
+    if parts is None:
+        return dict((key, canonical(item)) for key, item in value.items())
+    merged = []
+    for part in parts:
+        if isinstance(part, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += part
+        elif part != '':
+            merged.append(part)
+    if all(isinstance(part, str) for part in merged):
+        return ''.join(merged)
+    return {'Fn::Join': ['', merged]}
+
+
+def equivalent(original, compacted):
+    """Checks that a compacted template deploys the same as the original
+
+    Only unused mappings and parameters may have been removed.
+    """
+    refs, maps = references(original)
+    for section, used in (('Mappings', maps), ('Parameters', refs)):
+        kept = compacted.get(section, {})
+        for name, value in original.get(section, {}).items():
+            if name in kept:
+                if kept[name] != value:
+                    return False
+            elif name in used:
+                return False
+    others = set(original) | set(compacted)
+    others.difference_update(('Mappings', 'Parameters'))
+    return all(canonical(original.get(section)) == canonical(compacted.get(section))
+               for section in others)
+
+
+def main(argv=None):
+    """Compacts templates and reports their sizes"""
+    parser = argparse.ArgumentParser(
+        description='Compacts rendered JSON templates without changing what they deploy')
+    parser.add_argument('templates', nargs='+', help='JSON templates to compact')
+    parser.add_argument('--prune-parameters', action='store_true',
+                        help='remove parameters nothing refers to as well')
+    parser.add_argument('--in-place', action='store_true',
+                        help='overwrite the templates with their compacted versions')
+    args = parser.parse_args(argv)
+
+    failed = False
+    total_before = total_after = 0
+    for path in args.templates:
+        with open(path) as template_file:
+            body = template_file.read()
+        template = json.loads(body)
+        compacted, removed = compact_template(template, args.prune_parameters)
+        compacted_body = minify(compacted)
+        ok = equivalent(template, compacted)
+        failed = failed or not ok
+        before, after = len(body.encode('utf-8')), len(compacted_body.encode('utf-8'))
+        total_before += before
+        total_after += after
+        print('%s: %d -> %d bytes (-%.1f%%)%s%s' % (
+            path, before, after, 100.0 * (before - after) / before if before else 0,
+            ', removed %s' % ', '.join(removed) if removed else '',
+            '' if ok else ', NOT EQUIVALENT'))
+        if args.in_place and ok:
+            with open(path, 'w') as template_file:
+                template_file.write(compacted_body + '\n')
+    if len(args.templates) > 1:
+        print('total: %d -> %d bytes (-%.1f%%)' % (
+            total_before, total_after,
+            100.0 * (total_before - total_after) / total_before if total_before else 0))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
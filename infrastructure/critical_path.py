@@ -0,0 +1,359 @@
+"""
+Estimates how long creating a stack takes from the dependencies between its
+resources, and finds the chain of resources that bounds it, e.g.
+
+    InternetGatewayAttachment -> NatGateway1EIP -> NatGateway1 ->
+        DefaultPrivateRoute1
+
+Resources depend on the resources they Ref, Fn::GetAtt or Fn::Sub, and on
+their DependsOn. CloudFormation creates a resource once everything it
+depends on exists, so the creation time of a stack is the longest path
+through that graph, each resource taking the time CREATION_TIMES gives its
+type. Resources with a ResourceSignal creation policy also wait for their
+signals, SIGNAL_TIME by default, or their whole timeout with --worst-case.
+The times are typical rather than measured and can be overridden, by
+resource type or logical ID, with a JSON file.
+
+Templates are given as files, as directories of one environment's
+templates, or as batch output directories of <environment>/<stack>.json.
+The nested stacks of a master template take the time estimated for the
+template of the same stack in the same environment.
+
+DependsOn that the references already imply are reported as redundant, and
+the others on the critical path with how much removing them would save, to
+show where the stacks serialize more than they need to. The graph can be
+written as JSON or as DOT for Graphviz, with the critical path in red.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+from template_diff import TEMPLATE_EXTENSIONS, load_template, references, template_files
+
+# Typical seconds to create a resource of each type
+CREATION_TIMES = {
+    'AWS::ApplicationAutoScaling::ScalableTarget': 30,
+    'AWS::ApplicationAutoScaling::ScalingPolicy': 5,
+    'AWS::AutoScaling::AutoScalingGroup': 60,
+    'AWS::AutoScaling::LaunchConfiguration': 5,
+    'AWS::AutoScaling::ScalingPolicy': 5,
+    'AWS::AutoScaling::WarmPool': 30,
+    'AWS::CloudFormation::Stack': 60,
+    'AWS::CloudWatch::Alarm': 5,
+    'AWS::EC2::EIP': 5,
+    'AWS::EC2::InternetGateway': 15,
+    'AWS::EC2::LaunchTemplate': 5,
+    'AWS::EC2::NatGateway': 100,
+    'AWS::EC2::Route': 5,
+    'AWS::EC2::RouteTable': 5,
+    'AWS::EC2::SecurityGroup': 5,
+    'AWS::EC2::SecurityGroupIngress': 5,
+    'AWS::EC2::Subnet': 5,
+    'AWS::EC2::SubnetRouteTableAssociation': 5,
+    'AWS::EC2::VPC': 15,
+    'AWS::EC2::VPCEndpoint': 90,
+    'AWS::EC2::VPCGatewayAttachment': 15,
+    'AWS::ECS::CapacityProvider': 10,
+    'AWS::ECS::Cluster': 5,
+    'AWS::ECS::ClusterCapacityProviderAssociations': 5,
+    'AWS::ECS::Service': 120,
+    'AWS::ECS::TaskDefinition': 5,
+    'AWS::ElasticLoadBalancingV2::Listener': 5,
+    'AWS::ElasticLoadBalancingV2::ListenerRule': 5,
+    'AWS::ElasticLoadBalancingV2::LoadBalancer': 180,
+    'AWS::ElasticLoadBalancingV2::TargetGroup': 15,
+    'AWS::IAM::InstanceProfile': 120,
+    'AWS::IAM::Role': 15,
+    'AWS::Logs::LogGroup': 5,
+}
+
+# Seconds of resources of other types
+DEFAULT_CREATION_TIME = 10
+
+# Seconds a resource with a ResourceSignal creation policy waits for its
+# signals, as hosts boot and run their UserData
+SIGNAL_TIME = 180
+
+ISO_DURATION = re.compile(r'^PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?$')
+
+
+def parse_duration(duration):
+    """Returns the seconds of an ISO 8601 duration such as PT15M"""
+    match = ISO_DURATION.match(duration)
+    if not match or not any(match.groups()):
+        raise ValueError('invalid duration %r' % duration)
+    hours, minutes, seconds = (int(group or 0) for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+class Graph(object):
+    """The resources of a template, how long they take and what they wait for"""
+
+    def __init__(self, template, times=None, worst_case=False):
+        times = times or {}
+        resources = template.get('Resources', {})
+        self.types = {}
+        self.durations = {}
+        self.references = {}
+        self.depends_on = {}
+        for name, resource in resources.items():
+            resource_type = resource['Type']
+            duration = times.get(name, times.get(resource_type, CREATION_TIMES.get(
+                resource_type, DEFAULT_CREATION_TIME)))
+            signal = resource.get('CreationPolicy', {}).get('ResourceSignal')
+            if signal is not None:
+                duration += (parse_duration(signal.get('Timeout', 'PT5M')) if worst_case
+                             else times.get('ResourceSignal', SIGNAL_TIME))
+            depends_on = resource.get('DependsOn', [])
+            if isinstance(depends_on, str):
+                depends_on = [depends_on]
+            self.types[name] = resource_type
+            self.durations[name] = duration
+            self.references[name] = references([
+                resource.get('Properties', {}), resource.get('Metadata', {}),
+            ]) & set(resources)
+            self.depends_on[name] = set(depends_on)
+        self.order = self._topological_order()
+
+    def dependencies(self, name, without=None):
+        """Returns what a resource waits for, leaving out the without edge"""
+        dependencies = self.references[name] | self.depends_on[name]
+        if without is not None and without[1] == name and without[0] not in self.references[name]:
+            dependencies = dependencies - {without[0]}
+        return dependencies
+
+    def _topological_order(self):
+        waiting = dict((name, len(self.dependencies(name))) for name in self.types)
+        dependents = dict((name, []) for name in self.types)
+        for name in self.types:
+            for dependency in self.dependencies(name):
+                dependents[dependency].append(name)
+        ready = sorted(name for name, count in waiting.items() if not count)
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for dependent in sorted(dependents[name]):
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    ready.append(dependent)
+        if len(order) != len(self.types):
+            raise ValueError('circular dependency between %s' % ', '.join(
+                sorted(set(self.types) - set(order))))
+        return order
+
+    def schedule(self, without=None):
+        """Returns the earliest {resource: (start, finish)} seconds"""
+        times = {}
+        for name in self.order:
+            start = max([times[dependency][1]
+                         for dependency in self.dependencies(name, without)] or [0])
+            times[name] = (start, start + self.durations[name])
+        return times
+
+    def total(self, without=None):
+        """Returns the seconds until every resource is created"""
+        return max([finish for _, finish in self.schedule(without).values()] or [0])
+
+    def critical_path(self, times=None):
+        """Returns the resources of the longest chain, in creation order"""
+        times = times or self.schedule()
+        if not times:
+            return []
+        name = max(sorted(times), key=lambda resource: times[resource][1])
+        path = [name]
+        while times[name][0]:
+            name = max(sorted(self.dependencies(name)), key=lambda dependency: times[dependency][1])
+            path.append(name)
+        return path[::-1]
+
+    def slack(self, times=None):
+        """Returns how many seconds each resource could be delayed without delaying the stack"""
+        times = times or self.schedule()
+        total = max([finish for _, finish in times.values()] or [0])
+        latest = dict((name, total) for name in self.types)
+        for name in reversed(self.order):
+            for dependency in self.dependencies(name):
+                latest[dependency] = min(latest[dependency],
+                                         latest[name] - self.durations[name])
+        return dict((name, latest[name] - times[name][1]) for name in self.types)
+
+    def redundant_depends_on(self):
+        """Returns the (dependency, resource) DependsOn the other edges already imply"""
+        ancestors = {}
+        for name in self.order:
+            ancestors[name] = set()
+            for dependency in self.dependencies(name):
+                ancestors[name] |= ancestors[dependency] | {dependency}
+        redundant = []
+        for name in self.order:
+            for dependency in sorted(self.depends_on[name]):
+                others = self.dependencies(name) - {dependency}
+                if dependency in self.references[name] or any(
+                        dependency in ancestors[other] for other in others):
+                    redundant.append((dependency, name))
+        return redundant
+
+    def serializing_depends_on(self):
+        """Returns (dependency, resource, seconds saved) of DependsOn that lengthen creation"""
+        total = self.total()
+        redundant = set(self.redundant_depends_on())
+        found = []
+        for name in self.order:
+            for dependency in sorted(self.depends_on[name]):
+                if (dependency, name) not in redundant:
+                    saved = total - self.total(without=(dependency, name))
+                    if saved > 0:
+                        found.append((dependency, name, saved))
+        return found
+
+    def to_dict(self):
+        """Returns the graph and its analysis as a JSON-serializable dict"""
+        times = self.schedule()
+        slack = self.slack(times)
+        return {
+            'total': max([finish for _, finish in times.values()] or [0]),
+            'critical_path': self.critical_path(times),
+            'resources': dict((name, {
+                'type': self.types[name],
+                'duration': self.durations[name],
+                'start': times[name][0],
+                'finish': times[name][1],
+                'slack': slack[name],
+            }) for name in self.order),
+            'edges': [{'from': dependency, 'to': name,
+                       'kind': 'reference' if dependency in self.references[name]
+                       else 'depends_on'}
+                      for name in self.order for dependency in sorted(self.dependencies(name))],
+            'redundant_depends_on': [list(edge) for edge in self.redundant_depends_on()],
+            'serializing_depends_on': [list(edge) for edge in self.serializing_depends_on()],
+        }
+
+    def to_dot(self, name='stack'):
+        """Returns the graph as a DOT subgraph with the critical path in red"""
+        path = self.critical_path()
+        critical_edges = set(zip(path, path[1:]))
+        redundant = set(self.redundant_depends_on())
+        lines = ['subgraph "cluster_%s" {' % name, '    label="%s (%ds)";' % (
+            name, self.total())]
+        for resource in self.order:
+            lines.append('    "%s/%s" [label="%s\\n%s\\n%ds"%s];' % (
+                name, resource, resource, self.types[resource], self.durations[resource],
+                ', color=red' if resource in path else ''))
+        for resource in self.order:
+            for dependency in sorted(self.dependencies(resource)):
+                attributes = []
+                if (dependency, resource) in critical_edges:
+                    attributes.append('color=red')
+                if dependency not in self.references[resource]:
+                    attributes.append('style=dashed')
+                if (dependency, resource) in redundant:
+                    attributes.append('label="redundant"')
+                lines.append('    "%s/%s" -> "%s/%s"%s;' % (
+                    name, dependency, name, resource,
+                    ' [%s]' % ', '.join(attributes) if attributes else ''))
+        lines.append('}')
+        return '\n'.join(lines)
+
+
+def template_paths(paths):
+    """Returns {(environment, stack): file} for templates and their directories
+
+    A directory holding templates is one environment, named after it, and
+    any other directory a batch output directory.
+    """
+    files = {}
+    for path in paths:
+        if not os.path.isdir(path):
+            files['-', os.path.splitext(os.path.basename(path))[0]] = path
+            continue
+        environment = os.path.basename(os.path.normpath(path))
+        for file_name in sorted(os.listdir(path)):
+            stack, extension = os.path.splitext(file_name)
+            if extension in TEMPLATE_EXTENSIONS and os.path.isfile(
+                    os.path.join(path, file_name)):
+                files[environment, stack] = os.path.join(path, file_name)
+        files.update(template_files(path))
+    return files
+
+
+def analyze(paths, times=None, worst_case=False):
+    """Returns {(environment, stack): Graph} of the templates at paths
+
+    Nested stacks take the time estimated for the template of the same
+    stack in the same environment.
+    """
+    graphs = {}
+    files = template_paths(paths)
+    templates = dict((key, load_template(path)) for key, path in files.items())
+    nested = dict((key, any(resource['Type'] == 'AWS::CloudFormation::Stack'
+                            for resource in template.get('Resources', {}).values()))
+                  for key, template in templates.items())
+    for key in sorted(templates, key=lambda key: (nested[key], key)):
+        stack_times = dict(times or {})
+        if nested[key]:
+            for name, resource in templates[key].get('Resources', {}).items():
+                child = graphs.get((key[0], name))
+                if resource['Type'] == 'AWS::CloudFormation::Stack' and child is not None:
+                    stack_times.setdefault(name, child.total())
+        graphs[key] = Graph(templates[key], stack_times, worst_case)
+    return graphs
+
+
+def describe(name, graph, stream=sys.stdout):
+    """Prints the critical path and the DependsOn worth revisiting of a graph"""
+    times = graph.schedule()
+    print('%s: %ds' % (name, graph.total()), file=stream)
+    for resource in graph.critical_path(times):
+        start, finish = times[resource]
+        print('    %5ds %5ds  %-36s %s' % (start, finish, resource, graph.types[resource]),
+              file=stream)
+    for dependency, resource in graph.redundant_depends_on():
+        print('    redundant DependsOn %s -> %s' % (dependency, resource), file=stream)
+    for dependency, resource, saved in graph.serializing_depends_on():
+        print('    DependsOn %s -> %s adds %ds' % (dependency, resource, saved), file=stream)
+
+
+def main(argv=None):
+    """Prints the critical paths of templates"""
+    parser = argparse.ArgumentParser(
+        description='Estimates stack creation times from the resource dependencies')
+    parser.add_argument('paths', nargs='+', help='templates or batch output directories')
+    parser.add_argument('--times', type=argparse.FileType('r'),
+                        help='JSON file of seconds by resource type or logical ID')
+    parser.add_argument('--worst-case', action='store_true',
+                        help='wait the whole timeout of resource signals')
+    parser.add_argument('--format', choices=('text', 'json', 'dot'), default='text',
+                        help='output format (default: text)')
+    args = parser.parse_args(argv)
+
+    try:
+        graphs = analyze(args.paths, json.load(args.times) if args.times else None,
+                         args.worst_case)
+    except (IOError, ValueError) as error:
+        print(error, file=sys.stderr)
+        return 1
+    if not graphs:
+        print('no templates found in %s' % ', '.join(args.paths), file=sys.stderr)
+        return 1
+    names = dict((key, key[1] if key[0] == '-' else '%s/%s' % key) for key in graphs)
+    if args.format == 'json':
+        json.dump(dict((names[key], graph.to_dict()) for key, graph in graphs.items()),
+                  sys.stdout, indent=4, sort_keys=True)
+        print()
+    elif args.format == 'dot':
+        print('digraph stacks {')
+        print('    node [shape=box];')
+        for key in sorted(graphs):
+            print(graphs[key].to_dot(names[key]))
+        print('}')
+    else:
+        for key in sorted(graphs):
+            describe(names[key], graphs[key])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
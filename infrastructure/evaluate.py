@@ -0,0 +1,412 @@
+"""
+Resolves the intrinsic functions of a rendered template offline, for a
+region, its availability zones and parameter values, so what a stack would
+create can be checked without deploying it:
+
+    Ref, Fn::Sub, Fn::Join, Fn::Select, Fn::Split, Fn::GetAZs, Fn::Cidr,
+    Fn::FindInMap, Fn::Base64, Fn::If and the condition functions
+
+Refs to resources resolve to their physical IDs when given and to their
+logical IDs otherwise, and Fn::GetAtt and Fn::ImportValue to the given
+values or to "{Resource.Attribute}" and "{Import:Name}" placeholders.
+Parameters without a value take their default, and SSM parameter types
+resolve to the parameter name rather than its value.
+
+An Evaluator compiles a template once, folding everything that does not
+depend on the region or the parameters into constants, and memoizes the
+Refs, attributes and conditions of each evaluation as well as the results
+of recent evaluations, so many environment and region combinations of one
+template evaluate quickly. Results share their constant parts and must not
+be modified.
+"""
+import argparse
+import base64
+import collections
+import ipaddress
+import itertools
+import json
+import re
+import sys
+
+SUB_VARIABLE = re.compile(r'\$\{([^}]*)\}')
+
+# Results of the most recent evaluations kept per Evaluator
+CACHE_SIZE = 256
+
+GETATT_PLACEHOLDER = '{%s.%s}'
+IMPORT_PLACEHOLDER = '{Import:%s}'
+
+
+class _NoValue(object):
+    """The value of Ref AWS::NoValue, removing the property that uses it"""
+
+    def __repr__(self):
+        return 'AWS::NoValue'
+
+
+NO_VALUE = _NoValue()
+
+
+class _Constant(object):
+    """A compiled value that is the same in every evaluation"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, context):
+        return self.value
+
+
+def default_azs(region):
+    """Returns the first three availability zones of a region"""
+    return ['%s%s' % (region, letter) for letter in 'abc']
+
+
+def pseudo_parameters(region, account_id='123456789012', stack_name='stack'):
+    """Returns the pseudo parameter values of a stack in a region"""
+    partition, url_suffix = 'aws', 'amazonaws.com'
+    if region.startswith('cn-'):
+        partition, url_suffix = 'aws-cn', 'amazonaws.com.cn'
+    elif region.startswith('us-gov-'):
+        partition = 'aws-us-gov'
+    return {
+        'AWS::AccountId': account_id,
+        'AWS::NotificationARNs': [],
+        'AWS::NoValue': NO_VALUE,
+        'AWS::Partition': partition,
+        'AWS::Region': region,
+        'AWS::StackId': 'arn:%s:cloudformation:%s:%s:stack/%s/%s' % (
+            partition, region, account_id, stack_name,
+            '00000000-0000-0000-0000-000000000000'),
+        'AWS::StackName': stack_name,
+        'AWS::URLSuffix': url_suffix,
+    }
+
+
+class Context(object):
+    """The inputs and memoized lookups of one evaluation"""
+
+    def __init__(self, evaluator, region, azs, parameters, pseudo, physical_ids,
+                 attributes, imports):
+        self.evaluator = evaluator
+        self.region = region
+        self.azs = azs
+        self.values = dict(pseudo)
+        self.values.update(parameters)
+        self.physical_ids = physical_ids
+        self.attributes = attributes
+        self.imports = imports
+        self.conditions = {}
+
+    def ref(self, name):
+        if name not in self.values:
+            if name not in self.evaluator.resources:
+                raise ValueError('Ref to unknown parameter or resource %r' % name)
+            self.values[name] = self.physical_ids.get(name, name)
+        return self.values[name]
+
+    def get_att(self, name, attribute):
+        key = '%s.%s' % (name, attribute)
+        if key not in self.values:
+            if name not in self.evaluator.resources:
+                raise ValueError('Fn::GetAtt of unknown resource %r' % name)
+            self.values[key] = self.attributes.get(key, GETATT_PLACEHOLDER % (name, attribute))
+        return self.values[key]
+
+    def condition(self, name):
+        if name not in self.conditions:
+            if name not in self.evaluator.conditions:
+                raise ValueError('unknown condition %r' % name)
+            self.conditions[name] = bool(self.evaluator.conditions[name](self))
+        return self.conditions[name]
+
+
+def _is_constant(*compiled):
+    return all(isinstance(item, _Constant) for item in compiled)
+
+
+def _fold(function, *compiled):
+    """Compiles function of the compiled arguments, folding it if they are constants"""
+    if _is_constant(*compiled):
+        return _Constant(function(*[item.value for item in compiled]))
+    return lambda context: function(*[item(context) for item in compiled])
+
+
+def _string(value, function):
+    if not isinstance(value, str):
+        raise ValueError('%s needs a string, not %r' % (function, value))
+    return value
+
+
+def _compile_ref(name):
+    return lambda context: context.ref(name)
+
+
+def _compile_get_att(name, attribute):
+    return lambda context: context.get_att(name, attribute)
+
+
+def _compile_sub(argument, compile_value):
+    if isinstance(argument, list):
+        text, variables = argument
+        variables = dict((name, compile_value(value)) for name, value in variables.items())
+    else:
+        text, variables = argument, {}
+    parts = []
+    position = 0
+    for match in SUB_VARIABLE.finditer(text):
+        parts.append(_Constant(text[position:match.start()]))
+        name = match.group(1)
+        if name.startswith('!'):
+            parts.append(_Constant('${%s}' % name[1:]))
+        elif name in variables:
+            parts.append(variables[name])
+        elif '.' in name:
+            parts.append(_compile_get_att(*name.split('.', 1)))
+        else:
+            parts.append(_compile_ref(name))
+        position = match.end()
+    parts.append(_Constant(text[position:]))
+    return _fold(lambda *values: ''.join(_string(value, 'Fn::Sub') for value in values),
+                 *parts)
+
+
+def _select(index, values):
+    index = int(index)
+    if not 0 <= index < len(values):
+        raise ValueError('Fn::Select index %d out of range of %r' % (index, values))
+    return values[index]
+
+
+def _cidr(block, count, bits):
+    network = ipaddress.ip_network(block)
+    count, bits = int(count), int(bits)
+    if not 0 <= bits <= network.max_prefixlen - network.prefixlen:
+        raise ValueError('Fn::Cidr cannot split %s into /%d blocks' % (
+            block, network.max_prefixlen - bits))
+    cidrs = [str(cidr) for cidr in itertools.islice(
+        network.subnets(new_prefix=network.max_prefixlen - bits), count)]
+    if len(cidrs) < count:
+        raise ValueError('Fn::Cidr found %d of the %d blocks asked for in %s' % (
+            len(cidrs), count, block))
+    return cidrs
+
+
+def _find_in_map(mappings):
+    def find(name, key, value):
+        try:
+            return mappings[name][key][value]
+        except KeyError:
+            raise ValueError('Fn::FindInMap found no %s/%s/%s' % (name, key, value))
+    return find
+
+
+def _base64(value):
+    return base64.b64encode(_string(value, 'Fn::Base64').encode('utf-8')).decode('ascii')
+
+
+class Evaluator(object):
+    """A template compiled for evaluation in any region with any parameters"""
+
+    def __init__(self, template, cache_size=CACHE_SIZE):
+        self.parameters = template.get('Parameters', {})
+        self.mappings = template.get('Mappings', {})
+        self.resources = template.get('Resources', {})
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self.conditions = dict(
+            (name, self.compile(value)) for name, value in template.get('Conditions', {}).items())
+        self.compiled_resources = dict(
+            (name, self._compile_resource(resource))
+            for name, resource in self.resources.items())
+        self.outputs = dict(
+            (name, (output.get('Condition'), self.compile(output['Value'])))
+            for name, output in template.get('Outputs', {}).items())
+
+    def _compile_resource(self, resource):
+        from template_diff import references
+
+        depends_on = resource.get('DependsOn', [])
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        dependencies = references([resource.get('Properties', {}), resource.get('Metadata', {})])
+        dependencies = sorted((dependencies & set(self.resources)) | set(depends_on))
+        return (resource.get('Condition'), resource['Type'], dependencies,
+                self.compile(resource.get('Properties', {})),
+                self.compile(resource['Metadata']) if 'Metadata' in resource else None)
+
+    def compile(self, value):
+        """Compiles a template value to a function of a Context"""
+        if isinstance(value, list):
+            items = [self.compile(item) for item in value]
+            return _fold(lambda *values: [item for item in values if item is not NO_VALUE],
+                         *items)
+        if not isinstance(value, dict):
+            return _Constant(value)
+        if len(value) == 1:
+            (key, argument), = value.items()
+            if key == 'Ref':
+                return _compile_ref(argument)
+            if key == 'Condition':
+                return lambda context: context.condition(argument)
+            if key.startswith('Fn::'):
+                return self._compile_function(key, argument)
+        keys = list(value)
+        items = [self.compile(value[key]) for key in keys]
+        return _fold(lambda *values: dict(
+            (key, item) for key, item in zip(keys, values) if item is not NO_VALUE), *items)
+
+    def _compile_function(self, function, argument):
+        if function == 'Fn::GetAtt':
+            name, attribute = (argument if isinstance(argument, list)
+                               else argument.split('.', 1))
+            return _compile_get_att(name, attribute)
+        if function == 'Fn::Sub':
+            return _compile_sub(argument, self.compile)
+        if function == 'Fn::If':
+            condition, if_true, if_false = argument
+            if_true, if_false = self.compile(if_true), self.compile(if_false)
+            return lambda context: (if_true if context.condition(condition)
+                                    else if_false)(context)
+        if function == 'Fn::GetAZs':
+            region = self.compile(argument)
+            return lambda context: list(
+                context.azs if region(context) in ('', context.region)
+                else default_azs(region(context)))
+        arguments = [self.compile(item) for item in argument] if isinstance(
+            argument, list) else [self.compile(argument)]
+        if function == 'Fn::Join':
+            return _fold(lambda delimiter, values: delimiter.join(
+                _string(value, 'Fn::Join') for value in values), *arguments)
+        if function == 'Fn::Select':
+            return _fold(_select, *arguments)
+        if function == 'Fn::Split':
+            return _fold(lambda delimiter, value: value.split(delimiter), *arguments)
+        if function == 'Fn::Cidr':
+            return _fold(_cidr, *arguments)
+        if function == 'Fn::FindInMap':
+            return _fold(_find_in_map(self.mappings), *arguments)
+        if function == 'Fn::Base64':
+            return _fold(_base64, *arguments)
+        if function == 'Fn::ImportValue':
+            name, = arguments
+            return lambda context: context.imports.get(
+                name(context), IMPORT_PLACEHOLDER % name(context))
+        if function == 'Fn::Equals':
+            return _fold(lambda first, second: first == second, *arguments)
+        if function == 'Fn::Not':
+            return _fold(lambda value: not value, *arguments)
+        if function == 'Fn::And':
+            return _fold(lambda *values: all(values), *arguments)
+        if function == 'Fn::Or':
+            return _fold(lambda *values: any(values), *arguments)
+        raise ValueError('cannot evaluate %s' % function)
+
+    def parameter_values(self, parameters):
+        """Returns the value of every parameter, taking defaults for the missing ones"""
+        unknown = sorted(set(parameters) - set(self.parameters))
+        if unknown:
+            raise ValueError('unknown parameters %s' % ', '.join(unknown))
+        values = {}
+        for name, parameter in self.parameters.items():
+            value = parameters.get(name, parameter.get('Default'))
+            if value is None:
+                raise ValueError('no value for parameter %s' % name)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            allowed = parameter.get('AllowedValues')
+            if allowed is not None and value not in [str(item) for item in allowed]:
+                raise ValueError('parameter %s is %r, not one of %s' % (
+                    name, value, ', '.join(map(str, allowed))))
+            parameter_type = parameter['Type']
+            if isinstance(value, str) and (
+                    parameter_type == 'CommaDelimitedList' or parameter_type.startswith('List<')):
+                value = value.split(',')
+            values[name] = value
+        return values
+
+    def evaluate(self, region='us-east-1', azs=None, parameters=None, physical_ids=None,
+                 attributes=None, imports=None, account_id='123456789012', stack_name='stack'):
+        """Resolves the resources and outputs of the template
+
+        Returns a dict with the Type, Dependencies and resolved Properties and
+        Metadata of the resources created, and the resolved Outputs.
+        """
+        key = (region, tuple(azs or ()), json.dumps(
+            [parameters, physical_ids, attributes, imports], sort_keys=True),
+            account_id, stack_name)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        context = Context(self, region, list(azs or default_azs(region)),
+                          self.parameter_values(parameters or {}),
+                          pseudo_parameters(region, account_id, stack_name),
+                          physical_ids or {}, attributes or {}, imports or {})
+        resources = {}
+        for name, compiled in self.compiled_resources.items():
+            condition, resource_type, dependencies, properties, metadata = compiled
+            if condition is not None and not context.condition(condition):
+                continue
+            resource = {'Type': resource_type, 'Dependencies': dependencies,
+                        'Properties': properties(context)}
+            if metadata is not None:
+                resource['Metadata'] = metadata(context)
+            resources[name] = resource
+        outputs = dict(
+            (name, value(context)) for name, (condition, value) in self.outputs.items()
+            if condition is None or context.condition(condition))
+        result = {'Resources': resources, 'Outputs': outputs}
+
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+
+def evaluate_template(template, region='us-east-1', azs=None, parameters=None, **options):
+    """Resolves a template dict once, see Evaluator.evaluate"""
+    return Evaluator(template).evaluate(region, azs, parameters, **options)
+
+
+def main(argv=None):
+    """Prints the resolved resources and outputs of a template"""
+    parser = argparse.ArgumentParser(
+        description='Resolves the intrinsic functions of a template for a region and parameters')
+    parser.add_argument('template', help='JSON or YAML template')
+    parser.add_argument('--region', default='us-east-1', help='region (default: us-east-1)')
+    parser.add_argument('--azs', help='comma separated availability zones of the region '
+                                      '(default: its a, b and c zones)')
+    parser.add_argument('-p', '--parameter', action='append', default=[], metavar='NAME=VALUE',
+                        help='parameter value, repeated for each parameter')
+    parser.add_argument('--resource', action='append',
+                        help='only print this resource, repeated for each resource')
+    args = parser.parse_args(argv)
+
+    from template_diff import load_template
+
+    parameters = {}
+    for parameter in args.parameter:
+        name, separator, value = parameter.partition('=')
+        if not separator:
+            parser.error('parameters are given as NAME=VALUE, not %r' % parameter)
+        parameters[name] = value
+    try:
+        result = evaluate_template(load_template(args.template), args.region,
+                                   args.azs.split(',') if args.azs else None, parameters)
+    except ValueError as error:
+        print('%s: %s' % (args.template, error), file=sys.stderr)
+        return 1
+    if args.resource:
+        unknown = sorted(set(args.resource) - set(result['Resources']))
+        if unknown:
+            parser.error('unknown resources %s' % ', '.join(unknown))
+        result = dict((name, result['Resources'][name]) for name in args.resource)
+    json.dump(result, sys.stdout, indent=4, sort_keys=True)
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+ECS agent and kernel settings for the ECS hosts.
+
+A HostTuning is turned into ECS agent variables for /etc/ecs/ecs.config and
+kernel parameters for /etc/sysctl.d, which ECSCluster.py writes either
+through cfn-init or directly from UserData depending on the boot mode. The
+defaults favour task launch latency and connection heavy workloads over the
+agent's own defaults, which re-pull images on every launch and keep the
+kernel's small connection queues.
+"""
+import json
+import re
+from dataclasses import dataclass, field, fields
+
+IMAGE_PULL_BEHAVIORS = ('default', 'always', 'once', 'prefer-cached')
+
+# Where the kernel parameters are written on the hosts
+SYSCTL_FILE = '/etc/sysctl.d/90-ecs-host-tuning.conf'
+
+# Durations as the ECS agent parses them, e.g. 30s, 10m or 3h
+AGENT_DURATION = re.compile(r'^\d+(ns|us|ms|s|m|h)$')
+
+
+@dataclass(frozen=True)
+class HostTuning(object):
+    """ECS agent and kernel settings of the hosts
+
+    image_pull_behavior reuses cached images with prefer-cached, and images
+    unused for image_minimum_cleanup_age are deleted every
+    image_cleanup_interval. task_eni_trunking lets a host attach more awsvpc
+    tasks than it has ENIs, once the awsvpcTrunking account setting is
+    enabled. sysctls holds further kernel parameters by name.
+    """
+    image_pull_behavior: str = 'prefer-cached'
+    image_cleanup_interval: str = '10m'
+    image_minimum_cleanup_age: str = '30m'
+    images_deleted_per_cycle: int = 10
+    task_cleanup_wait: str = '1h'
+    task_eni_trunking: bool = True
+    container_stop_timeout: str = '30s'
+    log_drivers: tuple = ('json-file', 'awslogs')
+    somaxconn: int = 4096
+    ip_local_port_range: tuple = (1024, 65000)
+    nf_conntrack_max: int = 262144
+    sysctls: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.image_pull_behavior not in IMAGE_PULL_BEHAVIORS:
+            raise ValueError('unknown image pull behavior %r, expected one of %s' % (
+                self.image_pull_behavior, ', '.join(IMAGE_PULL_BEHAVIORS)))
+        for name in ('image_cleanup_interval', 'image_minimum_cleanup_age',
+                     'task_cleanup_wait', 'container_stop_timeout'):
+            if not AGENT_DURATION.match(getattr(self, name)):
+                raise ValueError('%s must be a duration such as 30s or 10m, got %r' % (
+                    name, getattr(self, name)))
+        for name in ('images_deleted_per_cycle', 'somaxconn', 'nf_conntrack_max'):
+            if getattr(self, name) < 1:
+                raise ValueError('%s must be positive, got %r' % (name, getattr(self, name)))
+        if not self.log_drivers:
+            raise ValueError('at least one log driver must be available')
+        low, high = self.ip_local_port_range
+        if not 1024 <= low < high <= 65535:
+            raise ValueError('ip_local_port_range must be within 1024-65535, got %s-%s' % (
+                low, high))
+        # Lists from JSON manifests are stored as tuples
+        object.__setattr__(self, 'log_drivers', tuple(self.log_drivers))
+        object.__setattr__(self, 'ip_local_port_range', tuple(self.ip_local_port_range))
+
+    @classmethod
+    def from_options(cls, options):
+        """Returns the HostTuning for None, a dict of fields or a HostTuning"""
+        if options is None or isinstance(options, cls):
+            return options
+        unknown = set(options) - set(option.name for option in fields(cls))
+        if unknown:
+            raise ValueError('unknown host tuning options %s' % ', '.join(sorted(unknown)))
+        return cls(**options)
+
+    def ecs_config(self):
+        """Returns the (name, value) pairs of the ECS agent variables"""
+        config = [
+            ('ECS_IMAGE_PULL_BEHAVIOR', self.image_pull_behavior),
+            ('ECS_IMAGE_CLEANUP_INTERVAL', self.image_cleanup_interval),
+            ('ECS_IMAGE_MINIMUM_CLEANUP_AGE', self.image_minimum_cleanup_age),
+            ('ECS_NUM_IMAGES_DELETE_PER_CYCLE', str(self.images_deleted_per_cycle)),
+            ('ECS_ENGINE_TASK_CLEANUP_WAIT_DURATION', self.task_cleanup_wait),
+            ('ECS_CONTAINER_STOP_TIMEOUT', self.container_stop_timeout),
+            ('ECS_AVAILABLE_LOGGING_DRIVERS', json.dumps(list(self.log_drivers))),
+        ]
+        if self.task_eni_trunking:
+            config.extend([
+                ('ECS_ENABLE_TASK_ENI', 'true'),
+                ('ECS_ENABLE_HIGH_DENSITY_ENI', 'true'),
+            ])
+        return config
+
+    def kernel_parameters(self):
+        """Returns the (name, value) pairs of the kernel parameters, sorted by name"""
+        parameters = {
+            'net.core.somaxconn': str(self.somaxconn),
+            'net.ipv4.tcp_max_syn_backlog': str(self.somaxconn),
+            'net.ipv4.ip_local_port_range': '%d %d' % self.ip_local_port_range,
+            'net.netfilter.nf_conntrack_max': str(self.nf_conntrack_max),
+        }
+        parameters.update((name, str(value)) for name, value in self.sysctls.items())
+        return sorted(parameters.items())
+
+    def sysctl_conf(self):
+        """Returns the contents of SYSCTL_FILE"""
+        return ''.join('%s = %s\n' % parameter for parameter in self.kernel_parameters())
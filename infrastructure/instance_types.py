@@ -0,0 +1,88 @@
+"""
+The EC2 instance families the ECS hosts can be built from, and the CPU
+architecture of each. A family's instance types are its name and one of its
+sizes, e.g. c6g.xlarge; the architecture decides which ECS-optimized AMI the
+hosts boot from.
+"""
+
+BURSTABLE_SIZES = ('nano', 'micro', 'small', 'medium', 'large', 'xlarge', '2xlarge')
+
+# Sizes of the 6th generation Intel families
+INTEL_SIZES = ('large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge', '16xlarge',
+               '24xlarge', '32xlarge')
+
+# Sizes of the 7th generation Intel families
+INTEL_7_SIZES = ('large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge', '16xlarge',
+                 '24xlarge', '48xlarge')
+
+GRAVITON_SIZES = ('medium', 'large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge',
+                  '16xlarge')
+
+# Family -> (architecture, sizes)
+INSTANCE_FAMILIES = {
+    # Burstable
+    't2': ('x86_64', BURSTABLE_SIZES),
+    't3': ('x86_64', BURSTABLE_SIZES),
+    't3a': ('x86_64', BURSTABLE_SIZES),
+    't4g': ('arm64', BURSTABLE_SIZES),
+    # Compute optimized
+    'c5': ('x86_64', ('large', 'xlarge', '2xlarge', '4xlarge', '9xlarge', '12xlarge',
+                      '18xlarge', '24xlarge')),
+    'c6i': ('x86_64', INTEL_SIZES),
+    'c7i': ('x86_64', INTEL_7_SIZES),
+    'c6g': ('arm64', GRAVITON_SIZES),
+    'c7g': ('arm64', GRAVITON_SIZES),
+    # General purpose
+    'm5': ('x86_64', ('large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge',
+                      '16xlarge', '24xlarge')),
+    'm6i': ('x86_64', INTEL_SIZES),
+    'm7i': ('x86_64', INTEL_7_SIZES),
+    'm6g': ('arm64', GRAVITON_SIZES),
+    'm7g': ('arm64', GRAVITON_SIZES),
+    # Memory optimized
+    'r5': ('x86_64', ('large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge',
+                      '16xlarge', '24xlarge')),
+    'r6i': ('x86_64', INTEL_SIZES),
+    'r7i': ('x86_64', INTEL_7_SIZES),
+    'r6g': ('arm64', GRAVITON_SIZES),
+    'r7g': ('arm64', GRAVITON_SIZES),
+}
+
+ARCHITECTURES = ('x86_64', 'arm64')
+
+
+def family_instance_types(family):
+    """Returns the instance types of a family, smallest first"""
+    if family not in INSTANCE_FAMILIES:
+        raise ValueError('unknown instance family %r, expected one of %s' % (
+            family, ', '.join(sorted(INSTANCE_FAMILIES))))
+    _, sizes = INSTANCE_FAMILIES[family]
+    return ['%s.%s' % (family, size) for size in sizes]
+
+
+def instance_architecture(instance_type):
+    """Returns the architecture of an instance type, validating its family and size"""
+    family, _, size = instance_type.partition('.')
+    if family not in INSTANCE_FAMILIES:
+        raise ValueError('instance type %r is not of a known family, expected one of %s' % (
+            instance_type, ', '.join(sorted(INSTANCE_FAMILIES))))
+    architecture, sizes = INSTANCE_FAMILIES[family]
+    if size not in sizes:
+        raise ValueError('the %s family has no %r size, expected one of %s' % (
+            family, size, ', '.join(sizes)))
+    return architecture
+
+
+def common_architecture(instance_types):
+    """Returns the architecture shared by instance types
+
+    The hosts of an Auto Scaling Group boot from a single AMI, so mixing
+    x86_64 and arm64 instance types raises ValueError.
+    """
+    architectures = dict((instance_architecture(instance_type), instance_type)
+                         for instance_type in instance_types)
+    if len(architectures) != 1:
+        raise ValueError('instance types must share one architecture, got %s' % ', '.join(
+            '%s (%s)' % (instance_type, architecture)
+            for architecture, instance_type in sorted(architectures.items())))
+    return next(iter(architectures))
@@ -0,0 +1,199 @@
+"""
+Opt-in tracing of where the time goes while templates are generated.
+
+Tracing is enabled with --trace FILE on the stack scripts and batch.py, or
+by setting TEMPLATE_TRACE=FILE. When enabled, troposphere and awacs are
+hooked to record a span for:
+
+    template    - every Template.add_resource, add_parameter and add_output
+    troposphere - constructing a resource or property, which validates the
+                  type of each property as it is set, and validating it
+                  when it is encoded
+    awacs       - constructing a policy document, statement...
+    output      - serializing the template
+
+as well as rendering and writing each template of a batch. Spans record the
+change in sys.getallocatedblocks() as allocated_blocks. The trace is written
+on exit in the Chrome trace event format, which chrome://tracing and
+Perfetto open, with the spans of batch worker processes merged in.
+
+When tracing is off nothing is hooked, and span() returns a shared no-op
+context manager.
+"""
+import os
+import sys
+import threading
+import time
+
+ENVIRONMENT_VARIABLE = 'TEMPLATE_TRACE'
+
+# The recorded events, None when tracing is off
+_events = None
+
+# The process that recorded them, as forked workers inherit them
+_pid = None
+
+# The file the trace is written to on exit
+_trace_path = None
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def _now():
+    return time.perf_counter_ns() / 1e3
+
+
+class _Span(object):
+    __slots__ = ('name', 'category', 'args', 'started', 'blocks')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.blocks = sys.getallocatedblocks()
+        self.started = _now()
+        return self
+
+    def __exit__(self, *exc_info):
+        finished = _now()
+        self.args['allocated_blocks'] = sys.getallocatedblocks() - self.blocks
+        _record(self.name, self.category, self.started, finished, self.args)
+        return False
+
+
+def _record(name, category, started, finished, args):
+    if _events is not None:
+        _events.append({
+            'name': name, 'cat': category, 'ph': 'X', 'ts': started,
+            'dur': finished - started, 'pid': os.getpid(),
+            'tid': threading.get_native_id(), 'args': args,
+        })
+
+
+def enabled():
+    """Checks whether tracing is on"""
+    return _events is not None
+
+
+def span(name, category='build', **args):
+    """Returns a context manager recording a span while tracing is on"""
+    if _events is None:
+        return NULL_SPAN
+    return _Span(name, category, args)
+
+
+def _traced(function, category, describe):
+    """Wraps function to record a span named by describe(*args)"""
+    def traced(*args, **kwargs):
+        blocks = sys.getallocatedblocks()
+        started = _now()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finished = _now()
+            name, span_args = describe(*args)
+            span_args['allocated_blocks'] = sys.getallocatedblocks() - blocks
+            _record(name, category, started, finished, span_args)
+    traced.__wrapped__ = function
+    return traced
+
+
+def _describe_added(method):
+    def describe(template, value, *args):
+        return '%s %s' % (method, getattr(value, 'title', value)), {
+            'type': getattr(value, 'resource_type', None) or type(value).__name__}
+    return describe
+
+
+def _describe_object(action):
+    def describe(value, *args):
+        name = getattr(value, 'resource_type', None) or type(value).__name__
+        return '%s %s' % (action, name), {'title': getattr(value, 'title', None)}
+    return describe
+
+
+def _install_hooks():
+    import awacs
+    import troposphere
+
+    for method in ('add_resource', 'add_parameter', 'add_output'):
+        setattr(troposphere.Template, method, _traced(
+            getattr(troposphere.Template, method), 'template', _describe_added(method)))
+    base = troposphere.BaseAWSObject
+    base.__init__ = _traced(base.__init__, 'troposphere', _describe_object('init'))
+    base._validate_props = _traced(base._validate_props, 'troposphere',
+                                   _describe_object('validate'))
+    for awacs_base in (awacs.AWSObject, awacs.AWSHelperFn):
+        awacs_base.__init__ = _traced(awacs_base.__init__, 'awacs', _describe_object('init'))
+
+
+def enable():
+    """Turns tracing on, hooking troposphere and awacs"""
+    global _events, _pid
+    if _events is not None and _pid == os.getpid():
+        return
+    if _events is None:
+        _install_hooks()
+    _pid = os.getpid()
+    _events = [{'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+                'args': {'name': os.path.basename(sys.argv[0]) or 'python'}}]
+
+
+def take_events():
+    """Returns the events recorded so far and forgets them"""
+    global _events
+    events = _events or []
+    if _events is not None:
+        _events = []
+    return events
+
+
+def add_events(events):
+    """Merges the events recorded by another process"""
+    if _events is not None and events:
+        _events.extend(events)
+
+
+def write_trace(path, events):
+    """Writes events as a Chrome trace"""
+    import json
+
+    with open(path, 'w') as trace_file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+        trace_file.write('\n')
+
+
+def trace_to(path):
+    """Turns tracing on and writes the trace to path on exit"""
+    global _trace_path
+    if _trace_path is None:
+        import atexit
+
+        enable()
+        started = _now()
+
+        def write():
+            _record(os.path.basename(sys.argv[0]) or 'python', 'run', started, _now(), {})
+            write_trace(_trace_path, take_events())
+        atexit.register(write)
+    _trace_path = path
+
+
+def trace_from_environment():
+    """Turns tracing on when TEMPLATE_TRACE names a trace file"""
+    path = os.environ.get(ENVIRONMENT_VARIABLE)
+    if path:
+        trace_to(path)
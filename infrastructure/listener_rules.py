@@ -0,0 +1,444 @@
+"""
+Plans the listener rules that route requests to the target groups of many
+services, across as many Application Load Balancers as the ELB limits need.
+
+Each route sends requests for a host and/or path pattern to a target. Routes
+are evaluated most specific first, so a route never shadows a more specific
+one: routes for exact hosts come before wildcard hosts, which come before
+routes matching any host, and within those exact paths and longer literal
+paths come first. Routes that cannot overlap (different exact hosts) are
+interleaved hottest first, so busy routes match after fewer evaluations.
+Consecutive routes to the same target and host are merged into one rule,
+up to the condition value limit of a rule.
+
+Routes for a host stay on one load balancer, as do the routes of a target
+(a target group belongs to a single load balancer), and these groups are
+packed first-fit onto load balancers within the per-listener rule and
+per-load balancer target group limits. Routes matching any host are kept on
+the first load balancer, which the default DNS name points at.
+
+Priorities are spaced PRIORITY_GAP apart so later routes can be inserted
+between existing ones. Given the previous plan, the longest run of rules
+whose previous priorities are still in order keeps them, and only the other
+rules get new priorities, so regenerating the plan does not churn every rule
+when a route is added or removed. Groups stay on their previous load
+balancer while it has room.
+
+Stacks adding rules to the same listener each plan theirs within their own
+PRIORITY_RANGES, and can also pass the priorities the others' rendered
+templates use on it as taken, so no two rules share a priority.
+
+Planning is O(n log n) in the number of routes.
+"""
+import argparse
+import bisect
+import heapq
+import json
+import re
+import sys
+from collections import namedtuple
+
+# ELB quotas, see "Quotas for your Application Load Balancers"
+MAX_RULES_PER_LISTENER = 100
+MAX_TARGET_GROUPS_PER_LOAD_BALANCER = 100
+MAX_CONDITION_VALUES = 5
+MAX_PRIORITY = 50000
+
+PRIORITY_GAP = 100
+
+# The priorities each stack's rules take on the first load balancer's
+# listener. Rules of the LoadBalancers stack are evaluated before those of
+# the Services stack.
+PRIORITY_RANGES = {
+    'LoadBalancers': (1, 25000),
+    'Services': (25001, MAX_PRIORITY),
+}
+
+WILDCARDS = re.compile(r'[*?]')
+
+# hotness is a relative request rate, higher routes are evaluated earlier
+Route = namedtuple('Route', 'name target host path hotness')
+
+# A rule forwards requests matching one of its paths (if any) on its host (if
+# any) to target, routes are the names of the routes it was merged from
+Rule = namedtuple('Rule', 'priority target host paths routes')
+
+
+def make_route(name, target=None, host=None, path=None, hotness=0):
+    """Returns a Route, targeting a target named after the route by default"""
+    if not host and not path:
+        raise ValueError('route %r needs a host or a path' % name)
+    return Route(name, target or name, host or None, path or None, hotness)
+
+
+def load_routes(routes):
+    """Returns Routes for a list of Routes or of dicts of their fields"""
+    loaded = []
+    names = set()
+    for route in routes:
+        if not isinstance(route, Route):
+            route = make_route(**route)
+        if route.name in names:
+            raise ValueError('duplicate route %r' % route.name)
+        names.add(route.name)
+        loaded.append(route)
+    return loaded
+
+
+def _literal_length(pattern):
+    return len(WILDCARDS.sub('', pattern)) if pattern else -1
+
+
+def _path_order(route):
+    """Sort key putting more specific paths first, then hotter routes"""
+    path = route.path
+    return (path is None, bool(path and WILDCARDS.search(path)), -_literal_length(path),
+            -route.hotness, route.name)
+
+
+def order_routes(routes):
+    """Returns the routes in the order they must be evaluated in"""
+    exact_hosts = {}
+    other_routes = []
+    for route in routes:
+        if route.host and not WILDCARDS.search(route.host):
+            exact_hosts.setdefault(route.host, []).append(route)
+        else:
+            other_routes.append(route)
+
+    # Routes of different exact hosts never match the same request, so the
+    # hosts are interleaved by the hotness of their next route
+    ordered = []
+    heap = []
+    for host, host_routes in exact_hosts.items():
+        host_routes.sort(key=_path_order)
+        heap.append((-host_routes[0].hotness, host_routes[0].name, host, 0))
+    heapq.heapify(heap)
+    while heap:
+        _, _, host, index = heapq.heappop(heap)
+        host_routes = exact_hosts[host]
+        ordered.append(host_routes[index])
+        if index + 1 < len(host_routes):
+            route = host_routes[index + 1]
+            heapq.heappush(heap, (-route.hotness, route.name, host, index + 1))
+
+    # Wildcard hosts, longest literal first, then routes matching any host
+    other_routes.sort(key=lambda route: (
+        route.host is None, -_literal_length(route.host)) + _path_order(route))
+    return ordered + other_routes
+
+
+def merge_rules(routes):
+    """Merges consecutive routes to the same target and host into unprioritized rules"""
+    rules = []
+    for route in routes:
+        if rules:
+            last = rules[-1]
+            values = len(last.paths) + 1 + (1 if route.host else 0)
+            if (last.target == route.target and last.host == route.host and last.paths
+                    and route.path and values <= MAX_CONDITION_VALUES):
+                rules[-1] = last._replace(paths=last.paths + (route.path,),
+                                          routes=last.routes + (route.name,))
+                continue
+        rules.append(Rule(None, route.target, route.host,
+                          (route.path,) if route.path else (), (route.name,)))
+    return rules
+
+
+class _Groups(object):
+    """Union-find of the routes that must share a load balancer"""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, key):
+        self.parent.setdefault(key, key)
+        while self.parent[key] != key:
+            self.parent[key] = self.parent[self.parent[key]]
+            key = self.parent[key]
+        return key
+
+    def union(self, first, second):
+        self.parent[self.find(first)] = self.find(second)
+
+
+def assign_load_balancers(rules, previous=None, max_rules=MAX_RULES_PER_LISTENER,
+                          max_target_groups=MAX_TARGET_GROUPS_PER_LOAD_BALANCER):
+    """Returns the index of the load balancer each rule goes to"""
+    previous = previous or {}
+    groups = _Groups()
+    for rule in rules:
+        key = ('host', rule.host) if rule.host else ('any', None)
+        groups.union(key, ('target', rule.target))
+        # Routes for any host stay on the first load balancer
+        if not rule.host:
+            groups.union(key, ('first', None))
+
+    members = {}
+    for index, rule in enumerate(rules):
+        members.setdefault(groups.find(('target', rule.target)), []).append(index)
+
+    loads = []
+
+    def fits(load_balancer, rule_count, targets):
+        rule_total, load_targets = loads[load_balancer]
+        return (rule_total + rule_count <= max_rules
+                and len(load_targets | targets) <= max_target_groups)
+
+    def place(load_balancer, indexes, targets):
+        while len(loads) <= load_balancer:
+            loads.append([0, set()])
+        loads[load_balancer][0] += len(indexes)
+        loads[load_balancer][1].update(targets)
+        for index in indexes:
+            assignment[index] = load_balancer
+
+    assignment = [None] * len(rules)
+    pending = []
+    first = groups.find(('first', None)) if ('first', None) in groups.parent else None
+    for root, indexes in members.items():
+        targets = set(rules[index].target for index in indexes)
+        if len(indexes) > max_rules or len(targets) > max_target_groups:
+            raise ValueError('the %d rules and %d targets of host %s do not fit on one '
+                             'load balancer' % (len(indexes), len(targets), ', '.join(
+                                 sorted(set(str(rules[index].host) for index in indexes)))))
+        # Stay where most of the group's routes were
+        was = [previous[name][0] for index in indexes for name in rules[index].routes
+               if name in previous]
+        preferred = 0 if root == first else (max(set(was), key=was.count) if was else None)
+        pending.append((preferred is None, -len(indexes), min(indexes), preferred, indexes,
+                        targets))
+
+    # Groups with a previous load balancer first, then biggest first
+    for _, _, _, preferred, indexes, targets in sorted(pending, key=lambda group: group[:3]):
+        if preferred is not None and (preferred >= len(loads) or fits(
+                preferred, len(indexes), targets)):
+            place(preferred, indexes, targets)
+            continue
+        for load_balancer in range(len(loads)):
+            if fits(load_balancer, len(indexes), targets):
+                place(load_balancer, indexes, targets)
+                break
+        else:
+            place(len(loads), indexes, targets)
+    return assignment
+
+
+def _longest_increasing(values):
+    """Returns the indexes of a longest strictly increasing subsequence of values
+
+    None values are skipped.
+    """
+    tails = []
+    tail_indexes = []
+    parents = {}
+    for index, value in enumerate(values):
+        if value is None:
+            continue
+        position = bisect.bisect_left(tails, value)
+        parents[index] = tail_indexes[position - 1] if position else None
+        if position == len(tails):
+            tails.append(value)
+            tail_indexes.append(index)
+        else:
+            tails[position] = value
+            tail_indexes[position] = index
+    kept = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        kept.append(index)
+        index = parents[index]
+    return kept[::-1]
+
+
+def _spread(count, low, high, taken, bounded=True):
+    """Returns count increasing priorities between low and high, exclusive, or None
+
+    With bounded, the priorities leave as much room before high as between
+    each other, otherwise they may run up to it.
+    """
+    step = min(PRIORITY_GAP, (high - low) // (count + 1) if bounded
+               else (high - 1 - low) // count)
+    if step < 1:
+        return None
+    priorities = []
+    priority = low
+    for offset in range(count):
+        priority = max(priority + 1, low + step * (offset + 1))
+        while priority in taken:
+            priority += 1
+        if priority >= high:
+            return None
+        priorities.append(priority)
+    return priorities
+
+
+def assign_priorities(previous_priorities, first=1, last=MAX_PRIORITY, taken=()):
+    """Returns priorities for rules in evaluation order, given their previous ones
+
+    previous_priorities holds the previous priority of each rule, or None.
+    Priorities are between first and last and never one of taken.
+    """
+    taken = frozenset(taken)
+    count = len(previous_priorities)
+    priorities = [None] * count
+    for index in _longest_increasing(previous_priorities):
+        if first <= previous_priorities[index] <= last and (
+                previous_priorities[index] not in taken):
+            priorities[index] = previous_priorities[index]
+
+    index = 0
+    while index < count:
+        if priorities[index] is not None:
+            index += 1
+            continue
+        end = index
+        while end < count and priorities[end] is None:
+            end += 1
+        low = priorities[index - 1] if index else first - 1
+        high = priorities[end] if end < count else last + 1
+        spread = _spread(end - index, low, high, taken, bounded=end < count)
+        if spread is None:
+            # No room left between the kept priorities, space them all out again
+            spread = _spread(count, first - 1, last + 1, taken, bounded=False)
+            if spread is None:
+                free = [priority for priority in range(first, last + 1)
+                        if priority not in taken]
+                if len(free) < count:
+                    raise ValueError('no room for %d rules between priorities %d and %d' % (
+                        count, first, last))
+                spread = [free[position * len(free) // count] for position in range(count)]
+            return spread
+        priorities[index:end] = spread
+        index = end
+    return priorities
+
+
+class Plan(object):
+    """The rules of each load balancer's listener, in evaluation order"""
+
+    def __init__(self, load_balancers, route_count, previous=None):
+        self.load_balancers = load_balancers
+        self.route_count = route_count
+        self.previous = previous or {}
+
+    def rules(self):
+        """Yields (load balancer index, rule) pairs"""
+        for load_balancer, rules in enumerate(self.load_balancers):
+            for rule in rules:
+                yield load_balancer, rule
+
+    def targets(self, load_balancer):
+        """Returns the targets of a load balancer in the order they are first routed to"""
+        targets = []
+        for rule in self.load_balancers[load_balancer]:
+            if rule.target not in targets:
+                targets.append(rule.target)
+        return targets
+
+    def priorities(self):
+        """Returns the route -> (load balancer, priority) map a later plan keeps stable"""
+        return dict((name, (load_balancer, rule.priority))
+                    for load_balancer, rule in self.rules() for name in rule.routes)
+
+    def stats(self):
+        """Summarizes the plan and what changed since the previous one"""
+        current = self.priorities()
+        moved = sum(1 for name, place in current.items()
+                    if name in self.previous and self.previous[name][0] != place[0])
+        reprioritized = sum(1 for name, place in current.items()
+                            if name in self.previous and tuple(self.previous[name]) != place)
+        return {
+            'routes': self.route_count,
+            'rules': sum(len(rules) for rules in self.load_balancers),
+            'load_balancers': len(self.load_balancers),
+            'target_groups': sum(len(self.targets(index))
+                                 for index in range(len(self.load_balancers))),
+            'moved_routes': moved,
+            'changed_priorities': reprioritized,
+            'new_routes': sum(1 for name in current if name not in self.previous),
+        }
+
+
+def plan_rules(routes, previous=None, max_rules=MAX_RULES_PER_LISTENER,
+               max_target_groups=MAX_TARGET_GROUPS_PER_LOAD_BALANCER,
+               priority_range=(1, MAX_PRIORITY), taken=()):
+    """Plans the listener rules of routes
+
+    previous is the priorities() of the previous plan, to keep stable.
+    Priorities are within priority_range, and taken holds the priorities
+    other stacks use on the first load balancer's listener.
+    """
+    first, last = priority_range
+    previous = previous or {}
+    routes = load_routes(routes)
+    rules = merge_rules(order_routes(routes))
+    assignment = assign_load_balancers(rules, previous, max_rules, max_target_groups)
+
+    load_balancers = [[] for _ in range(max(assignment) + 1 if assignment else 1)]
+    for rule, load_balancer in zip(rules, assignment):
+        load_balancers[load_balancer].append(rule)
+
+    for load_balancer, lb_rules in enumerate(load_balancers):
+        previous_priorities = []
+        for rule in lb_rules:
+            kept = [previous[name][1] for name in rule.routes
+                    if name in previous and previous[name][0] == load_balancer]
+            previous_priorities.append(kept[0] if kept else None)
+        load_balancers[load_balancer] = [
+            rule._replace(priority=priority)
+            for rule, priority in zip(lb_rules, assign_priorities(
+                previous_priorities, first, last, taken if load_balancer == 0 else ()))]
+    return Plan(load_balancers, len(routes), previous)
+
+
+def priorities_from_template(template):
+    """Returns the priorities() of the plan a rendered LoadBalancers template was built from"""
+    priorities = {}
+    for resource in template.get('Resources', {}).values():
+        if resource.get('Type') != 'AWS::ElasticLoadBalancingV2::ListenerRule':
+            continue
+        metadata = resource.get('Metadata', {})
+        for name in metadata.get('Routes', ()):
+            priorities[name] = (metadata.get('LoadBalancer', 0),
+                                int(resource['Properties']['Priority']))
+    return priorities
+
+
+def taken_priorities(template):
+    """Returns the priorities a rendered template's rules use on the first listener"""
+    return set(
+        int(resource['Properties']['Priority'])
+        for resource in template.get('Resources', {}).values()
+        if resource.get('Type') == 'AWS::ElasticLoadBalancingV2::ListenerRule'
+        and resource.get('Metadata', {}).get('LoadBalancer', 0) == 0)
+
+
+def main(argv=None):
+    """Plans the listener rules of a JSON list of routes and prints a summary"""
+    parser = argparse.ArgumentParser(
+        description='Plans the listener rules of a JSON list of routes')
+    parser.add_argument('routes', help='JSON file with a list of routes')
+    parser.add_argument('--previous',
+                        help='previously rendered LoadBalancers template to keep stable')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print every rule')
+    args = parser.parse_args(argv)
+
+    with open(args.routes) as routes_file:
+        routes = json.load(routes_file)
+    previous = None
+    if args.previous:
+        with open(args.previous) as template_file:
+            previous = priorities_from_template(json.load(template_file))
+    plan = plan_rules(routes, previous)
+    if args.verbose:
+        for load_balancer, rule in plan.rules():
+            print('%d %5d %-30s %-30s %s' % (load_balancer, rule.priority, rule.host or '*',
+                                             ','.join(rule.paths) or '*', rule.target))
+    json.dump(plan.stats(), sys.stdout, indent=4, sort_keys=True)
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
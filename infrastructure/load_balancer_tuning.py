@@ -0,0 +1,127 @@
+"""
+Performance settings of the Application Load Balancer and its target groups.
+
+The defaults replace the AWS ones where those hurt deploys: target groups
+drain for 30 seconds rather than 300, ramp new targets up over a slow start
+window instead of sending them their full share of requests the moment they
+register, and health check often enough to notice a failed task in well
+under a minute.
+"""
+from dataclasses import dataclass, fields
+
+ALGORITHMS = ('round_robin', 'least_outstanding_requests', 'weighted_random')
+
+# Cross-zone load balancing of a target group, which otherwise follows the
+# load balancer, where an Application Load Balancer always has it on
+CROSS_ZONE_MODES = ('true', 'false', 'use_load_balancer_configuration')
+
+# The slow start of round_robin target groups, the only ones supporting it
+DEFAULT_SLOW_START = 30
+
+
+class _Tuning(object):
+    """Builds settings from the options of a template"""
+
+    @classmethod
+    def from_options(cls, options):
+        """Returns the settings for None (the defaults), a dict of fields or settings"""
+        if options is None:
+            return cls()
+        if isinstance(options, cls):
+            return options
+        unknown = set(options) - set(option.name for option in fields(cls))
+        if unknown:
+            raise ValueError('unknown %s options %s' % (cls.__name__, ', '.join(sorted(unknown))))
+        return cls(**options)
+
+
+def _check_range(settings, name, low, high):
+    value = getattr(settings, name)
+    if not low <= value <= high:
+        raise ValueError('%s must be between %d and %d, got %r' % (name, low, high, value))
+
+
+@dataclass(frozen=True)
+class LoadBalancerTuning(_Tuning):
+    """Attributes of the Application Load Balancer
+
+    idle_timeout is in seconds and should exceed the keep-alive timeout of
+    the services behind the load balancer.
+    """
+    idle_timeout: int = 60
+    http2: bool = True
+
+    def __post_init__(self):
+        _check_range(self, 'idle_timeout', 1, 4000)
+
+    def attributes(self):
+        """Returns the (key, value) pairs of the load balancer attributes"""
+        return [
+            ('idle_timeout.timeout_seconds', str(self.idle_timeout)),
+            ('routing.http2.enabled', str(self.http2).lower()),
+        ]
+
+
+@dataclass(frozen=True)
+class TargetGroupTuning(_Tuning):
+    """Attributes and health check of a target group
+
+    Times are in seconds; a slow_start of 0 disables it. Slow start only
+    works with round_robin and defaults to DEFAULT_SLOW_START for it and 0
+    otherwise; least_outstanding_requests favours new targets on its own as
+    they have no requests outstanding. cross_zone is one of CROSS_ZONE_MODES,
+    or a bool.
+    """
+    deregistration_delay: int = 30
+    slow_start: int = None
+    algorithm: str = 'round_robin'
+    cross_zone: str = 'use_load_balancer_configuration'
+    health_check_path: str = '/'
+    health_check_interval: int = 10
+    health_check_timeout: int = 5
+    healthy_threshold: int = 2
+    unhealthy_threshold: int = 3
+
+    def __post_init__(self):
+        if self.algorithm not in ALGORITHMS:
+            raise ValueError('unknown load balancing algorithm %r, expected one of %s' % (
+                self.algorithm, ', '.join(ALGORITHMS)))
+        if isinstance(self.cross_zone, bool):
+            object.__setattr__(self, 'cross_zone', str(self.cross_zone).lower())
+        if self.cross_zone not in CROSS_ZONE_MODES:
+            raise ValueError('unknown cross-zone mode %r, expected one of %s' % (
+                self.cross_zone, ', '.join(CROSS_ZONE_MODES)))
+        _check_range(self, 'deregistration_delay', 0, 3600)
+        if self.slow_start is None:
+            object.__setattr__(self, 'slow_start',
+                               DEFAULT_SLOW_START if self.algorithm == 'round_robin' else 0)
+        if self.slow_start:
+            _check_range(self, 'slow_start', 30, 900)
+            if self.algorithm != 'round_robin':
+                raise ValueError('slow start only works with round_robin, not %s' % (
+                    self.algorithm,))
+        _check_range(self, 'health_check_interval', 5, 300)
+        _check_range(self, 'health_check_timeout', 2, 120)
+        if self.health_check_timeout >= self.health_check_interval:
+            raise ValueError('health_check_timeout must be shorter than health_check_interval')
+        _check_range(self, 'healthy_threshold', 2, 10)
+        _check_range(self, 'unhealthy_threshold', 2, 10)
+
+    def attributes(self):
+        """Returns the (key, value) pairs of the target group attributes"""
+        return [
+            ('deregistration_delay.timeout_seconds', str(self.deregistration_delay)),
+            ('slow_start.duration_seconds', str(self.slow_start)),
+            ('load_balancing.algorithm.type', self.algorithm),
+            ('load_balancing.cross_zone.enabled', self.cross_zone),
+        ]
+
+    def health_check(self):
+        """Returns the health check properties of the target group"""
+        return dict(
+            HealthCheckPath=self.health_check_path,
+            HealthCheckIntervalSeconds=self.health_check_interval,
+            HealthCheckTimeoutSeconds=self.health_check_timeout,
+            HealthyThresholdCount=self.healthy_threshold,
+            UnhealthyThresholdCount=self.unhealthy_threshold,
+        )
@@ -0,0 +1,179 @@
+"""
+Streaming serialization of templates.
+
+Template.to_json() builds the whole document as one pretty-printed string
+before it is written. The writers here serialize one resource (or
+parameter, output...) at a time and write each piece as soon as it is
+encoded, so peak memory is bounded by the largest single entry rather than
+the whole document. The pretty-printed JSON is byte-identical to
+to_json(indent=4), compact JSON drops the indentation and uses the C encoder, and
+YAML is written in the same long-form intrinsic function syntax.
+"""
+import argparse
+import json
+import sys
+
+import instrument
+
+FORMATS = ('json', 'yaml')
+
+EXTENSIONS = {'json': '.json', 'yaml': '.yaml'}
+
+INDENT = 4
+
+PRETTY_SEPARATORS = (',', ': ')
+
+COMPACT_SEPARATORS = (',', ':')
+
+# Sections holding one entry per logical ID, streamed entry by entry
+ENTRY_SECTIONS = ('Conditions', 'Mappings', 'Outputs', 'Parameters', 'Resources', 'Rules')
+
+
+def template_sections(template):
+    """Returns the top level sections of a template, as to_json() lays them out
+
+    Unlike Template.to_dict() the resources, parameters... are left as
+    troposphere objects, to be encoded one at a time.
+    """
+    sections = {}
+    if template.description:
+        sections['Description'] = template.description
+    if template.metadata:
+        sections['Metadata'] = template.metadata
+    if template.conditions:
+        sections['Conditions'] = template.conditions
+    if template.mappings:
+        sections['Mappings'] = template.mappings
+    if template.outputs:
+        sections['Outputs'] = template.outputs
+    if template.parameters:
+        sections['Parameters'] = template.parameters
+    if template.version:
+        sections['AWSTemplateFormatVersion'] = template.version
+    if template.transform:
+        sections['Transform'] = template.transform
+    if template.rules:
+        sections['Rules'] = template.rules
+    if template.globals:
+        sections['Globals'] = template.globals
+    sections['Resources'] = template.resources
+    return sections
+
+
+def iter_json(template, compact=False):
+    """Yields the JSON document of a template piece by piece"""
+    from troposphere import encode_to_dict
+
+    if compact:
+        def encode(value, _depth):
+            return json.dumps(encode_to_dict(value), sort_keys=True,
+                              separators=COMPACT_SEPARATORS)
+        newline, member_separator, key_separator = '', ',', ':'
+    else:
+        def encode(value, depth):
+            text = json.dumps(encode_to_dict(value), indent=INDENT, sort_keys=True,
+                              separators=PRETTY_SEPARATORS)
+            return text.replace('\n', '\n' + ' ' * (INDENT * depth))
+        newline, member_separator, key_separator = '\n', ',', ': '
+
+    def indent(depth):
+        return newline + ' ' * (INDENT * depth if newline else 0)
+
+    sections = template_sections(template)
+    yield '{'
+    for section_index, section in enumerate(sorted(sections)):
+        value = sections[section]
+        if section_index:
+            yield member_separator
+        yield indent(1) + json.dumps(section) + key_separator
+        if section in ENTRY_SECTIONS and isinstance(value, dict) and value:
+            yield '{'
+            for entry_index, name in enumerate(sorted(value)):
+                if entry_index:
+                    yield member_separator
+                yield indent(2) + json.dumps(name) + key_separator + encode(value[name], 2)
+            yield indent(1) + '}'
+        else:
+            yield encode(value, 1)
+    yield indent(0) + '}'
+
+
+def iter_yaml(template):
+    """Yields the YAML document of a template piece by piece"""
+    import yaml
+    from troposphere import encode_to_dict
+
+    dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+    def dump(value):
+        return yaml.dump(value, Dumper=dumper, default_flow_style=False)
+
+    sections = template_sections(template)
+    for section in sorted(sections):
+        value = sections[section]
+        if section in ENTRY_SECTIONS and isinstance(value, dict) and value:
+            yield section + ':\n'
+            for name in sorted(value):
+                # Shifting a whole block mapping right keeps it valid YAML
+                entry = dump({name: encode_to_dict(value[name])})
+                yield ''.join('  ' + line for line in entry.splitlines(True))
+        else:
+            yield dump({section: encode_to_dict(value)})
+
+
+def iter_template(template, fmt='json', compact=False):
+    """Yields the serialized template in the given format"""
+    if fmt == 'yaml':
+        return iter_yaml(template)
+    if fmt == 'json':
+        return iter_json(template, compact=compact)
+    raise ValueError('unknown format %r, expected one of %s' % (fmt, ', '.join(FORMATS)))
+
+
+def dumps(template, fmt='json', compact=False):
+    """Serializes a template to a string"""
+    with instrument.span('serialize', 'output', format=fmt):
+        return ''.join(iter_template(template, fmt=fmt, compact=compact)).rstrip('\n')
+
+
+def write_template(template, stream=None, fmt='json', compact=False):
+    """Streams a serialized template to a file object, stdout by default"""
+    stream = sys.stdout if stream is None else stream
+    with instrument.span('serialize', 'output', format=fmt):
+        for chunk in iter_template(template, fmt=fmt, compact=compact):
+            stream.write(chunk)
+        if fmt == 'json':
+            stream.write('\n')
+
+
+class TraceAction(argparse.Action):
+    """Turns tracing on as soon as --trace is parsed, before anything is built"""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        instrument.trace_to(values)
+        setattr(namespace, self.dest, values)
+
+
+def add_output_arguments(parser):
+    """Adds the output options of the template scripts to an argument parser
+
+    Tracing is turned on here when TEMPLATE_TRACE is set, see instrument.py.
+    """
+    instrument.trace_from_environment()
+    parser.add_argument('--format', choices=FORMATS, default='json',
+                        help='format the template is written in (default: json)')
+    parser.add_argument('--compact', action='store_true',
+                        help='write JSON without indentation')
+    parser.add_argument('-o', '--output',
+                        help='file the template is written to (default: stdout)')
+    parser.add_argument('--trace', action=TraceAction, metavar='FILE',
+                        help='write a Chrome trace of generating the template to FILE')
+
+
+def write_from_arguments(template, args):
+    """Writes a template as requested by the options of add_output_arguments"""
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            write_template(template, output_file, fmt=args.format, compact=args.compact)
+    else:
+        write_template(template, fmt=args.format, compact=args.compact)
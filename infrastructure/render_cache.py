@@ -0,0 +1,177 @@
+"""
+An on-disk cache of rendered templates, so stacks whose generator source,
+dependencies and options have not changed are not rebuilt and re-serialized.
+
+Entries are keyed by a hash of the generator source (including the local
+modules it imports), the installed troposphere and awacs versions, the
+builder options, the contents of the files named by FILE_OPTIONS and the
+output format. The least recently used entries are
+evicted once the cache grows past its size cap.
+"""
+import ast
+import functools
+import hashlib
+import json
+import os
+
+from template_diff import file_digest
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+INDEX_FILE = 'index.json'
+
+# Builder options naming templates whose rule priorities the builders read
+FILE_OPTIONS = ('previous_template', 'services_template', 'load_balancers_template')
+
+
+@functools.lru_cache(maxsize=None)
+def package_version(name):
+    """Returns the installed version of a package without importing it"""
+    try:
+        from importlib import metadata
+        return metadata.version(name)
+    except Exception:  # pylint: disable=broad-except
+        return 'unknown'
+
+
+def _local_imports(tree):
+    """Lists the names of the modules in SOURCE_DIR imported by a module"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+    return sorted(
+        name for name in names
+        if os.path.isfile(os.path.join(SOURCE_DIR, name + '.py'))
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def source_hash(module_name):
+    """Hashes the source of a module and of the local modules it imports"""
+    digest = hashlib.sha256()
+    seen = set()
+    pending = [module_name]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        with open(os.path.join(SOURCE_DIR, name + '.py'), 'rb') as source_file:
+            source = source_file.read()
+        digest.update(name.encode('utf-8') + b'\0' + source + b'\0')
+        pending.extend(_local_imports(ast.parse(source)))
+    return digest.hexdigest()
+
+
+def file_hashes(options):
+    """Hashes the contents of the files named by the FILE_OPTIONS of options"""
+    hashes = {}
+    for name in FILE_OPTIONS:
+        path = options.get(name)
+        if path:
+            try:
+                hashes[name] = file_digest(path).hex()
+            except IOError:
+                hashes[name] = None
+    return hashes
+
+
+def cache_key(stack, options, serialization='json'):
+    """Returns the cache key of a stack rendered with the given options and format"""
+    digest = hashlib.sha256()
+    for part in (
+            source_hash(stack),
+            package_version('troposphere'),
+            package_version('awacs'),
+            json.dumps(options, sort_keys=True),
+            json.dumps(file_hashes(options), sort_keys=True),
+            serialization,
+    ):
+        digest.update(part.encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+class RenderCache(object):
+    """A size-capped, least recently used cache of rendered templates"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clock = 0
+        self._entries = {}
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as index_file:
+                index = json.load(index_file)
+        except (IOError, ValueError):
+            return
+        self._clock = index.get('clock', 0)
+        self._entries = dict(
+            (key, (size, used)) for key, (size, used) in index.get('entries', {}).items()
+            if os.path.isfile(self._path(key))
+        )
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _touch(self, key, size):
+        self._clock += 1
+        self._entries[key] = (size, self._clock)
+
+    def get(self, key):
+        """Returns the cached template body of a key, or None on a miss"""
+        if key in self._entries:
+            try:
+                with open(self._path(key)) as entry_file:
+                    body = entry_file.read()
+            except IOError:
+                del self._entries[key]
+            else:
+                self.hits += 1
+                self._touch(key, self._entries[key][0])
+                return body
+        self.misses += 1
+        return None
+
+    def put(self, key, body):
+        """Stores a rendered template body, evicting old entries if needed"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(key), 'w') as entry_file:
+            entry_file.write(body)
+        self._touch(key, len(body.encode('utf-8')))
+        self._evict()
+
+    def _evict(self):
+        total = sum(size for size, _ in self._entries.values())
+        for key in sorted(self._entries, key=lambda key: self._entries[key][1]):
+            if total <= self.max_bytes:
+                break
+            total -= self._entries.pop(key)[0]
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def save(self):
+        """Writes the cache index back to disk"""
+        if not self._entries and not os.path.isdir(self.directory):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, INDEX_FILE), 'w') as index_file:
+            json.dump({'clock': self._clock, 'entries': self._entries}, index_file)
+
+    def stats(self):
+        """Summarizes the hit and miss counts"""
+        lookups = self.hits + self.misses
+        return 'cache: %d hits, %d misses (%.0f%% hit rate), %d evictions' % (
+            self.hits, self.misses, 100.0 * self.hits / lookups if lookups else 0.0,
+            self.evictions)
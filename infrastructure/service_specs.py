@@ -0,0 +1,149 @@
+"""
+The ECS services that Services.py deploys onto the cluster.
+
+A ServiceSpec describes one service: its container, how many tasks it runs,
+where they are placed, the route the load balancer sends to it and how it
+scales. Tasks use bridge networking with dynamic host ports, so any number
+of them fit on a host, and are spread across availability zones and then
+binpacked on memory so hosts fill up before new ones are needed.
+"""
+from dataclasses import dataclass, field, fields
+
+from load_balancer_tuning import TargetGroupTuning
+
+PLACEMENT_STRATEGY_TYPES = ('random', 'spread', 'binpack')
+PLACEMENT_CONSTRAINT_TYPES = ('distinctInstance', 'memberOf')
+
+# Target tracking metric -> predefined metric type
+SCALING_METRICS = {
+    'cpu': 'ECSServiceAverageCPUUtilization',
+    'memory': 'ECSServiceAverageMemoryUtilization',
+    'requests': 'ALBRequestCountPerTarget',
+}
+
+# ECS service limits
+MAX_PLACEMENT_STRATEGIES = 5
+MAX_PLACEMENT_CONSTRAINTS = 10
+
+
+def parse_placement_strategy(strategy):
+    """Returns the (type, field) of a type:field placement strategy, e.g. binpack:memory"""
+    strategy_type, _, strategy_field = strategy.partition(':')
+    if strategy_type not in PLACEMENT_STRATEGY_TYPES:
+        raise ValueError('unknown placement strategy %r, expected one of %s' % (
+            strategy, ', '.join(PLACEMENT_STRATEGY_TYPES)))
+    if (strategy_type == 'random') == bool(strategy_field):
+        raise ValueError('placement strategy %r %s a field' % (
+            strategy, 'takes no' if strategy_type == 'random' else 'needs'))
+    if strategy_type == 'binpack' and strategy_field not in ('cpu', 'memory'):
+        raise ValueError('binpack works on cpu or memory, not %r' % strategy_field)
+    return strategy_type, strategy_field or None
+
+
+def parse_placement_constraint(constraint):
+    """Returns the (type, expression) of distinctInstance or memberOf:<expression>"""
+    constraint_type, _, expression = constraint.partition(':')
+    if constraint_type not in PLACEMENT_CONSTRAINT_TYPES:
+        raise ValueError('unknown placement constraint %r, expected one of %s' % (
+            constraint, ', '.join(PLACEMENT_CONSTRAINT_TYPES)))
+    if (constraint_type == 'memberOf') != bool(expression):
+        raise ValueError('placement constraint %r %s an expression' % (
+            constraint, 'needs' if constraint_type == 'memberOf' else 'takes no'))
+    return constraint_type, expression or None
+
+
+@dataclass(frozen=True)
+class ServiceSpec(object):
+    """An ECS service and its task definition
+
+    cpu is in CPU units and memory, the hard limit, and memory_reservation,
+    the soft limit binpacking uses, are in MiB. A service with a host or
+    path gets a target group and listener rule on the load balancer's
+    listener, with target_group overriding TargetGroupTuning fields. With
+    max_count the service scales between min_count and max_count tasks to
+    keep scaling_metric (cpu, memory or requests per target) at
+    scaling_target.
+    """
+    name: str
+    image: str
+    cpu: int = 256
+    memory: int = 512
+    memory_reservation: int = None
+    container_port: int = 80
+    environment: dict = field(default_factory=dict)
+    desired_count: int = 2
+    host: str = None
+    path: str = None
+    hotness: int = 0
+    target_group: TargetGroupTuning = None
+    health_check_grace_period: int = 60
+    placement_strategies: tuple = ('spread:attribute:ecs.availability-zone', 'binpack:memory')
+    placement_constraints: tuple = ()
+    min_count: int = 1
+    max_count: int = None
+    scaling_metric: str = 'cpu'
+    scaling_target: float = 60.0
+    scale_in_cooldown: int = 300
+    scale_out_cooldown: int = 60
+
+    def __post_init__(self):
+        if self.memory < 4:
+            raise ValueError('memory must be at least 4 MiB, got %r' % self.memory)
+        if self.memory_reservation is not None and not (
+                0 < self.memory_reservation <= self.memory):
+            raise ValueError('memory_reservation must be between 1 and memory, got %r' % (
+                self.memory_reservation,))
+        if self.cpu < 0 or self.desired_count < 0:
+            raise ValueError('cpu and desired_count must not be negative')
+        if len(self.placement_strategies) > MAX_PLACEMENT_STRATEGIES:
+            raise ValueError('at most %d placement strategies are allowed' % (
+                MAX_PLACEMENT_STRATEGIES,))
+        if len(self.placement_constraints) > MAX_PLACEMENT_CONSTRAINTS:
+            raise ValueError('at most %d placement constraints are allowed' % (
+                MAX_PLACEMENT_CONSTRAINTS,))
+        for strategy in self.placement_strategies:
+            parse_placement_strategy(strategy)
+        for constraint in self.placement_constraints:
+            parse_placement_constraint(constraint)
+        if self.max_count is not None:
+            if not 0 <= self.min_count <= self.max_count:
+                raise ValueError('min_count must be between 0 and max_count, got %r' % (
+                    self.min_count,))
+            if self.scaling_metric not in SCALING_METRICS:
+                raise ValueError('unknown scaling metric %r, expected one of %s' % (
+                    self.scaling_metric, ', '.join(sorted(SCALING_METRICS))))
+            if self.scaling_metric == 'requests' and not self.routed:
+                raise ValueError('service %s scales on requests but has no host or path' % (
+                    self.name,))
+        # Lists and objects from JSON manifests
+        object.__setattr__(self, 'placement_strategies', tuple(self.placement_strategies))
+        object.__setattr__(self, 'placement_constraints', tuple(self.placement_constraints))
+        if self.routed or self.target_group is not None:
+            object.__setattr__(self, 'target_group',
+                               TargetGroupTuning.from_options(self.target_group))
+
+    @classmethod
+    def from_options(cls, options):
+        """Returns the ServiceSpec for a dict of fields or a ServiceSpec"""
+        if isinstance(options, cls):
+            return options
+        unknown = set(options) - set(option.name for option in fields(cls))
+        if unknown:
+            raise ValueError('unknown service options %s' % ', '.join(sorted(unknown)))
+        return cls(**options)
+
+    @property
+    def routed(self):
+        """Whether the load balancer routes requests to the service"""
+        return bool(self.host or self.path)
+
+    def route(self):
+        """Returns the listener_rules route of the service"""
+        return {'name': self.name, 'host': self.host, 'path': self.path,
+                'hotness': self.hotness}
+
+
+# The services deployed when none are given
+DEFAULT_SERVICES = (
+    ServiceSpec(name='website', image='public.ecr.aws/nginx/nginx:stable', path='/*'),
+)
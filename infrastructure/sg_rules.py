@@ -0,0 +1,268 @@
+"""
+Compacts the ingress rules of a security group and splits them over as many
+groups as the per-group rule limit needs.
+
+Rules are given as dicts with a protocol (tcp by default, udp, icmp or -1
+for all traffic), ports (a port, a "from-to" range or a list of those) and
+the sources they allow: cidrs (a CIDR or a list of them) or a
+source_security_group. They are planned in passes until nothing changes:
+
+    dedupe    - every (protocol, source, port range) is kept once
+    ports     - overlapping and adjacent port ranges of a source are merged
+    cidrs     - the CIDRs allowed the same ports are collapsed with
+                ipaddress.collapse_addresses, which also drops CIDRs inside
+                others
+    subsumed  - rules whose CIDR and ports are covered by a wider rule, or
+                by an all traffic rule, are dropped
+
+ICMP type and code ranges are only deduplicated. The compacted rules are
+sorted, so the same input always gives the same groups.
+"""
+import argparse
+import ipaddress
+import json
+import sys
+from collections import namedtuple
+
+# EC2 quotas, see "Amazon VPC quotas"
+MAX_RULES_PER_GROUP = 60
+MAX_GROUPS_PER_INTERFACE = 5
+
+PROTOCOLS = ('tcp', 'udp', 'icmp', '-1')
+
+# source is an IPv4Network, an IPv6Network or a security group ID; ports are
+# inclusive and (None, None) for all traffic
+Rule = namedtuple('Rule', 'protocol source from_port to_port')
+
+
+def parse_ports(ports):
+    """Returns the (from, to) ranges of a port, a from-to range or a list of those"""
+    if isinstance(ports, (list, tuple)):
+        return [port_range for item in ports for port_range in parse_ports(item)]
+    if isinstance(ports, int):
+        return [(ports, ports)]
+    low, _, high = str(ports).partition('-')
+    port_range = (int(low), int(high or low))
+    if not 0 <= port_range[0] <= port_range[1] <= 65535:
+        raise ValueError('invalid port range %r' % (ports,))
+    return [port_range]
+
+
+def expand_rules(rules):
+    """Returns the Rules of every source and port range of the given rule dicts"""
+    expanded = []
+    for rule in rules:
+        unknown = set(rule) - {'protocol', 'ports', 'cidrs', 'source_security_group'}
+        if unknown:
+            raise ValueError('unknown security group rule options %s' % (
+                ', '.join(sorted(unknown))))
+        protocol = str(rule.get('protocol', 'tcp'))
+        if protocol not in PROTOCOLS:
+            raise ValueError('unknown protocol %r, expected one of %s' % (
+                protocol, ', '.join(PROTOCOLS)))
+        cidrs = rule.get('cidrs', ())
+        if isinstance(cidrs, str):
+            cidrs = [cidrs]
+        sources = [ipaddress.ip_network(cidr, strict=False) for cidr in cidrs]
+        if rule.get('source_security_group'):
+            sources.append(rule['source_security_group'])
+        if not sources:
+            raise ValueError('security group rule %r allows no sources' % (rule,))
+        if protocol == '-1':
+            port_ranges = [(None, None)]
+        elif 'ports' not in rule:
+            raise ValueError('%s security group rule %r needs ports' % (protocol, rule))
+        elif protocol == 'icmp':
+            # ICMP "ports" are a type and code, -1 for all of them
+            port_ranges = [tuple(rule['ports'])] if isinstance(
+                rule['ports'], (list, tuple)) else [(int(rule['ports']), -1)]
+        else:
+            port_ranges = parse_ports(rule['ports'])
+        expanded.extend(Rule(protocol, source, low, high)
+                        for source in sources for low, high in port_ranges)
+    return expanded
+
+
+def _merge_port_ranges(port_ranges):
+    merged = []
+    for low, high in sorted(port_ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def merge_ports(rules):
+    """Merges overlapping and adjacent port ranges of the same protocol and source"""
+    by_source = {}
+    merged = []
+    for rule in rules:
+        if rule.protocol in ('tcp', 'udp'):
+            by_source.setdefault((rule.protocol, rule.source), []).append(
+                (rule.from_port, rule.to_port))
+        else:
+            merged.append(rule)
+    for (protocol, source), port_ranges in by_source.items():
+        merged.extend(Rule(protocol, source, low, high)
+                      for low, high in _merge_port_ranges(port_ranges))
+    return merged
+
+
+def collapse_cidrs(rules):
+    """Collapses the CIDRs allowed the same protocol and ports"""
+    by_ports = {}
+    collapsed = []
+    for rule in rules:
+        if isinstance(rule.source, str):
+            collapsed.append(rule)
+        else:
+            key = (rule.protocol, rule.from_port, rule.to_port, rule.source.version)
+            by_ports.setdefault(key, []).append(rule.source)
+    for (protocol, low, high, _), networks in by_ports.items():
+        collapsed.extend(Rule(protocol, network, low, high)
+                         for network in ipaddress.collapse_addresses(networks))
+    return collapsed
+
+
+def _covers(outer, inner):
+    if outer.protocol == '-1':
+        return True
+    if outer.protocol != inner.protocol:
+        return False
+    if outer.protocol == 'icmp':
+        return (outer.from_port, outer.to_port) == (inner.from_port, inner.to_port)
+    return outer.from_port <= inner.from_port and inner.to_port <= outer.to_port
+
+
+def drop_subsumed(rules):
+    """Drops the rules another rule of a containing CIDR already allows"""
+    # CIDRs are indexed as (version, prefix length, network address) integers,
+    # so containing CIDRs are found by masking rather than building networks
+    by_network = {}
+    prefixes = {}
+    for rule in rules:
+        if not isinstance(rule.source, str):
+            source = rule.source
+            by_network.setdefault(
+                (source.version, source.prefixlen, int(source.network_address)), []).append(rule)
+            prefixes.setdefault(source.version, set()).add(source.prefixlen)
+    prefixes = dict((version, sorted(lengths, reverse=True))
+                    for version, lengths in prefixes.items())
+
+    kept = []
+    for rule in rules:
+        source = rule.source
+        if isinstance(source, str):
+            kept.append(rule)
+            continue
+        address = int(source.network_address)
+        bits = source.max_prefixlen
+        covered = False
+        # Every indexed CIDR containing the rule's, the rule's own included
+        for prefix in prefixes[source.version]:
+            if prefix > source.prefixlen:
+                continue
+            network = address >> (bits - prefix) << (bits - prefix)
+            for other in by_network.get((source.version, prefix, network), ()):
+                if other != rule and _covers(other, rule):
+                    covered = True
+                    break
+            if covered:
+                break
+        if not covered:
+            kept.append(rule)
+    return kept
+
+
+def _sort_key(rule):
+    source = rule.source
+    if isinstance(source, str):
+        # Security group IDs rank after IPv4 (0) and IPv6 (1) networks, so
+        # their IDs are never compared with network addresses
+        source_key = (3, 0, source)
+    else:
+        source_key = (source.version - 4, int(source.network_address), source.prefixlen)
+    return (PROTOCOLS.index(rule.protocol), source_key,
+            rule.from_port if rule.from_port is not None else -2,
+            rule.to_port if rule.to_port is not None else -2)
+
+
+def compact_rules(rules):
+    """Returns the compacted, sorted Rules allowing the same traffic as rules"""
+    current = sorted(set(rules), key=_sort_key)
+    while True:
+        compacted = sorted(set(drop_subsumed(collapse_cidrs(merge_ports(current)))),
+                           key=_sort_key)
+        if compacted == current:
+            return compacted
+        current = compacted
+
+
+class Plan(object):
+    """The groups of compacted rules and how many rules they replaced"""
+
+    def __init__(self, groups, rule_count):
+        self.groups = groups
+        self.rule_count = rule_count
+
+    def stats(self):
+        """Returns the rule counts before and after planning"""
+        return {
+            'rules_before': self.rule_count,
+            'rules_after': sum(len(group) for group in self.groups),
+            'groups': len(self.groups),
+        }
+
+
+def plan_rules(rules, max_rules=MAX_RULES_PER_GROUP, max_groups=MAX_GROUPS_PER_INTERFACE):
+    """Compacts rule dicts and splits them into groups of at most max_rules rules"""
+    expanded = expand_rules(rules)
+    compacted = compact_rules(expanded)
+    groups = [compacted[index:index + max_rules]
+              for index in range(0, len(compacted), max_rules)] or [[]]
+    if len(groups) > max_groups:
+        raise ValueError('the %d compacted rules need %d security groups, more than the %d '
+                         'an interface can have' % (len(compacted), len(groups), max_groups))
+    return Plan(groups, len(expanded))
+
+
+def rule_properties(rule):
+    """Returns the SecurityGroupRule properties of a Rule"""
+    properties = {'IpProtocol': rule.protocol}
+    if isinstance(rule.source, str):
+        properties['SourceSecurityGroupId'] = rule.source
+    elif rule.source.version == 4:
+        properties['CidrIp'] = str(rule.source)
+    else:
+        properties['CidrIpv6'] = str(rule.source)
+    if rule.protocol != '-1':
+        properties.update(FromPort=rule.from_port, ToPort=rule.to_port)
+    return properties
+
+
+def main(argv=None):
+    """Compacts a JSON list of rules and prints the rule counts"""
+    parser = argparse.ArgumentParser(
+        description='Compacts a JSON list of security group ingress rules')
+    parser.add_argument('rules', help='JSON file with a list of rules')
+    parser.add_argument('--max-rules', type=int, default=MAX_RULES_PER_GROUP,
+                        help='rules per security group (default: %d)' % MAX_RULES_PER_GROUP)
+    parser.add_argument('-v', '--verbose', action='store_true', help='print every rule')
+    args = parser.parse_args(argv)
+
+    with open(args.rules) as rules_file:
+        plan = plan_rules(json.load(rules_file), args.max_rules)
+    if args.verbose:
+        for index, group in enumerate(plan.groups):
+            for rule in group:
+                print('%d %-4s %-43s %s' % (
+                    index, rule.protocol, rule.source, 'all' if rule.from_port is None else
+                    '%s-%s' % (rule.from_port, rule.to_port)))
+    json.dump(plan.stats(), sys.stdout, indent=4, sort_keys=True)
+    print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
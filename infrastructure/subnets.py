@@ -0,0 +1,50 @@
+"""
+Plans the public and private subnets of a VPC, one of each per Availability
+Zone, as non-overlapping blocks of the VPC CIDR.
+
+Subnet i of a kind is the (offset + i)th block of the requested prefix length
+within the VPC range. Blocks are computed with integer arithmetic on the
+network address, rather than by enumerating every candidate subnet, so plans
+for very large address spaces are generated and validated in constant time
+per subnet.
+"""
+import ipaddress
+
+
+def plan_subnets(vpc_cidr, az_count, prefix_length=24, public_offset=10, private_offset=20):
+    """Returns the lists of public and private subnet networks, one per AZ
+
+    With the defaults, a 10.192.0.0/16 VPC gets public subnets from
+    10.192.10.0/24 and private subnets from 10.192.20.0/24 onwards.
+    Raises ValueError when the subnets would not fit in the VPC or overlap.
+    """
+    vpc = ipaddress.ip_network(vpc_cidr)
+    if az_count < 1:
+        raise ValueError('at least one Availability Zone is required, got %d' % az_count)
+    if not vpc.prefixlen <= prefix_length <= vpc.max_prefixlen:
+        raise ValueError('subnet prefix /%d does not fit in VPC %s' % (prefix_length, vpc))
+
+    block_count = 2 ** (prefix_length - vpc.prefixlen)
+    ranges = {
+        'public': (public_offset, public_offset + az_count),
+        'private': (private_offset, private_offset + az_count),
+    }
+    for kind, (first, end) in sorted(ranges.items()):
+        if first < 0 or end > block_count:
+            raise ValueError('%s subnets %d to %d do not fit in the %d /%d blocks of VPC %s' % (
+                kind, first, end - 1, block_count, prefix_length, vpc))
+    if max(public_offset, private_offset) < min(ranges['public'][1], ranges['private'][1]):
+        raise ValueError('public and private subnets overlap, %d AZs need offsets at least '
+                         '%d blocks apart' % (az_count, az_count))
+
+    base = int(vpc.network_address)
+    block_size = 2 ** (vpc.max_prefixlen - prefix_length)
+    network_class = type(vpc)
+
+    def blocks(first):
+        return [
+            network_class((base + (first + index) * block_size, prefix_length))
+            for index in range(az_count)
+        ]
+
+    return blocks(public_offset), blocks(private_offset)
@@ -0,0 +1,348 @@
+"""
+This script compares newly rendered templates with the previous ones,
+resource by resource and property by property, and flags the changes that
+make CloudFormation replace a resource rather than update it in place, so
+downtime shows up before a change set is created.
+
+It takes two templates, or two batch output directories laid out as
+<environment>/<stack>.json (or .yaml), and prints for every environment the
+added, removed and modified resources:
+
+    + ServicesLogGroup          AWS::Logs::LogGroup
+    - OldListenerRule           AWS::ElasticLoadBalancingV2::ListenerRule
+    ~ ECSLaunchConfiguration    AWS::AutoScaling::LaunchConfiguration  REPLACE (UserData)
+    ~ NatGateway1               AWS::EC2::NatGateway  REPLACE (SubnetId via PublicSubnet1)
+
+Templates, then resources, then properties are compared by the digests of
+their canonical JSON, so unchanged templates are skipped without being
+parsed and only changed resources are looked into. Replacements follow the
+REPLACEMENT_PROPERTIES table, and cascade to resources whose replacement
+properties refer to a replaced resource, since its physical ID changes, or
+to a parameter whose default changed. It exits with 1 when a resource
+would be replaced and --fail-on-replacement is set.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+# Resource type -> properties whose change replaces the resource, '*' for all
+# of them. Taken from "Update requires: Replacement" in the resource reference.
+REPLACEMENT_PROPERTIES = {
+    'AWS::ApplicationAutoScaling::ScalableTarget': (
+        'ResourceId', 'ScalableDimension', 'ServiceNamespace'),
+    'AWS::ApplicationAutoScaling::ScalingPolicy': (
+        'PolicyName', 'ResourceId', 'ScalableDimension', 'ScalingTargetId',
+        'ServiceNamespace'),
+    'AWS::AutoScaling::AutoScalingGroup': ('AutoScalingGroupName',),
+    'AWS::AutoScaling::LaunchConfiguration': ('*',),
+    'AWS::AutoScaling::WarmPool': ('AutoScalingGroupName',),
+    'AWS::CloudWatch::Alarm': ('AlarmName',),
+    'AWS::EC2::EIP': ('Domain', 'NetworkBorderGroup'),
+    'AWS::EC2::LaunchTemplate': ('LaunchTemplateName',),
+    'AWS::EC2::NatGateway': (
+        'AllocationId', 'ConnectivityType', 'PrivateIpAddress', 'SubnetId'),
+    'AWS::EC2::Route': (
+        'DestinationCidrBlock', 'DestinationIpv6CidrBlock', 'RouteTableId'),
+    'AWS::EC2::RouteTable': ('VpcId',),
+    'AWS::EC2::SecurityGroup': ('GroupDescription', 'GroupName', 'VpcId'),
+    'AWS::EC2::Subnet': (
+        'AvailabilityZone', 'AvailabilityZoneId', 'CidrBlock', 'Ipv6CidrBlock', 'VpcId'),
+    'AWS::EC2::SubnetRouteTableAssociation': ('SubnetId',),
+    'AWS::EC2::VPC': ('CidrBlock', 'Ipv4IpamPoolId', 'Ipv4NetmaskLength'),
+    'AWS::EC2::VPCEndpoint': ('ServiceName', 'VpcEndpointType', 'VpcId'),
+    'AWS::EC2::VPCGatewayAttachment': ('VpcId',),
+    'AWS::ECS::CapacityProvider': ('AutoScalingGroupProvider.AutoScalingGroupArn', 'Name'),
+    'AWS::ECS::Cluster': ('ClusterName',),
+    'AWS::ECS::ClusterCapacityProviderAssociations': ('Cluster',),
+    'AWS::ECS::Service': (
+        'Cluster', 'DeploymentController', 'LaunchType', 'Role', 'SchedulingStrategy',
+        'ServiceName'),
+    # Every change registers a new revision, which the services then roll out
+    'AWS::ECS::TaskDefinition': ('*',),
+    'AWS::ElasticLoadBalancingV2::Listener': ('LoadBalancerArn',),
+    'AWS::ElasticLoadBalancingV2::ListenerRule': ('ListenerArn',),
+    'AWS::ElasticLoadBalancingV2::LoadBalancer': ('Name', 'Scheme', 'Type'),
+    'AWS::ElasticLoadBalancingV2::TargetGroup': (
+        'IpAddressType', 'Name', 'Port', 'Protocol', 'ProtocolVersion', 'TargetType',
+        'VpcId'),
+    'AWS::IAM::InstanceProfile': ('InstanceProfileName', 'Path'),
+    'AWS::IAM::Role': ('Path', 'RoleName'),
+    'AWS::Logs::LogGroup': ('LogGroupName',),
+}
+
+# Auto Scaling Group properties an AutoScalingReplacingUpdate replaces the group on
+REPLACING_UPDATE_PROPERTIES = (
+    'LaunchConfigurationName', 'LaunchTemplate', 'MixedInstancesPolicy', 'VPCZoneIdentifier',
+)
+
+TEMPLATE_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+
+def digest(value):
+    """Returns the structural hash of a JSON value, equal for equal values"""
+    return hashlib.blake2b(
+        json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8'),
+        digest_size=16).digest()
+
+
+def load_template(path):
+    """Reads a JSON or YAML template"""
+    with open(path) as template_file:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(template_file)
+        return json.load(template_file)
+
+
+def references(value):
+    """Returns the logical IDs a value refers to with Ref, Fn::GetAtt and Fn::Sub"""
+    found = set()
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if len(value) == 1:
+                (key, item), = value.items()
+                if key == 'Ref' and isinstance(item, str):
+                    found.add(item)
+                    continue
+                if key == 'Fn::GetAtt':
+                    found.add(item[0] if isinstance(item, list) else item.split('.')[0])
+                    continue
+                if key == 'Fn::Sub':
+                    body = item[0] if isinstance(item, list) else item
+                    for part in body.split('${')[1:]:
+                        found.add(part.split('}')[0].split('.')[0])
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return found
+
+
+def _property(properties, path):
+    for key in path.split('.'):
+        if not isinstance(properties, dict):
+            return None
+        properties = properties.get(key)
+    return properties
+
+
+def replacement_properties(resource):
+    """Returns the property paths whose change replaces a resource"""
+    paths = REPLACEMENT_PROPERTIES.get(resource.get('Type'), ())
+    replacing = resource.get('UpdatePolicy', {}).get('AutoScalingReplacingUpdate', {})
+    if replacing.get('WillReplace') in (True, 'true'):
+        paths = paths + REPLACING_UPDATE_PROPERTIES
+    return paths
+
+
+class ResourceChange(object):
+    """A resource added, removed or modified between two templates"""
+
+    def __init__(self, name, kind, resource_type, properties=(), replaced_by=()):
+        self.name = name
+        self.kind = kind
+        self.resource_type = resource_type
+        # Changed properties, and the replacement properties among them
+        self.properties = list(properties)
+        self.replaced_by = list(replaced_by)
+
+    @property
+    def replaces(self):
+        return bool(self.replaced_by)
+
+    def describe(self):
+        line = '%s %-30s %s' % ({'added': '+', 'removed': '-', 'modified': '~'}[self.kind],
+                                self.name, self.resource_type)
+        if self.replaced_by:
+            line += '  REPLACE (%s)' % ', '.join(self.replaced_by)
+        elif self.properties:
+            line += '  (%s)' % ', '.join(self.properties)
+        return line
+
+    def to_dict(self):
+        return {'name': self.name, 'kind': self.kind, 'type': self.resource_type,
+                'properties': self.properties, 'replaced_by': self.replaced_by}
+
+
+def diff_templates(old, new):
+    """Returns the ResourceChanges between two template dicts, and the other changed sections"""
+    old_resources = old.get('Resources', {})
+    new_resources = new.get('Resources', {})
+    changes = {}
+    for name in sorted(set(old_resources) | set(new_resources)):
+        if name not in old_resources:
+            changes[name] = ResourceChange(name, 'added', new_resources[name].get('Type'))
+            continue
+        if name not in new_resources:
+            changes[name] = ResourceChange(name, 'removed', old_resources[name].get('Type'))
+            continue
+        before, after = old_resources[name], new_resources[name]
+        if digest(before) == digest(after):
+            continue
+        if before.get('Type') != after.get('Type'):
+            changes[name] = ResourceChange(name, 'modified', after.get('Type'),
+                                           ['Type'], ['Type'])
+            continue
+        old_properties = before.get('Properties', {})
+        new_properties = after.get('Properties', {})
+        changed = [key for key in sorted(set(old_properties) | set(new_properties))
+                   if key not in old_properties or key not in new_properties
+                   or digest(old_properties[key]) != digest(new_properties[key])]
+        # Attributes such as DependsOn, Metadata and UpdatePolicy
+        changed.extend(key for key in sorted(set(before) | set(after))
+                       if key not in ('Type', 'Properties')
+                       and digest(before.get(key)) != digest(after.get(key)))
+        replaced_by = []
+        for path in replacement_properties(after):
+            if path == '*':
+                replaced_by = [key for key in changed if key in old_properties
+                               or key in new_properties]
+                break
+            if digest(_property(old_properties, path)) != digest(
+                    _property(new_properties, path)):
+                replaced_by.append(path)
+        changes[name] = ResourceChange(name, 'modified', after.get('Type'), changed,
+                                       replaced_by)
+
+    # Parameters whose default changed change the properties referring to
+    # them, for stacks deployed without passing the parameter. Their other
+    # keys, such as Description, do not change what is deployed
+    old_parameters = old.get('Parameters', {})
+    changed_parameters = set(
+        name for name, parameter in new.get('Parameters', {}).items()
+        if name in old_parameters
+        and digest(old_parameters[name].get('Default')) != digest(parameter.get('Default')))
+    for name, resource in sorted(new_resources.items()) if changed_parameters else ():
+        if name not in old_resources or old_resources[name].get('Type') != resource.get('Type'):
+            continue
+        paths = replacement_properties(resource)
+        for key, value in sorted(resource.get('Properties', {}).items()):
+            for parameter in sorted(references(value) & changed_parameters):
+                change = changes.setdefault(name, ResourceChange(
+                    name, 'modified', resource.get('Type')))
+                if key not in change.properties:
+                    change.properties.append(key)
+                if '*' in paths or any(path.split('.')[0] == key for path in paths):
+                    change.replaced_by.append('%s via %s' % (key, parameter))
+
+    # A replaced resource gets a new physical ID, so resources whose
+    # replacement properties refer to it are replaced as well
+    replaced = set(name for name, change in changes.items() if change.replaces)
+    pending = list(replaced)
+    dependents = {}
+    for name, resource in new_resources.items():
+        for path in replacement_properties(resource):
+            value = resource.get('Properties', {}) if path == '*' else _property(
+                resource.get('Properties', {}), path)
+            for target in references(value):
+                dependents.setdefault(target, []).append((name, path))
+    while pending:
+        target = pending.pop()
+        for name, path in dependents.get(target, ()):
+            if name not in old_resources:
+                continue
+            change = changes.setdefault(name, ResourceChange(
+                name, 'modified', new_resources[name].get('Type')))
+            change.replaced_by.append('%s via %s' % ('properties' if path == '*' else path,
+                                                     target))
+            if name not in replaced:
+                replaced.add(name)
+                pending.append(name)
+
+    sections = [section for section in ('Parameters', 'Mappings', 'Conditions', 'Outputs')
+                if digest(old.get(section, {})) != digest(new.get(section, {}))]
+    return [changes[name] for name in sorted(changes)], sections
+
+
+def template_files(path):
+    """Returns {(environment, stack): file} for a batch output directory"""
+    files = {}
+    for environment in sorted(os.listdir(path)):
+        directory = os.path.join(path, environment)
+        if not os.path.isdir(directory):
+            continue
+        for file_name in sorted(os.listdir(directory)):
+            stack, extension = os.path.splitext(file_name)
+            if extension in TEMPLATE_EXTENSIONS:
+                files[environment, stack] = os.path.join(directory, file_name)
+    return files
+
+
+def file_digest(path):
+    """Returns the digest of a file's bytes"""
+    with open(path, 'rb') as template_file:
+        return hashlib.blake2b(template_file.read(), digest_size=16).digest()
+
+
+def diff_paths(old_path, new_path):
+    """Yields (environment, stack, changes, sections) for every differing template
+
+    Templates only on one side have every resource added or removed.
+    """
+    if os.path.isdir(old_path) or os.path.isdir(new_path):
+        old_files = template_files(old_path) if os.path.isdir(old_path) else {}
+        new_files = template_files(new_path) if os.path.isdir(new_path) else {}
+    else:
+        key = ('-', os.path.splitext(os.path.basename(new_path))[0])
+        old_files, new_files = {key: old_path}, {key: new_path}
+
+    for key in sorted(set(old_files) | set(new_files)):
+        old_file, new_file = old_files.get(key), new_files.get(key)
+        if old_file and new_file and file_digest(old_file) == file_digest(new_file):
+            continue
+        old = load_template(old_file) if old_file else {}
+        new = load_template(new_file) if new_file else {}
+        changes, sections = diff_templates(old, new)
+        if changes or sections:
+            yield key[0], key[1], changes, sections
+
+
+def main(argv=None):
+    """Prints the resource changes between the previous and the new templates"""
+    parser = argparse.ArgumentParser(
+        description='Compares rendered templates and flags resource replacements')
+    parser.add_argument('old', help='previous template or batch output directory')
+    parser.add_argument('new', help='new template or batch output directory')
+    parser.add_argument('--json', action='store_true', help='print the changes as JSON')
+    parser.add_argument('--fail-on-replacement', action='store_true',
+                        help='exit with 1 when a resource would be replaced')
+    args = parser.parse_args(argv)
+
+    summary = {}
+    replacements = 0
+    results = []
+    for environment, stack, changes, sections in diff_paths(args.old, args.new):
+        counts = summary.setdefault(environment, dict(
+            (kind, 0) for kind in ('added', 'removed', 'modified', 'replaced')))
+        for change in changes:
+            counts[change.kind] += 1
+            counts['replaced'] += change.replaces
+        replacements += sum(change.replaces for change in changes)
+        results.append({'environment': environment, 'stack': stack, 'sections': sections,
+                        'changes': [change.to_dict() for change in changes]})
+        if not args.json:
+            print('%s/%s' % (environment, stack))
+            for change in changes:
+                print('    ' + change.describe())
+            if sections:
+                print('    changed %s' % ', '.join(sections))
+
+    if args.json:
+        json.dump({'templates': results, 'summary': summary}, sys.stdout, indent=4,
+                  sort_keys=True)
+        print()
+    else:
+        for environment, counts in sorted(summary.items()):
+            print('%s: %d added, %d removed, %d modified, %d replaced' % (
+                environment, counts['added'], counts['removed'], counts['modified'],
+                counts['replaced']))
+        if not summary:
+            print('no changes')
+    return 1 if args.fail_on_replacement and replacements else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
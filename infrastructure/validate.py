@@ -0,0 +1,274 @@
+"""
+This script validates rendered templates offline, catching the mistakes that
+would otherwise only show up once CloudFormation rejects the template:
+
+  * Ref, Fn::GetAtt and Fn::Sub variables that do not resolve to a
+    parameter, resource or pseudo parameter
+  * DependsOn, Condition and Fn::FindInMap targets that do not exist
+  * Fn::Select indexes that are out of range
+  * Outputs without a Value
+  * template body size and parameter/resource/output/mapping count limits
+
+Without arguments the default template of every stack is built and
+validated, which makes it cheap enough to run as a pre-commit hook.
+"""
+import argparse
+import json
+import re
+import sys
+
+PSEUDO_PARAMETERS = frozenset((
+    'AWS::AccountId', 'AWS::NotificationARNs', 'AWS::NoValue', 'AWS::Partition',
+    'AWS::Region', 'AWS::StackId', 'AWS::StackName', 'AWS::URLSuffix',
+))
+
+# CloudFormation quotas, see "AWS CloudFormation quotas" in the user guide
+MAX_INLINE_BODY_BYTES = 51200
+MAX_S3_BODY_BYTES = 1024 * 1024
+MAX_RESOURCES = 500
+MAX_PARAMETERS = 200
+MAX_OUTPUTS = 200
+MAX_MAPPINGS = 200
+MAX_LOGICAL_ID_LENGTH = 255
+
+# Fn::GetAZs never returns more zones than the largest region has
+MAX_AZ_COUNT = 6
+
+LOGICAL_ID = re.compile(r'^[A-Za-z0-9]+$')
+
+SUB_VARIABLE = re.compile(r'\$\{([^!}][^}]*)\}')
+
+
+class Validator(object):
+    """Collects the problems found in a single template"""
+
+    def __init__(self, template, body_size=None):
+        self.template = template
+        self.body_size = body_size
+        self.parameters = template.get('Parameters', {})
+        self.resources = template.get('Resources', {})
+        self.mappings = template.get('Mappings', {})
+        self.conditions = template.get('Conditions', {})
+        self.errors = []
+        self.warnings = []
+
+    def error(self, path, message):
+        self.errors.append('%s: %s' % ('.'.join(path), message))
+
+    def warning(self, path, message):
+        self.warnings.append('%s: %s' % ('.'.join(path), message))
+
+    def validate(self):
+        """Runs every check and returns (errors, warnings)"""
+        self._check_limits()
+        for name, resource in self.resources.items():
+            path = ('Resources', name)
+            if not isinstance(resource, dict) or 'Type' not in resource:
+                self.error(path, 'resource has no Type')
+                continue
+            self._check_depends_on(path, name, resource.get('DependsOn'))
+            self._check_condition_name(path + ('Condition',), resource.get('Condition'))
+            for key in ('Properties', 'Metadata', 'CreationPolicy', 'UpdatePolicy'):
+                if key in resource:
+                    self._walk(path + (key,), resource[key])
+        for name, output in self.template.get('Outputs', {}).items():
+            path = ('Outputs', name)
+            if 'Value' not in output:
+                self.error(path, 'output has no Value')
+            self._check_condition_name(path + ('Condition',), output.get('Condition'))
+            self._walk(path, output)
+        for name, condition in self.conditions.items():
+            self._walk(('Conditions', name), condition)
+        return self.errors, self.warnings
+
+    def _check_limits(self):
+        for section, limit in (('Parameters', MAX_PARAMETERS), ('Resources', MAX_RESOURCES),
+                               ('Outputs', MAX_OUTPUTS), ('Mappings', MAX_MAPPINGS)):
+            count = len(self.template.get(section, {}))
+            if count > limit:
+                self.error((section,), '%d entries exceed the limit of %d' % (count, limit))
+            for name in self.template.get(section, {}):
+                if not LOGICAL_ID.match(name) or len(name) > MAX_LOGICAL_ID_LENGTH:
+                    self.error((section, name), 'invalid logical ID')
+        if not self.resources:
+            self.error(('Resources',), 'a template needs at least one resource')
+        if self.body_size is not None:
+            if self.body_size > MAX_S3_BODY_BYTES:
+                self.error(('Template',), 'body of %d bytes exceeds the %d byte limit' % (
+                    self.body_size, MAX_S3_BODY_BYTES))
+            elif self.body_size > MAX_INLINE_BODY_BYTES:
+                self.warning(('Template',), 'body of %d bytes must be uploaded to S3, inline '
+                             'bodies are limited to %d bytes' % (
+                                 self.body_size, MAX_INLINE_BODY_BYTES))
+
+    def _check_depends_on(self, path, name, depends_on):
+        if depends_on is None:
+            return
+        targets = [depends_on] if isinstance(depends_on, str) else depends_on
+        for target in targets:
+            if target == name:
+                self.error(path + ('DependsOn',), 'resource depends on itself')
+            elif target not in self.resources:
+                self.error(path + ('DependsOn',), 'unknown resource %r' % target)
+
+    def _check_condition_name(self, path, condition):
+        if condition is not None and condition not in self.conditions:
+            self.error(path, 'unknown condition %r' % condition)
+
+    def _check_ref(self, path, target):
+        if not isinstance(target, str):
+            self.error(path, 'Ref target must be a string')
+        elif (target not in self.parameters and target not in self.resources
+              and target not in PSEUDO_PARAMETERS):
+            self.error(path, 'Ref to unknown parameter or resource %r' % target)
+
+    def _check_get_att(self, path, value):
+        if isinstance(value, str):
+            value = value.split('.', 1)
+        if not isinstance(value, list) or len(value) != 2:
+            self.error(path, 'Fn::GetAtt takes a resource name and an attribute')
+        elif value[0] not in self.resources:
+            self.error(path, 'Fn::GetAtt of unknown resource %r' % value[0])
+
+    def _check_sub(self, path, value):
+        if isinstance(value, list):
+            if len(value) != 2 or not isinstance(value[1], dict):
+                self.error(path, 'Fn::Sub takes a string and a map of variables')
+                return
+            text, variables = value
+            self._walk(path, variables)
+        else:
+            text, variables = value, {}
+        if not isinstance(text, str):
+            return
+        for variable in SUB_VARIABLE.findall(text):
+            if variable in variables:
+                continue
+            if '.' in variable and variable not in PSEUDO_PARAMETERS:
+                self._check_get_att(path, variable)
+            else:
+                self._check_ref(path, variable)
+
+    def _check_find_in_map(self, path, value):
+        if not isinstance(value, list) or len(value) != 3:
+            self.error(path, 'Fn::FindInMap takes a map name and two keys')
+            return
+        name, top_key, second_key = value
+        if isinstance(name, str):
+            if name not in self.mappings:
+                self.error(path, 'Fn::FindInMap of unknown mapping %r' % name)
+            elif isinstance(top_key, str):
+                if top_key not in self.mappings[name]:
+                    self.error(path, 'mapping %r has no key %r' % (name, top_key))
+                elif (isinstance(second_key, str)
+                      and second_key not in self.mappings[name][top_key]):
+                    self.error(path, 'mapping %r has no key %r under %r' % (
+                        name, second_key, top_key))
+
+    def _check_select(self, path, value):
+        if not isinstance(value, list) or len(value) != 2:
+            self.error(path, 'Fn::Select takes an index and a list')
+            return
+        index, items = value
+        if isinstance(index, dict):
+            return
+        try:
+            index = int(index)
+        except (TypeError, ValueError):
+            self.error(path, 'Fn::Select index %r is not an integer' % (index,))
+            return
+        if index < 0:
+            self.error(path, 'Fn::Select index %d is negative' % index)
+        elif isinstance(items, list) and index >= len(items):
+            self.error(path, 'Fn::Select index %d is out of range for %d items' % (
+                index, len(items)))
+        elif isinstance(items, dict) and 'Fn::GetAZs' in items and index >= MAX_AZ_COUNT:
+            self.error(path, 'Fn::Select index %d exceeds the Availability Zones of '
+                             'any region' % index)
+        elif (isinstance(items, dict) and isinstance(items.get('Fn::Cidr'), list)
+              and len(items['Fn::Cidr']) == 3 and isinstance(items['Fn::Cidr'][1], int)
+              and index >= items['Fn::Cidr'][1]):
+            self.error(path, 'Fn::Select index %d is out of range for %d Fn::Cidr blocks' % (
+                index, items['Fn::Cidr'][1]))
+
+    def _walk(self, path, value):
+        if isinstance(value, list):
+            for index, item in enumerate(value):
+                self._walk(path + (str(index),), item)
+            return
+        if not isinstance(value, dict):
+            return
+        if len(value) == 1:
+            function, argument = next(iter(value.items()))
+            if function == 'Ref':
+                self._check_ref(path + ('Ref',), argument)
+                return
+            if function == 'Fn::GetAtt':
+                self._check_get_att(path + (function,), argument)
+                return
+            if function == 'Fn::Sub':
+                self._check_sub(path + (function,), argument)
+                return
+            if function == 'Fn::FindInMap':
+                self._check_find_in_map(path + (function,), argument)
+            elif function == 'Fn::Select':
+                self._check_select(path + (function,), argument)
+            elif function == 'Fn::If' and isinstance(argument, list) and argument:
+                self._check_condition_name(path + (function,), argument[0])
+            elif function == 'Condition':
+                self._check_condition_name(path + (function,), argument)
+        for key, item in value.items():
+            self._walk(path + (key,), item)
+
+
+def validate_template(template, body_size=None):
+    """Validates a template dict and returns its (errors, warnings)"""
+    return Validator(template, body_size).validate()
+
+
+def validate_body(body, fmt='json'):
+    """Validates a serialized template and returns its (errors, warnings)"""
+    if fmt == 'yaml':
+        import yaml
+        template = yaml.safe_load(body)
+    else:
+        template = json.loads(body)
+    return validate_template(template, len(body.encode('utf-8')))
+
+
+def report(name, errors, warnings, stream=sys.stderr):
+    """Prints the problems found in a template"""
+    for warning in warnings:
+        print('%s: warning: %s' % (name, warning), file=stream)
+    for error in errors:
+        print('%s: error: %s' % (name, error), file=stream)
+
+
+def main(argv=None):
+    """Validates templates"""
+    parser = argparse.ArgumentParser(description='Validates rendered templates offline')
+    parser.add_argument('templates', nargs='*',
+                        help='JSON or YAML templates to validate (default: build and '
+                             'validate the default template of every stack)')
+    args = parser.parse_args(argv)
+
+    failed = False
+    if args.templates:
+        for path in args.templates:
+            with open(path) as template_file:
+                body = template_file.read()
+            errors, warnings = validate_body(
+                body, 'yaml' if path.endswith(('.yaml', '.yml')) else 'json')
+            report(path, errors, warnings)
+            failed = failed or bool(errors)
+    else:
+        import batch
+        for stack in batch.STACKS:
+            errors, warnings = validate_body(batch.render(stack, {}))
+            report(stack, errors, warnings)
+            failed = failed or bool(errors)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Describes how the outputs of one stack feed the parameters of another, so
+that the nested master template and the stacks themselves (when they use
+exports instead of parameters) wire them up the same way.
+"""
+
+# Consumer stack -> {parameter: (producer stack, producer output)}
+INPUTS = {
+    'SecurityGroups': {
+        'VPC': ('VPC', 'VPC'),
+    },
+    'LoadBalancers': {
+        'VPC': ('VPC', 'VPC'),
+        'Subnets': ('VPC', 'PublicSubnets'),
+        'SecurityGroups': ('SecurityGroups', 'LoadBalancerSecurityGroups'),
+    },
+    'ECSCluster': {
+        'VPC': ('VPC', 'VPC'),
+        'Subnets': ('VPC', 'PrivateSubnets'),
+        'SecurityGroup': ('SecurityGroups', 'ECSHostSecurityGroup'),
+    },
+    'Services': {
+        'Cluster': ('ECSCluster', 'Cluster'),
+        'Listener': ('LoadBalancers', 'Listener'),
+        'VPC': ('VPC', 'VPC'),
+    },
+}
+
+
+def export_name(output):
+    """Returns the name an output is exported as, prefixed by the environment"""
+    from troposphere import Sub
+    return Sub('${EnvironmentName}-%s' % output)
+
+
+def add_input(template, stack, parameter, exports=False):
+    """Adds an input parameter of a stack and returns the value to use for it
+
+    With exports the parameter is not added, its value is imported from the
+    export of the stack producing it instead. List parameters are imported
+    from comma separated exports.
+    """
+    from troposphere import ImportValue, Ref, Split
+
+    if not exports:
+        return Ref(template.add_parameter(parameter))
+    _, output = INPUTS[stack][parameter.title]
+    value = ImportValue(export_name(output))
+    if parameter.properties['Type'].startswith('List<'):
+        value = Split(',', value)
+    return value
+
+
+def add_output(template, output, exports=False):
+    """Adds an output, exporting it under the environment's name with exports"""
+    from troposphere import Export
+
+    if exports:
+        output.Export = Export(export_name(output.title))
+    return template.add_output(output)